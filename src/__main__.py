@@ -12,8 +12,10 @@ import camera_system
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Camera System settings.')
+    parser.add_argument('--detect_worker', action='store_true',
+                        help='物体検出を別プロセスで行う')
 
     args = parser.parse_args()
 
-    cs = camera_system.CameraSystem()
+    cs = camera_system.CameraSystem(detect_worker=args.detect_worker)
     cs.start()
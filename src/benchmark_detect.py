@@ -0,0 +1,421 @@
+"""物体検出のベンチマークを行うモジュール.
+
+推論エンジン(バックエンド)と入力画像サイズの組み合わせごとに
+別プロセスでDetectObject(opencv-dnnはtorchを使わないDnnDetectObject)を実行し、
+以下を計測してJSONで出力する。
+    - コールドスタート時間(import, モデルの読み込み, 初回の検出)
+    - 定常状態のレイテンシの分布, スループット
+    - ピークメモリ使用量(RSS), スレッド数
+    - ステージごとの処理時間
+スレッド数の設定を変えて計測し、最速の設定を探すこともできる(--sweep_threads)。
+
+    $ make benchmark
+    $ poetry run python src/benchmark_detect.py --img_dir fig_image -o out.json
+
+@author: kawanoichi
+"""
+
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import cv2
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR_PATH = os.path.dirname(script_dir)
+YOLO_PATH = Path(PROJECT_DIR_PATH) / "yolo"
+TEST_IMG_DIR = Path(PROJECT_DIR_PATH) / "tests" / "testdata" / "img"
+
+# バックエンド名: (重みファイルの拡張子, 検出クラス(モジュール名, クラス名), 検出クラスの引数)
+BACKENDS = {
+    "pytorch": (".pt", ("detect_object", "DetectObject"), {}),
+    "pytorch-int8": (".pt", ("detect_object", "DetectObject"),
+                     {"quantize": True}),
+    "pytorch-freeze": (".pt", ("detect_object", "DetectObject"),
+                       {"optimize": "freeze"}),
+    "torchscript": (".torchscript", ("detect_object", "DetectObject"), {}),
+    "onnxruntime": (".onnx", ("detect_object", "DetectObject"), {}),
+    "opencv-dnn": (".onnx", ("dnn_detect_object", "DnnDetectObject"), {}),
+}
+
+
+def peak_rss_mb():
+    """プロセスのピークメモリ使用量(RSS)[MB]を返す(計測できない場合はNone)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト, macOSはバイト単位
+    return rss / 2 ** 20 if sys.platform == "darwin" else rss / 2 ** 10
+
+
+def thread_count() -> int:
+    """プロセスのスレッド数を返す(psutilがない場合はPythonのスレッド数)."""
+    try:
+        import psutil
+    except ImportError:
+        return threading.active_count()
+    return psutil.Process().num_threads()
+
+
+def latency_stats(times: list) -> dict:
+    """レイテンシ[s]の分布を集計する."""
+    times = np.array(times)
+    return {"count": len(times),
+            "mean": float(times.mean()),
+            "min": float(times.min()),
+            "p50": float(np.percentile(times, 50)),
+            "p95": float(np.percentile(times, 95)),
+            "max": float(times.max())}
+
+
+def load_images(img_dirs: list, size=None) -> list:
+    """ベンチマークに使う画像をPNGのバイト列で読み込む.
+
+    Args:
+        img_dirs(list): 画像(*.png)を格納したディレクトリのリスト
+        size(tuple): 画像を縮小/拡大するサイズ(幅, 高さ). Noneの場合、元のサイズ
+
+    Returns:
+        list: (画像名, PNGのバイト列)のリスト
+    """
+    imgs = []
+    for img_dir in img_dirs:
+        for path in sorted(Path(img_dir).glob("*.png")):
+            img = cv2.imread(str(path))
+            if img is None:
+                continue
+            if size is not None:
+                img = cv2.resize(img, size)
+            imgs.append((path.name, cv2.imencode(".png", img)[1].tobytes()))
+    return imgs
+
+
+def benchmark(backend: str,
+              weights: str,
+              label_data: str,
+              img_dirs: list,
+              size=None,
+              repeat=5,
+              options=None) -> dict:
+    """1つのバックエンド, 入力サイズの組み合わせでベンチマークを行う.
+
+    コールドスタート時間を計測するため、新しいプロセスで呼び出す。
+
+    Args:
+        backend(str): バックエンド名(BACKENDSのキー)
+        weights(str): 重みファイルパス
+        label_data(str): ラベルを記述したファイルパス
+        img_dirs(list): 画像(*.png)を格納したディレクトリのリスト
+        size(tuple): 入力画像のサイズ(幅, 高さ). Noneの場合、元のサイズ
+        repeat(int): 定常状態の計測で全画像を検出する回数
+        options(dict): 検出クラスに渡す追加の引数(スレッド数など)
+
+    Returns:
+        dict: 計測結果
+              torchを使わないバックエンドではtorch_threadsはNone,
+              ピークメモリ使用量を計測できない場合はpeak_rss_mbはNone,
+              ステージごとの処理時間は空
+    """
+    imgs = load_images(img_dirs, size)
+    if not imgs:
+        raise FileNotFoundError(f"no images found in {img_dirs}")
+
+    _, (module, name), kwargs = BACKENDS[backend]
+    t0 = time.perf_counter()
+    detector_class = getattr(importlib.import_module(module), name)
+    import_time = time.perf_counter() - t0
+
+    kwargs = dict(kwargs, **(options or {}))
+    if kwargs.get("quantize"):
+        # ベンチマークの画像で較正する
+        kwargs["calib_imgs"] = [p for img_dir in img_dirs
+                                for p in sorted(Path(img_dir).glob("*.png"))]
+    d = detector_class(weights, label_data, **kwargs)
+
+    t = time.perf_counter()
+    d.load_model()
+    load_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    d.detect_object(imgs[0][1])
+    first_time = time.perf_counter() - t
+    cold_start = time.perf_counter() - t0
+
+    # 定常状態
+    profiler = getattr(d, "profiler", None)  # DnnDetectObjectは持たない
+    if profiler is not None:
+        profiler.reset()
+    times = []
+    t = time.perf_counter()
+    for _ in range(repeat):
+        for _, img in imgs:
+            t_img = time.perf_counter()
+            d.detect_object(img)
+            times.append(time.perf_counter() - t_img)
+    total_time = time.perf_counter() - t
+
+    # torchを使わないバックエンドではimportしない
+    torch_imported = "torch" in sys.modules
+    torch_threads = None
+    if torch_imported:
+        import torch
+        torch_threads = [torch.get_num_threads(),
+                         torch.get_num_interop_threads()]
+
+    return {"backend": backend,
+            "weights": str(weights),
+            "input_size": list(size) if size else "original",
+            "images": len(imgs),
+            "options": options or {},
+            "torch_imported": torch_imported,
+            "torch_threads": torch_threads,
+            "cold_start": {"import": import_time,
+                           "load": load_time,
+                           "first_detect": first_time,
+                           "total": cold_start},
+            "latency": latency_stats(times),
+            "throughput": len(times) / total_time,
+            "peak_rss_mb": peak_rss_mb(),
+            "threads": thread_count(),
+            "stages": profiler.summary() if profiler is not None else {}}
+
+
+def available_backends(weights: str) -> dict:
+    """利用可能なバックエンドと重みファイルパスを返す.
+
+    .ptと同じ名前の.torchscript, .onnxがあればそれらも対象にする。
+
+    Args:
+        weights(str): 重みファイルパス(.pt)
+
+    Returns:
+        dict: キー: バックエンド名, 値: 重みファイルパス
+    """
+    backends = {}
+    for backend, (suffix, _, _) in BACKENDS.items():
+        path = Path(weights).with_suffix(suffix)
+        if not path.exists():
+            continue
+        if suffix == ".onnx" and backend == "onnxruntime":
+            try:
+                import onnxruntime  # noqa
+            except ImportError:
+                continue
+        backends[backend] = str(path)
+    return backends
+
+
+def run_benchmarks(weights=YOLO_PATH/"learned_fig_weight_ver2.pt",
+                   label_data=YOLO_PATH/"fig_label.yaml",
+                   img_dirs=(TEST_IMG_DIR,),
+                   backends=None,
+                   sizes=(None,),
+                   repeat=5) -> dict:
+    """バックエンドと入力サイズの全ての組み合わせでベンチマークを行う.
+
+    Args:
+        weights(str): 重みファイルパス(.pt)
+        label_data(str): ラベルを記述したファイルパス
+        img_dirs(list): 画像(*.png)を格納したディレクトリのリスト
+        backends(list): 計測するバックエンド名. Noneの場合、利用可能な全て
+        sizes(list): 入力画像のサイズ(幅, 高さ)のリスト. Noneは元のサイズ
+        repeat(int): 定常状態の計測で全画像を検出する回数
+
+    Returns:
+        dict: 実行環境と計測結果
+    """
+    candidates = available_backends(weights)
+    if backends is not None:
+        candidates = {b: candidates[b] for b in backends if b in candidates}
+
+    results = []
+    for backend, path in candidates.items():
+        for size in sizes:
+            results.append(run_isolated(backend, path, label_data, img_dirs,
+                                        size, repeat))
+    return make_report(results)
+
+
+def run_isolated(backend: str,
+                 weights: str,
+                 label_data: str,
+                 img_dirs: list,
+                 size=None,
+                 repeat=5,
+                 options=None) -> dict:
+    """新しいプロセスでbenchmark()を実行する.
+
+    コールドスタート, メモリ使用量, スレッド設定が他の計測の影響を受けないようにする。
+    引数はbenchmark()と同じ。
+
+    Returns:
+        dict: 計測結果. 失敗した場合はエラー内容
+    """
+    print(f"benchmark: {backend} {size or 'original'} {options or ''}")
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        try:
+            return pool.apply(benchmark,
+                              (backend, str(weights), str(label_data),
+                               [str(d) for d in img_dirs], size, repeat,
+                               options))
+        except Exception as e:
+            print("Error:", e)
+            return {"backend": backend,
+                    "input_size": list(size) if size else "original",
+                    "options": options or {},
+                    "error": str(e)}
+
+
+def sweep_threads(weights=YOLO_PATH/"learned_fig_weight_ver2.pt",
+                  label_data=YOLO_PATH/"fig_label.yaml",
+                  img_dirs=(TEST_IMG_DIR,),
+                  backend="pytorch",
+                  reserved_cores=0,
+                  size=None,
+                  repeat=3) -> dict:
+    """スレッド数の組み合わせを計測し、最も速い設定を探す.
+
+    演算内並列スレッド数は1から使用可能なコア数(reserved_coresを除く)まで2倍ずつ,
+    演算間並列スレッド数は1, 2を試す。
+
+    Args:
+        weights(str): 重みファイルパス(.pt)
+        label_data(str): ラベルを記述したファイルパス
+        img_dirs(list): 画像(*.png)を格納したディレクトリのリスト
+        backend(str): 計測するバックエンド名
+        reserved_cores(int): 推論に使わずに残しておくコア数
+        size(tuple): 入力画像のサイズ(幅, 高さ). Noneの場合、元のサイズ
+        repeat(int): 定常状態の計測で全画像を検出する回数
+
+    Returns:
+        dict: 実行環境と計測結果. "best"に最もレイテンシ(p50)が小さい設定
+    """
+    path = available_backends(weights).get(backend)
+    if path is None:
+        raise FileNotFoundError(f"backend '{backend}' is not available")
+
+    if hasattr(os, "sched_getaffinity"):
+        n_cpus = len(os.sched_getaffinity(0))
+    else:
+        n_cpus = os.cpu_count()
+    max_threads = max(1, n_cpus - reserved_cores)
+    intra = sorted({min(2 ** i, max_threads)
+                    for i in range(max_threads.bit_length() + 1)})
+
+    results = [run_isolated(backend, path, label_data, img_dirs, size,
+                            repeat, {"intra_op_threads": n,
+                                     "inter_op_threads": m})
+               for n in intra for m in (1, 2)]
+    report = make_report(results)
+    succeeded = [r for r in results if "error" not in r]
+    report["best"] = min(succeeded, key=lambda r: r["latency"]["p50"],
+                         default=None)
+    return report
+
+
+def make_report(results: list) -> dict:
+    """計測結果に実行環境の情報を付ける."""
+    return {"date": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "results": results}
+
+
+def git_commit() -> str:
+    """現在のコミットハッシュを返す(取得できない場合はNone)."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=PROJECT_DIR_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_results(report: dict) -> None:
+    """計測結果を表形式で表示する."""
+    print(f"{'backend':>14}{'size':>10}{'cold[s]':>9}{'p50[ms]':>9}"
+          f"{'p95[ms]':>9}{'img/s':>7}{'RSS[MB]':>9}{'threads':>8}"
+          f"{'intra/inter':>12}")
+    for r in report["results"]:
+        size = "x".join(map(str, r["input_size"])) \
+            if isinstance(r["input_size"], list) else r["input_size"]
+        if "error" in r:
+            print(f"{r['backend']:>14}{size:>10}  Error: {r['error']}")
+            continue
+        torch_threads = "/".join(map(str, r["torch_threads"])) \
+            if r["torch_threads"] else "-"
+        rss = "n/a" if r["peak_rss_mb"] is None \
+            else f"{r['peak_rss_mb']:.0f}"
+        print(f"{r['backend']:>14}{size:>10}"
+              f"{r['cold_start']['total']:>9.2f}"
+              f"{r['latency']['p50'] * 1000:>9.1f}"
+              f"{r['latency']['p95'] * 1000:>9.1f}"
+              f"{r['throughput']:>7.1f}"
+              f"{rss:>9}{r['threads']:>8}"
+              f"{torch_threads:>12}")
+    if report.get("best"):
+        best = report["best"]
+        print("best:", best["options"],
+              f"p50 {best['latency']['p50'] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    """作業用.
+    $ poetry run python src/benchmark_detect.py -o benchmark.json
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="物体検出のベンチマーク")
+    parser.add_argument("-wpath", "--weights", type=str,
+                        default=YOLO_PATH/'learned_fig_weight_ver2.pt',
+                        help='重みファイルパス(.pt). 同名の.onnx, .torchscriptも計測する')
+    parser.add_argument("-label", "--label_data", type=str,
+                        default=YOLO_PATH/'fig_label.yaml',
+                        help='ラベルを記述したファイルパス')
+    parser.add_argument("--img_dir", type=str, nargs="+",
+                        default=[TEST_IMG_DIR], help='画像のディレクトリ')
+    parser.add_argument("--backends", type=str, nargs="+", default=None,
+                        choices=list(BACKENDS), help='計測するバックエンド')
+    parser.add_argument("--sizes", type=str, nargs="+", default=["original"],
+                        help='入力画像のサイズ(例: 640x480). originalは元のサイズ')
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help='定常状態の計測で全画像を検出する回数')
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help='結果のJSONの保存先')
+    parser.add_argument("--sweep_threads", action="store_true",
+                        help='スレッド数の組み合わせを計測して最速の設定を探す')
+    parser.add_argument("--reserved_cores", type=int, default=0,
+                        help='スレッド数の探索で推論に使わずに残しておくコア数')
+    args = parser.parse_args()
+
+    sizes = [None if s == "original" else tuple(map(int, s.split("x")))
+             for s in args.sizes]
+    if args.sweep_threads:
+        report = sweep_threads(args.weights, args.label_data, args.img_dir,
+                               (args.backends or ["pytorch"])[0],
+                               args.reserved_cores, sizes[0], args.repeat)
+    else:
+        report = run_benchmarks(args.weights, args.label_data, args.img_dir,
+                                args.backends, sizes, args.repeat)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print("saved:", args.output)
@@ -0,0 +1,129 @@
+"""NMSのマイクロベンチマークを行うモジュール.
+
+画像ごとの推論結果(NMS前の予測)を記録し、以下のNMSの処理時間を比較する。
+    - torchvision: torchvision.ops.nmsを使う従来の処理
+    - fast: 候補が少ない場合の軽量な処理(non_max_suppressionの既定)
+検出層で信頼度閾値未満のセルを省いた候補(DetectObjectの既定)についても計測する。
+
+    $ poetry run python src/benchmark_nms.py --img_dir fig_image
+    $ poetry run python src/benchmark_nms.py --save preds.pt  # 記録した予測を保存
+    $ poetry run python src/benchmark_nms.py --load preds.pt
+
+@author: kawanoichi
+"""
+
+import json
+import time
+import numpy as np
+import torch
+
+from benchmark_detect import TEST_IMG_DIR, latency_stats, load_images
+from detect_object import DetectObject
+from image_processing import ImageProcessing
+from utils.general import non_max_suppression
+
+# 計測する処理: non_max_suppressionの引数
+NMS_METHODS = {
+    "torchvision": {"fast_max": 0},
+    "fast": {},
+}
+
+
+def record_predictions(imgs: list, **kwargs) -> dict:
+    """画像ごとにNMS前の予測を記録する.
+
+    Args:
+        imgs(list): 画像(PNGなどのバイト列, BGR画像, 画像パス)のリスト
+        kwargs: DetectObjectの引数
+
+    Returns:
+        dict: "dense": 全セルの予測(1, セル数, 5 + クラス数)のリスト
+              "gated": 信頼度閾値を超えた候補[(候補数, 5 + クラス数)]のリスト
+    """
+    preds = {}
+    for key, gated in (("dense", False), ("gated", True)):
+        d = DetectObject(gated_decode=gated, **kwargs)
+        model = d.load_model()
+        preds[key] = []
+        with torch.inference_mode():
+            for img in imgs:
+                img = d.preprocess(ImageProcessing.load_img(img), model)
+                preds[key].append(model(img[None])[0])
+    return preds
+
+
+def benchmark_nms(preds: list,
+                  conf_thres=0.6,
+                  iou_thres=0.45,
+                  max_det=10,
+                  repeat=100) -> dict:
+    """NMSの処理時間を計測する.
+
+    Args:
+        preds(list): record_predictionsで記録した予測のリスト
+        conf_thres(float): 信頼度閾値
+        iou_thres(float): NMS IOU 閾値
+        max_det(int): 最大検出数
+        repeat(int): 予測ごとの繰り返し回数
+
+    Returns:
+        dict: キー: 処理名, 値: 処理時間[s]の分布と検出結果が一致したかどうか
+    """
+    results = {}
+    expected = None
+    for name, kwargs in NMS_METHODS.items():
+        times, outputs = [], []
+        with torch.inference_mode():
+            for pred in preds:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    out = non_max_suppression(pred, conf_thres, iou_thres,
+                                              max_det=max_det, **kwargs)
+                    times.append(time.perf_counter() - start)
+                outputs.append(out[0])
+        if expected is None:
+            expected = outputs
+        results[name] = {
+            "latency": latency_stats(times),
+            "matches": all(torch.allclose(a, b) if a.shape == b.shape
+                           else False for a, b in zip(outputs, expected))}
+    results["candidates"] = float(np.mean(
+        [int((p[0][..., 4] > conf_thres).sum()) for p in preds]))
+    return results
+
+
+if __name__ == '__main__':
+    """作業用.
+    $ poetry run python src/benchmark_nms.py
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NMSのマイクロベンチマーク")
+    parser.add_argument("-wpath", "--weights", type=str, default=None,
+                        help='重みファイルパス')
+    parser.add_argument("-label", "--label_data", type=str, default=None,
+                        help='ラベルを記述したファイルパス')
+    parser.add_argument("--img_dir", type=str, nargs="+",
+                        default=[str(TEST_IMG_DIR)],
+                        help='画像(*.png)を格納したディレクトリ')
+    parser.add_argument("--repeat", type=int, default=100,
+                        help='予測ごとの繰り返し回数')
+    parser.add_argument("--save", type=str, default=None,
+                        help='記録した予測の保存パス')
+    parser.add_argument("--load", type=str, default=None,
+                        help='保存した予測のパス(画像から記録しない)')
+    args = parser.parse_args()
+
+    if args.load:
+        preds = torch.load(args.load)
+    else:
+        kwargs = {k: v for k, v in (("weights", args.weights),
+                                    ("label_data", args.label_data)) if v}
+        preds = record_predictions(
+            [img for _, img in load_images(args.img_dir)], **kwargs)
+    if args.save:
+        torch.save(preds, args.save)
+
+    report = {key: benchmark_nms(p, repeat=args.repeat)
+              for key, p in preds.items()}
+    print(json.dumps(report, indent=2))
@@ -6,11 +6,14 @@
 import os
 import time
 import shutil
+import threading
 from datetime import datetime
 
 from client import Client
 from train_tracker import TrainTracker
 from robo_snap import RoboSnap
+from detection_cache import DetectionCache
+from detect_worker import DetectWorker
 
 script_dir = os.path.dirname(os.path.abspath(__file__))  # noqa
 PROJECT_DIR_PATH = os.path.dirname(script_dir)
@@ -19,9 +22,16 @@ PROJECT_DIR_PATH = os.path.dirname(script_dir)
 class CameraSystem:
     """カメラシステムクラス."""
 
-    def __init__(self, raspike_ip="172.20.1.1") -> None:
-        """カメラシステムのコンストラクタ."""
+    def __init__(self, raspike_ip="172.20.1.1", detect_worker=False) -> None:
+        """カメラシステムのコンストラクタ.
+
+        Args:
+            raspike_ip: 走行体のIPアドレス
+            detect_worker: 物体検出を別プロセスで行うかどうか
+        """
         self.raspike_ip = raspike_ip
+        self.detect_worker = detect_worker
+        self.detector = None
 
     @staticmethod
     def mkdir_fig_img() -> None:
@@ -50,10 +60,34 @@ class CameraSystem:
         # fig_image作成
         os.mkdir(img_dir_path)
 
+    def load_detector(self) -> None:
+        """物体検出のモジュールを読み込み、モデルの読み込みを開始する.
+
+        読み込みに失敗した場合、detectorはNoneのまま
+        (RoboSnapがデフォルトのパラメータで作成する)
+        """
+        try:
+            if self.detect_worker:
+                detector = DetectWorker(async_write=True)
+            else:
+                # torchなどの読み込みでキャリブレーションを待たせないためここでimportする
+                from detect_object import DetectObject
+                detector = DetectObject(cache=DetectionCache(),
+                                        async_write=True)
+            detector.preload()
+            self.detector = detector
+        except Exception as e:
+            print("Error: detector load failed:", e)
+
     def start(self) -> None:
         """ゲーム攻略を計画する."""
         print("camera-system start!!")
 
+        # 物体検出(torchなど)とモデルの読み込みをバックグラウンドで開始する
+        # (キャリブレーションを待たせず、フィグ画像の受信までに推論可能な状態にしておく)
+        loader = threading.Thread(target=self.load_detector, daemon=True)
+        loader.start()
+
         self.mkdir_fig_img()
 
         # キャリブレーション後に走行体状態取得モジュールを実行する
@@ -73,7 +107,8 @@ class CameraSystem:
                 tt.observe()
 
                 # ロボコンスナップ攻略開始
-                snap = RoboSnap(self.raspike_ip)
+                loader.join()
+                snap = RoboSnap(self.raspike_ip, detector=self.detector)
                 snap.start_snap()
 
                 # カメラシステムを終了
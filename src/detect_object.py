@@ -12,22 +12,33 @@ NOTE:
 @author: kawanoichi
 """
 
+import json
 import torch
 from pathlib import Path
 import os
 import numpy as np
 import sys
-from ultralytics.utils.plotting import Annotator, colors
+import threading
 
 script_dir = os.path.dirname(os.path.abspath(__file__))  # noqa
 YOLO_PATH = os.path.join(script_dir, "..", "yolo")  # noqa
 sys.path.append(YOLO_PATH)  # noqa
 YOLO_PATH = Path(YOLO_PATH)  # noqa
 from models.common import DetectMultiBackend
+from models.yolo import Detect
 from utils.general import (
-    check_img_size, cv2, non_max_suppression, scale_boxes)
-from utils.torch_utils import select_device
-from utils.augmentations import letterbox
+    check_img_size, cv2, non_max_suppression, scale_boxes, yaml_load)
+from utils.torch_utils import (
+    InferenceModel, quantize_model, select_device, smart_inference_mode,
+    time_sync)
+from utils.augmentations import (
+    letterbox_into, letterbox_params, letterbox_shape)
+from utils.plots import Annotator, colors
+from image_processing import ImageProcessing
+from detections import Detections
+from latency_profiler import LatencyProfiler
+from detection_cache import DetectionCache, file_digest
+from image_writer import ImageWriter
 
 PROJECT_DIR_PATH = os.path.dirname(script_dir)
 IMAGE_DIR_PATH = Path(os.path.join(PROJECT_DIR_PATH, "fig_image"))
@@ -38,6 +49,13 @@ class DetectObject():
 
     __DEVICE = 'cpu'
     __IMG_SIZE = (640, 480)
+    __FRAME_SHAPE = (480, 640, 3)  # カメラ画像のサイズ(高さ, 幅, チャンネル)
+
+    # 読み込み済みモデル(プロセス内で共有する)
+    # キー: (重みファイルパス, ラベルファイルパス, 推論エンジンの設定, 量子化の較正画像,
+    #        推論の最適化, 検出層の信頼度閾値)
+    __models = {}
+    __models_lock = threading.Lock()
 
     def __init__(self,
                  weights=YOLO_PATH/'learned_fig_weight_ver2.pt',
@@ -47,9 +65,29 @@ class DetectObject():
                  iou_thres=0.45,
                  max_det=10,
                  line_thickness=1,
-                 stride=32):
+                 stride=32,
+                 dnn=False,
+                 intra_op_threads=0,
+                 inter_op_threads=0,
+                 graph_optimization_level='all',
+                 quantize=False,
+                 calib_imgs=IMAGE_DIR_PATH,
+                 warmup_runs=2,
+                 reserved_cores=0,
+                 cpu_affinity=None,
+                 optimize='eager',
+                 channels_last=True,
+                 gated_decode=True,
+                 cache=None,
+                 async_write=False):
         """コンストラクタ.
 
+        重みファイルの拡張子で推論エンジンを選択する。
+            .pt   : PyTorch
+            .onnx : ONNX Runtime(CPUExecutionProvider)
+                    dnn=Trueの場合はOpenCV DNN
+            .torchscript : TorchScript
+
         Args:
             weights (str): 重みファイルパス
             label_data (str): ラベルを記述したファイルパス
@@ -58,6 +96,44 @@ class DetectObject():
             max_det (int): 最大検出数
             line_thickness (int): バウンディングボックスの太さ
             stride (int): ストライド
+            dnn (bool): ONNXモデルをOpenCV DNNで推論するかどうか
+            intra_op_threads (int): 演算内並列スレッド数(0は既定値)
+                                    PyTorch, ONNX Runtime, OpenCV DNNに適用する
+            inter_op_threads (int): 演算間並列スレッド数(0は既定値)
+                                    PyTorch, ONNX Runtimeに適用する
+            graph_optimization_level (str): ONNX Runtimeのグラフ最適化レベル
+                ('disable', 'basic', 'extended', 'all')
+            quantize (bool): PyTorchモデルをINT8に量子化して推論するかどうか
+            calib_imgs (str | list): 量子化の較正に使う画像
+                                     ディレクトリ(*.png)または画像パスのリスト
+            warmup_runs (int): 読み込み時にカメラ画像と同じ入力サイズで
+                               推論しておく回数(0の場合、CPUではウォームアップしない)
+            reserved_cores (int): 推論に使わずに残しておくコア数
+                                  (TrainTrackerなど他の処理用)
+                                  使用可能なCPUの末尾のこの数のコアを除いたCPUで推論し、
+                                  intra_op_threads=0の場合に演算内並列スレッド数を
+                                  使用可能なコア数からこの数を引いた数にする
+            cpu_affinity (list): 推論を実行するCPU番号のリスト
+                                 Noneの場合、設定しない
+                                 NOTE: 推論を行うスレッド(モデルを読み込むスレッド,
+                                       検出を呼び出したスレッド)と
+                                       それらが作る演算スレッドに適用される
+                                       スレッドごとに設定できない環境(Windowsなど)では
+                                       警告を表示して設定しない
+            optimize (str): PyTorchモデルの推論の最適化方法
+                ('eager': 最適化しない, 'freeze': torch.jit.freeze,
+                 'compile': torch.compile)
+                使用できない場合は警告を表示してeagerで推論する
+            channels_last (bool): PyTorchモデルの重みと入力をchannels-lastの
+                                  メモリ配置にするかどうか
+            gated_decode (bool): PyTorchモデルの検出層で信頼度閾値を超えたセルだけを
+                                 デコードするかどうか(NMSの結果は変わらない)
+            cache (DetectionCache): 同じ画像の検出結果を再利用するキャッシュ
+                                    Noneの場合、キャッシュしない
+            async_write (bool): 検出結果の画像の描画と保存を別スレッドで行うかどうか
+                                Trueの場合、保存の完了を待たずに検出結果を返す
+                                (flush_writesで完了を待つ)
+                                NOTE: BGR画像(np.ndarray)は保存が終わるまで変更しないこと
         """
         self.check_exist(weights)
         self.check_exist(label_data)
@@ -68,120 +144,400 @@ class DetectObject():
         self.max_det = max_det
         self.line_thickness = line_thickness
         self.stride = stride
+        self.dnn = dnn
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization_level = graph_optimization_level
+        self.quantize = quantize
+        self.calib_imgs = calib_imgs
+        self.warmup_runs = warmup_runs
+        self.reserved_cores = reserved_cores
+        self.cpu_affinity = cpu_affinity
+        self.optimize = optimize
+        self.channels_last = channels_last
+        self.gated_decode = gated_decode
+        self.cache = cache
+        # 検出ごとのステージ別処理時間を集計する
+        self.profiler = LatencyProfiler(clock=time_sync)
+        self.load_error = None
+        # 検出結果の画像の保存スレッド
+        self.__writer = ImageWriter(self.annotate, profiler=self.profiler) \
+            if async_write else None
+        self.__preload_thread = None
+        self.__labels = None  # ラベル名(キー: クラスID)
+        self.__buffers = threading.local()  # 推論の入力テンソル
+        self.__affinity = threading.local()  # スレッドに設定したCPU番号
+        # 推論スレッドのCPUアフィニティを設定する前の使用可能なCPU
+        if hasattr(os, "sched_getaffinity"):
+            self.__process_cpus = sorted(os.sched_getaffinity(0))
+        else:
+            self.__process_cpus = list(range(os.cpu_count()))
+
+    # ファイル, ディレクトリが存在するかの確認
+    check_exist = staticmethod(ImageProcessing.check_exist)
+
+    @property
+    def model_key(self) -> tuple:
+        """読み込み済みモデルを識別するキー."""
+        return (self.weights,
+                self.label_data,
+                self.dnn,
+                self.num_threads,
+                self.inter_op_threads,
+                self.graph_optimization_level,
+                str(self.calib_imgs) if self.quantize else None,
+                self.optimize,
+                self.channels_last,
+                self.conf_thres if self.gated_decode else None,
+                tuple(self.inference_cpus or ()))
+
+    @property
+    def fingerprint(self) -> str:
+        """検出結果に影響するモデルの設定を表す文字列(検出結果のキャッシュキーに使う).
+
+        重みファイル, ラベルファイルは内容のハッシュを使うため、
+        同じパスのファイルを更新した場合もキャッシュは使われない。
+        """
+        return json.dumps([file_digest(self.weights),
+                           file_digest(self.label_data),
+                           self.conf_thres,
+                           self.iou_thres,
+                           self.max_det,
+                           self.dnn,
+                           str(self.calib_imgs) if self.quantize else None,
+                           self.optimize,
+                           self.channels_last,
+                           self.gated_decode])
+
+    @property
+    def labels(self) -> dict:
+        """ラベル名(キー: クラスID).
+
+        描画のためにモデルを読み込まないよう、ラベルファイルから読み込む。
+        """
+        if self.__labels is None:
+            names = yaml_load(self.label_data)['names']
+            if isinstance(names, (list, tuple)):
+                names = dict(enumerate(names))
+            self.__labels = names
+        return self.__labels
+
+    @property
+    def num_threads(self) -> int:
+        """推論に使う演算内並列スレッド数(0は既定値)."""
+        if self.intra_op_threads > 0 or self.reserved_cores <= 0:
+            return self.intra_op_threads
+        return max(1, len(self.available_cpus()) - self.reserved_cores)
+
+    def available_cpus(self) -> list:
+        """推論に使用可能なCPU番号のリストを返す."""
+        if self.cpu_affinity is not None:
+            return list(self.cpu_affinity)
+        return list(self.__process_cpus)
+
+    @property
+    def inference_cpus(self):
+        """推論を実行するCPU番号のリスト(Noneの場合、設定しない).
+
+        reserved_coresを指定した場合は使用可能なCPUから末尾のreserved_cores個を除く。
+        """
+        if self.reserved_cores <= 0:
+            return None if self.cpu_affinity is None \
+                else list(self.cpu_affinity)
+        cpus = self.available_cpus()
+        return cpus[:max(1, len(cpus) - self.reserved_cores)]
 
-    @staticmethod
-    def check_exist(path: str) -> None:
-        """ファイル, ディレクトリが存在するかの確認.
+    def apply_affinity(self) -> None:
+        """推論を実行するスレッド(呼び出したスレッド)のCPUアフィニティを設定する.
 
-        Args:
-            path (str): ファイルまたはディレクトリのパス
-
-        raise:
-            FileNotFoundError: ファイルがない場合に発生
+        NOTE:
+            スレッドごとの設定のため、推論を行うスレッドごとに最初の推論前に設定する
+            (PyTorch, ONNX Runtimeの演算スレッドは作成元のスレッドの設定を引き継ぐ)。
+            スレッドごとに設定できない環境(Windowsなど)では、プロセス全体に設定すると
+            TrainTrackerなど他の処理用に残したコアも使えなくなるため設定しない。
         """
+        cpus = self.inference_cpus
+        if cpus is None or getattr(self.__affinity, "cpus", None) == cpus:
+            return
         try:
-            if not os.path.exists(path):
-                raise FileNotFoundError(f"'{path}' is not found")
+            if not hasattr(os, "sched_setaffinity"):
+                raise OSError("per-thread affinity is not supported")
+            os.sched_setaffinity(0, cpus)
+        except (OSError, ValueError) as e:
+            print("Warning: cpu_affinity is not applied:", e)
+        self.__affinity.cpus = cpus  # 失敗した場合も警告は1回だけにする
 
-        except FileNotFoundError as e:
-            print("Error:", e)
+    def apply_threads(self) -> None:
+        """推論のスレッド数とCPUアフィニティを設定する.
 
-    def detect_object(self,
-                      img_path=IMAGE_DIR_PATH/'test_image.png',
-                      save_path=None) -> list:
-        """物体の検出を行う関数.
+        NOTE:
+            PyTorchのスレッド数はプロセス全体の設定となる。
+            演算間並列スレッド数は並列処理の開始前に一度しか変更できないため、
+            変更できない場合は警告を表示して既定値のまま推論する。
+        """
+        self.apply_affinity()
+
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+            if self.dnn:
+                cv2.setNumThreads(self.num_threads)
+        if self.inter_op_threads > 0 and \
+                torch.get_num_interop_threads() != self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError as e:
+                print("Warning: inter_op_threads is not applied:", e)
+
+    @property
+    def is_loaded(self) -> bool:
+        """モデルが読み込み済みかどうか."""
+        return self.model_key in DetectObject.__models
+
+    def load_model(self) -> DetectMultiBackend:
+        """モデルを読み込む.
+
+        同じ重みファイルのモデルが読み込み済みの場合は再利用する。
+        読み込み時に一度だけウォームアップを行う。
 
-        Args:
-            img_path(str): 物体検出を行う画像パス
-            save_path(str): 検出結果の画像保存パス
-                            Noneの場合、保存しない
         Returns:
-            list: 検出したオブジェクト
+            DetectMultiBackend: 読み込んだモデル
         """
-        self.check_exist(img_path)
+        with DetectObject.__models_lock:
+            model = DetectObject.__models.get(self.model_key)
+            if model is not None:
+                return model
+
+            # cpuを指定
+            device = select_device(self.__DEVICE)
+            # モデルの読み込み前にスレッド数を設定する
+            self.apply_threads()
+
+            # モデルの読み込み
+            model = DetectMultiBackend(self.weights,
+                                       device=device,
+                                       dnn=self.dnn,
+                                       data=self.label_data,
+                                       fp16=False,
+                                       intra_op_threads=self.num_threads,
+                                       inter_op_threads=self.inter_op_threads,
+                                       graph_optimization_level=(
+                                           self.graph_optimization_level))
+
+            # 画像のサイズを指定されたストライド（ステップ）の倍数に合わせる
+            # 入力サイズが固定のモデル(ONNX)はそのサイズを使う
+            if model.fixed_imgsz:
+                model.img_size = list(model.fixed_imgsz)
+            else:
+                model.img_size = check_img_size(
+                    self.__IMG_SIZE, s=model.stride)  # >> [640, 480]
+
+            if self.quantize:
+                model.model = self.__quantize(model)
+            if model.pt:
+                if self.gated_decode:
+                    # 検出層で信頼度閾値未満のセルのデコードを省く
+                    for m in model.model.modules():
+                        if isinstance(m, Detect):
+                            m.conf_thres = self.conf_thres
+                # 推論専用の実行パス(inference mode, channels-last, jit.freeze/compile)
+                model.model = InferenceModel(model.model, self.optimize,
+                                             self.channels_last)
+
+            # モデルの初期化
+            # カメラ画像を前処理した後と同じ入力サイズで推論しておき、
+            # 初回の推論時にかかる処理(メモリ確保, グリッドの作成など)を済ませる
+            frame = np.zeros(self.__FRAME_SHAPE, dtype=np.uint8)
+            model.warmup(imgsz=(1, *self.preprocess(frame, model).shape),
+                         cpu=self.warmup_runs > 0,
+                         n=self.warmup_runs)
+
+            DetectObject.__models[self.model_key] = model
+            return model
+
+    def preload(self) -> threading.Thread:
+        """モデルの読み込みとウォームアップをバックグラウンドで開始する.
+
+        読み込みに失敗した場合はload_errorに例外を格納する。
+        検出時にはモデルが再度読み込まれる。
+
+        Returns:
+            threading.Thread: 読み込みを行うスレッド
+        """
+        if self.__preload_thread is None:
+            self.__preload_thread = threading.Thread(target=self.__preload,
+                                                     daemon=True)
+            self.__preload_thread.start()
+        return self.__preload_thread
+
+    def __preload(self) -> None:
+        """バックグラウンドでモデルを読み込む."""
+        try:
+            self.load_model()
+            self.load_error = None
+        except Exception as e:
+            self.load_error = e
+            print("Error: model preload failed:", e)
+
+    def wait_ready(self, timeout=None) -> bool:
+        """バックグラウンドでのモデルの読み込みの完了を待つ.
+
+        Args:
+            timeout(float): 最大待ち時間[s]. Noneの場合、完了まで待つ
 
-        # cpuを指定
-        device = select_device(self.__DEVICE)
+        Returns:
+            bool: モデルが読み込み済みかどうか
+        """
+        if self.__preload_thread is not None:
+            self.__preload_thread.join(timeout)
+        return self.is_loaded
 
-        # モデルの読み込み
-        model = DetectMultiBackend(self.weights,
-                                   device=device,
-                                   dnn=False,
-                                   data=self.label_data,
-                                   fp16=False)
+    def __quantize(self, model: DetectMultiBackend) -> torch.nn.Module:
+        """PyTorchモデルを静的量子化(INT8)する.
 
-        stride, labels, pt = model.stride, model.names, model.pt
+        較正用の画像で各層の出力の範囲を測定してから量子化する。
+        検出ヘッド(Detect)はFP32のまま推論する。
 
-        # 画像のサイズを指定されたストライド（ステップ）の倍数に合わせるための関数
-        img_size = check_img_size(
-            self.__IMG_SIZE, s=stride)  # >> [640, 640]
+        Args:
+            model(DetectMultiBackend): 読み込んだモデル
 
-        # モデルの初期化
-        batch_size = 1
-        model.warmup(
-            imgsz=(1 if pt or model.triton else batch_size, 3, *img_size))
+        Returns:
+            torch.nn.Module: 量子化したモデル
+        """
+        if not model.pt:
+            raise ValueError("quantize is only supported for PyTorch (.pt) "
+                             f"weights: {self.weights}")
+        if isinstance(self.calib_imgs, (str, Path)):
+            img_paths = sorted(Path(self.calib_imgs).glob("*.png"))
+        else:
+            img_paths = list(self.calib_imgs)
+        if not img_paths:
+            raise FileNotFoundError(
+                f"no calibration images found in '{self.calib_imgs}'")
+
+        images = [self.preprocess(ImageProcessing.load_img(str(img)),
+                                  model)[None] for img in img_paths]
+        return quantize_model(model.model, images)
+
+    def release_model(self) -> None:
+        """読み込み済みのモデルを解放する.
 
-        # 画像の読み込み
-        original_img = cv2.imread(img_path)  # BGR
+        NOTE:
+            同じ重みファイルを使う他のインスタンスからも解放される。
+            次回の検出時に再度読み込まれる。
+            保存待ちの検出結果の画像(ラベルの描画にモデルを使う)は先に保存する。
+        """
+        self.flush_writes()
+        with DetectObject.__models_lock:
+            DetectObject.__models.pop(self.model_key, None)
 
-        # パディング処理
-        img = letterbox(original_img,
-                        self.__IMG_SIZE,
-                        stride=self.stride,
-                        auto=True)[0]
-        img = img.transpose((2, 0, 1))[::-1]  # BGR -> RGB
-        img = np.ascontiguousarray(img)  # 連続したメモリ領域に変換
-        img = torch.from_numpy(img).to(model.device)  # PyTorchのテンソルに変換
-        img = img.half() if model.fp16 else img.float()  # uint8 to fp16/32
+    @classmethod
+    def release_all_models(cls) -> None:
+        """読み込み済みの全てのモデルを解放する."""
+        with cls.__models_lock:
+            cls.__models.clear()
 
-        # スケーリング
-        img /= 255  # 0 - 255 to 0.0 - 1.0
+    def input_params(self, img_shape: tuple, model=None) -> tuple:
+        """画像サイズに対するletterboxの変形を返す(画像サイズごとにキャッシュされる).
 
-        # torch.Size([3, 640, 640]) >> torch.Size([1, 3, 640, 640])
-        if len(img.shape) == 3:
-            img = img[None]
+        Args:
+            img_shape(tuple): 元画像の形状(高さ, 幅, ...)
+            model(DetectMultiBackend): 推論に使うモデル
+                                       Noneの場合、読み込み済みのモデルを使う
 
-        # 検出
-        pred = model(img, augment=False, visualize=False)
+        Returns:
+            tuple: letterbox_paramsの結果
+        """
+        if model is None:
+            model = self.load_model()
+        # 入力サイズが固定のモデルはそのサイズまでパディングする
+        return letterbox_params(img_shape[:2],
+                                tuple(model.fixed_imgsz or self.__IMG_SIZE),
+                                auto=model.fixed_imgsz is None,
+                                stride=self.stride)
+
+    def __input_buffer(self, n: int, shape: tuple, model) -> torch.Tensor:
+        """推論の入力に使う(n, 3, 高さ, 幅)のテンソルを返す(スレッドごとに再利用する).
+
+        PyTorchモデルをchannels-lastで推論する場合は同じメモリ配置で確保し、
+        推論時の並べ替えを省く。
+        """
+        memory_format = torch.channels_last \
+            if model.pt and self.channels_last else torch.contiguous_format
+        buffer = getattr(self.__buffers, "input", None)
+        if buffer is None or buffer.shape[0] < n or \
+                buffer.shape[2:] != shape or \
+                not buffer.is_contiguous(memory_format=memory_format):
+            buffer = torch.empty((n, 3, *shape), dtype=torch.float32,
+                                 memory_format=memory_format)
+            self.__buffers.input = buffer
+        return buffer[:n]
+
+    def preprocess(self, original_img: np.ndarray,
+                   model=None,
+                   times=None,
+                   out=None) -> torch.Tensor:
+        """推論用に画像を前処理する.
+
+        リサイズ, パディング, BGR -> RGB, HWC -> CHW, スケーリングを
+        中間の画像を作らずにoutへ直接書き込む。
 
-        # 非最大値抑制 (NMS) により重複検出を拒否
-        pred = non_max_suppression(pred,
-                                   self.conf_thres,  # 信頼度の閾値
-                                   self.iou_thres,  # IoUの閾値
-                                   max_det=self.max_det,  # 保持する最大検出数
-                                   classes=None,  # 検出するクラスのリスト
-                                   agnostic=False  # Trueの場合、クラスを無視してNMSを実行
-                                   )
-
-        # 検出結果を画像に描画
-        objects = pred[0]
-        print(Path(img_path).name, " 検出数", len(objects))
+        Args:
+            original_img(np.ndarray): BGR画像
+            model(DetectMultiBackend): 推論に使うモデル
+                                       Noneの場合、読み込み済みのモデルを使う
+            times(dict): ステージごとの処理時間の格納先
+            out(torch.Tensor): 書き込み先の(3, H, W)のfloat32テンソル
+                               Noneの場合、新しく確保する
 
-        save_img = original_img.copy()
+        Returns:
+            torch.Tensor: (3, H, W)のRGB画像テンソル(0.0 - 1.0)
+        """
+        if model is None:
+            model = self.load_model()
+        if times is None:
+            times = {}
+
+        with self.profiler.measure(times, "letterbox"):
+            params = self.input_params(original_img.shape, model)
+            if out is None:
+                out = torch.empty((3, *letterbox_shape(params)),
+                                  dtype=torch.float32)
+
+        with self.profiler.measure(times, "tensor"):
+            letterbox_into(original_img, out.numpy(), params)
+        return out.half() if model.fp16 else out
+
+    def postprocess(self,
+                    objects: torch.Tensor,
+                    img_shape: tuple,
+                    original_img: np.ndarray,
+                    save_path=None,
+                    times=None) -> list:
+        """NMS後の検出結果を元画像の座標に戻し、必要なら画像を保存する.
 
-        # 画像にバウンディングボックスやラベルなどのアノテーションを追加
-        annotator = Annotator(save_img,
-                              line_width=self.line_thickness,
-                              example=str(labels))
+        Args:
+            objects(torch.Tensor): NMS後の検出結果(n, 6)
+            img_shape(tuple): 推論時の画像サイズ(高さ, 幅)
+            original_img(np.ndarray): 元画像(BGR)
+            save_path(str): 検出結果の画像保存パス
+                            Noneの場合、保存しない
+            times(dict): ステージごとの処理時間の格納先
+        Returns:
+            np.ndarray: 検出したオブジェクト(検出数, 6)
+        """
+        if times is None:
+            times = {}
 
         if len(objects):
-            # バウンディングボックスをimgサイズからsave_imgサイズに再スケールします
-            objects[:, :4] = scale_boxes(
-                img.shape[2:], objects[:, :4], save_img.shape).round()
+            # バウンディングボックスをimgサイズからoriginal_imgサイズに再スケールします
+            with self.profiler.measure(times, "rescale"):
+                objects[:, :4] = scale_boxes(
+                    img_shape, objects[:, :4], original_img.shape).round()
 
             if save_path is not None:
-                # xyxy: バウンディングボックスの座標([x_min, y_min, x_max, y_max] 形式)
-                # conf: 信頼度
-                # cls: クラスID
-                for *xyxy, conf, cls in reversed(objects):
-                    c = int(cls)
-                    label = f'{labels[int(cls)]} {conf:.2f}'
-                    # 画像にバウンディングボックスとラベルを追加
-                    annotator.box_label(xyxy, label, color=colors(c, True))
-
                 # 検出結果を含む画像を保存
-                save_img = annotator.result()
-                cv2.imwrite(save_path, save_img)
+                self.save_result(original_img, objects.cpu().clone(),
+                                 save_path, times)
 
         """
         NOTE:
@@ -189,7 +545,285 @@ class DetectObject():
              行数:検出数
              列数:6列([x_min, y_min, x_max, y_max, conf, cls])
         """
-        return objects.tolist()
+        return objects.cpu().numpy()
+
+    def annotate(self, original_img: np.ndarray, objects) -> np.ndarray:
+        """検出結果を描画した画像を作成する.
+
+        Args:
+            original_img(np.ndarray): 元画像(BGR). 変更されない
+            objects: 元画像の座標での検出結果(n, 6)
+
+        Returns:
+            np.ndarray: 検出結果を描画した画像(BGR)
+        """
+        labels = self.labels
+        save_img = original_img.copy()
+
+        # 画像にバウンディングボックスやラベルなどのアノテーションを追加
+        annotator = Annotator(save_img, line_width=self.line_thickness)
+
+        # xyxy: バウンディングボックスの座標([x_min, y_min, x_max, y_max] 形式)
+        # conf: 信頼度
+        # cls: クラスID
+        for *xyxy, conf, cls in reversed(objects):
+            c = int(cls)
+            label = f'{labels[int(cls)]} {conf:.2f}'
+            # 画像にバウンディングボックスとラベルを追加
+            annotator.box_label(xyxy, label, color=colors(c, True))
+
+        return annotator.result()
+
+    def save_result(self,
+                    original_img: np.ndarray,
+                    objects,
+                    save_path: str,
+                    times=None,
+                    annotated_img=None) -> None:
+        """検出結果を描画した画像を保存する.
+
+        async_write=Trueの場合は保存スレッドに渡し、保存の完了を待たない
+        (処理時間は検出ごとの処理時間に含めずにprofilerに記録する)。
+
+        Args:
+            original_img(np.ndarray): 元画像(BGR)
+            objects: 元画像の座標での検出結果(n, 6)
+            save_path(str): 検出結果の画像保存パス
+            times(dict): ステージごとの処理時間の格納先
+            annotated_img(np.ndarray): 描画済みの画像
+                                       指定した場合、描画せずにこの画像を保存する
+        """
+        if self.__writer is not None:
+            if annotated_img is not None:
+                # 呼び出し元に返した画像が保存前に変更されないようにコピーする
+                self.__writer.submit(annotated_img.copy(), None, save_path)
+            else:
+                self.__writer.submit(original_img, objects, save_path)
+            return
+        if times is None:
+            times = {}
+        if annotated_img is not None:
+            save_img = annotated_img
+        else:
+            with self.profiler.measure(times, "annotate"):
+                save_img = self.annotate(original_img, objects)
+        with self.profiler.measure(times, "write"):
+            cv2.imwrite(save_path, save_img)
+
+    def flush_writes(self) -> None:
+        """保存待ちの検出結果の画像が全て保存されるまで待つ."""
+        if self.__writer is not None:
+            self.__writer.flush()
+
+    def detect_object(self,
+                      img=IMAGE_DIR_PATH/'test_image.png',
+                      save_path=None,
+                      annotate=False):
+        """物体の検出を行う関数.
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+                                           画像パス, PNGなどのバイト列, BGR画像のいずれか
+            save_path(str): 検出結果の画像保存パス
+                            Noneの場合、保存しない
+            annotate(bool): Trueの場合、検出結果を描画した画像も返す
+        Returns:
+            Detections: 検出したオブジェクト
+                        timesにステージごとの処理時間[s]を持つ
+            np.ndarray: 検出結果を描画した画像(BGR). annotate=Trueの場合のみ
+        """
+        times = {}
+        if annotate and isinstance(img, (str, Path)):
+            self.check_exist(img)
+        if annotate or not isinstance(img, (np.ndarray, str, Path)):
+            # バイト列(描画する場合は画像パスも)は一度だけデコードし、描画にも使い回す
+            with self.profiler.measure(times, "read"):
+                img = ImageProcessing.load_img(img)
+
+        # 描画する場合は描画した画像を保存にも使う(描画は1回だけ行う)
+        objects = self.__detect_objects(
+            [img], [None if annotate else save_path])[0]
+        # 検出前後の処理時間も同じ1回分として記録する
+        for k, t in times.items():
+            objects.times[k] = objects.times.get(k, 0.0) + t
+        annotated_img = None
+        if annotate:
+            with self.profiler.measure(objects.times, "annotate"):
+                annotated_img = self.annotate(img, objects)
+            if save_path is not None and len(objects):
+                self.save_result(img, objects, save_path, objects.times,
+                                 annotated_img=annotated_img)
+        self.profiler.record(objects.times)
+        return (objects, annotated_img) if annotate else objects
+
+    def detect_objects(self,
+                       imgs: list,
+                       save_paths=None,
+                       chunk_size=4) -> list:
+        """複数画像の物体検出をまとめて行う関数.
+
+        前処理後のサイズが同じ画像をchunk_size枚ずつ1つのバッチにまとめ、
+        1回の推論で検出する。
+
+        Args:
+            imgs(list): 物体検出を行う画像のリスト
+                        画像パス, PNGなどのバイト列, BGR画像(np.ndarray)のいずれか
+            save_paths(list): 検出結果の画像保存パスのリスト
+                              Noneの場合、保存しない
+            chunk_size(int): 1回の推論でまとめる最大枚数
+                             メモリ使用量はこの枚数分に抑えられる
+        Returns:
+            list: 画像ごとの検出したオブジェクト(Detections)のリスト
+
+        NOTE:
+            まとめて推論した画像の推論, NMSの処理時間は枚数で等分する。
+            モデルの読み込み時間は最初に推論する画像に含める。
+            キャッシュに検出結果がある画像は推論しない(モデルも読み込まない)。
+        """
+        results = self.__detect_objects(imgs, save_paths, chunk_size)
+        for objects in results:
+            self.profiler.record(objects.times)
+        return results
+
+    @smart_inference_mode()
+    def __detect_objects(self,
+                         imgs: list,
+                         save_paths=None,
+                         chunk_size=4) -> list:
+        """detect_objectsの処理(処理時間はprofilerに記録しない)."""
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be positive: {chunk_size}")
+        if save_paths is None:
+            save_paths = [None] * len(imgs)
+        if len(save_paths) != len(imgs):
+            raise ValueError("imgs and save_paths must have the same length")
+
+        # ファイルのハッシュを含むため呼び出しごとに1回だけ計算する
+        fingerprint = self.fingerprint if self.cache is not None else None
+        results = [None] * len(imgs)
+        cache_keys = {}  # キー: インデックス, 値: 検出結果をキャッシュするキー
+        model = None
+        chunk = []  # [(インデックス, 元画像, 処理時間)]
+        for i, img in enumerate(imgs):
+            times = {}
+            if isinstance(img, (str, Path)):
+                self.check_exist(img)
+
+            # 同じ画像の検出結果があれば推論しない
+            if self.cache is not None:
+                with self.profiler.measure(times, "cache"):
+                    cache_keys[i] = self.cache.key(img, fingerprint)
+                    objects = self.cache.get(cache_keys[i])
+                if objects is not None:
+                    results[i] = self.__cached_result(img, objects,
+                                                      save_paths[i], times)
+                    del cache_keys[i]
+                    continue
+
+            # モデルの取得(初回のみ読み込み)
+            if model is None:
+                with self.profiler.measure(times, "load"):
+                    model = self.load_model()
+                # 読み込みと別のスレッドで推論する場合もCPUアフィニティを設定する
+                self.apply_affinity()
+                # バッチサイズが固定のモデルはその枚数ずつ推論する
+                if model.max_batch_size:
+                    chunk_size = min(chunk_size, model.max_batch_size)
+
+            # 画像の読み込み
+            with self.profiler.measure(times, "read"):
+                original_img = ImageProcessing.load_img(img)  # BGR
+            shape = letterbox_shape(
+                self.input_params(original_img.shape, model))
+
+            # サイズが異なる画像は同じバッチにまとめられない
+            if len(chunk) == chunk_size or (chunk and chunk_shape != shape):
+                self.__detect_chunk(chunk, batch[:len(chunk)],
+                                    imgs, save_paths, results)
+                chunk = []
+            if not chunk:
+                chunk_shape = shape
+                batch = self.__input_buffer(chunk_size, shape, model)
+            # バッチの入力テンソルに直接書き込む
+            self.preprocess(original_img, model, times, out=batch[len(chunk)])
+            chunk.append((i, original_img, times))
+
+        if chunk:
+            self.__detect_chunk(chunk, batch[:len(chunk)],
+                                imgs, save_paths, results)
+
+        for i, key in cache_keys.items():
+            self.cache.put(key, results[i])
+        return results
+
+    def __cached_result(self, img, objects: list, save_path,
+                        times: dict) -> Detections:
+        """キャッシュした検出結果を返す(保存パスがあれば検出結果の画像も保存する).
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+            objects(np.ndarray): キャッシュした検出結果
+            save_path(str): 検出結果の画像保存パス
+            times(dict): ステージごとの処理時間の格納先
+
+        Returns:
+            Detections: 検出したオブジェクト
+        """
+        if save_path is not None and len(objects):
+            with self.profiler.measure(times, "read"):
+                original_img = ImageProcessing.load_img(img)  # BGR
+            self.save_result(original_img, objects.copy(), save_path, times)
+        return Detections(objects, times)
+
+    def __detect_chunk(self,
+                       chunk: list,
+                       batch: torch.Tensor,
+                       imgs: list,
+                       save_paths: list,
+                       results: list) -> None:
+        """前処理済みの画像をまとめて推論し、結果をresultsに格納する.
+
+        Args:
+            chunk(list): (インデックス, 元画像, 処理時間)のリスト
+            batch(torch.Tensor): 前処理済みの画像(N, 3, H, W)
+            imgs(list): detect_objectsに渡された画像のリスト
+            save_paths(list): 検出結果の画像保存パスのリスト
+            results(list): 検出結果の格納先
+        """
+        model = self.load_model()
+
+        # 推論, NMSの処理時間(チャンク内の画像で等分する)
+        times = {}
+        n = len(chunk)
+        if model.fp16:
+            batch = batch.half()
+
+        # 検出
+        with self.profiler.measure(times, "forward", n):
+            pred = model(batch, augment=False, visualize=False)
+
+        # 非最大値抑制 (NMS) により重複検出を拒否
+        with self.profiler.measure(times, "nms", n):
+            pred = non_max_suppression(pred,
+                                       self.conf_thres,  # 信頼度の閾値
+                                       self.iou_thres,  # IoUの閾値
+                                       max_det=self.max_det,  # 保持する最大検出数
+                                       classes=None,  # 検出するクラスのリスト
+                                       agnostic=False  # Trueの場合、クラスを無視してNMSを実行
+                                       )
+
+        for (i, original_img, img_times), objects in zip(chunk, pred):
+            for k, t in times.items():
+                img_times[k] = img_times.get(k, 0.0) + t
+            name = Path(imgs[i]).name \
+                if isinstance(imgs[i], (str, Path)) else f"image{i}"
+            print(name, " 検出数", len(objects))
+            objects = self.postprocess(objects,
+                                       batch.shape[2:],
+                                       original_img,
+                                       save_paths[i],
+                                       img_times)
+            results[i] = Detections(objects, img_times)
 
 
 if __name__ == '__main__':
@@ -220,6 +854,12 @@ if __name__ == '__main__':
                         default=IMAGE_DIR_PATH/'FigA_1.png', help='入力画像')
     parser.add_argument("-spath", "--save_path", type=str,
                         default=save_path, help='検出画像の保存先. Noneの場合保存しない')
+    parser.add_argument("--quantize", action="store_true",
+                        help='INT8に量子化して推論する')
+    parser.add_argument("--calib_imgs", type=str, default=IMAGE_DIR_PATH,
+                        help='量子化の較正に使う画像のディレクトリ')
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help='検出結果のキャッシュを保存するディレクトリ')
     args = parser.parse_args()
 
     d = DetectObject(args.weights,
@@ -228,9 +868,14 @@ if __name__ == '__main__':
                      args.iou_thres,
                      args.max_det,
                      args.line_thickness,
-                     args.stride)
+                     args.stride,
+                     quantize=args.quantize,
+                     calib_imgs=args.calib_imgs,
+                     cache=DetectionCache(cache_dir=args.cache_dir)
+                     if args.cache_dir else None)
 
     objects = d.detect_object(args.img_path, args.save_path)
     print("objects\n", objects)
+    print(d.profiler.report())
 
     print("完了")
@@ -0,0 +1,320 @@
+"""物体検出のHTTPサーバモジュール.
+
+1つのモデルを読み込んだままにして、複数のツールから物体検出を行えるようにする。
+短い時間内に届いたリクエストは1回の推論にまとめて検出する。
+
+    $ poetry run python src/detect_server.py --port 8765
+
+API:
+    POST /detect
+        PNGなどのバイト列(Content-Type: image/png)または
+        JSON {"path": 画像パス, "save_path": 検出結果の画像保存パス}
+        >> {"objects": [[x_min, y_min, x_max, y_max, conf, cls], ...],
+            "times": {ステージ名: 処理時間[s]}}
+    GET /health
+        >> {"ready": モデルが読み込み済みかどうか}
+
+@author: kawanoichi
+"""
+
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import cv2
+import numpy as np
+import requests
+
+from detect_object import DetectObject
+from image_processing import ImageProcessing
+
+
+class DetectBatcher:
+    """検出要求をまとめて推論するクラス.
+
+    最初の要求からbatch_window秒以内に届いた要求(最大max_batch件)を
+    DetectObject.detect_objectsで1回の推論にまとめる。
+    """
+
+    def __init__(self, detector, batch_window=0.01, max_batch=4) -> None:
+        """コンストラクタ.
+
+        Args:
+            detector(DetectObject): 物体検出に使うインスタンス
+            batch_window(float): 要求をまとめる時間[s]
+            max_batch(int): まとめる最大件数
+        """
+        self.detector = detector
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.__requests = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, img, save_path=None) -> Future:
+        """検出を要求する.
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+            save_path(str): 検出結果の画像保存パス
+
+        Returns:
+            Future: 検出結果(Detections)
+        """
+        future = Future()
+        self.__requests.put((img, save_path, future))
+        return future
+
+    def close(self) -> None:
+        """推論スレッドを終了する."""
+        self.__requests.put(None)
+        self.__thread.join()
+
+    def __run(self) -> None:
+        """推論スレッド."""
+        while True:
+            request = self.__requests.get()
+            if request is None:
+                return
+            batch = [request]
+            # 最初の要求からbatch_window秒以内に届いた要求をまとめる
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.__requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.__requests.put(None)  # 推論後に終了する
+                    break
+                batch.append(request)
+            self.__detect(batch)
+
+    def __detect(self, batch: list) -> None:
+        """まとめた要求を推論し、結果を返す."""
+        imgs, save_paths, futures = zip(*batch)
+        try:
+            results = self.detector.detect_objects(
+                list(imgs), list(save_paths), chunk_size=self.max_batch)
+        except Exception:
+            # どの画像で失敗したか分からないため1件ずつ検出し直す
+            for img, save_path, future in batch:
+                try:
+                    future.set_result(
+                        self.detector.detect_object(img, save_path))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        for future, objects in zip(futures, results):
+            future.set_result(objects)
+
+
+class DetectRequestHandler(BaseHTTPRequestHandler):
+    """物体検出のHTTPリクエストを処理するクラス."""
+
+    def log_message(self, format, *args) -> None:
+        """リクエストごとのログを表示しない."""
+
+    def send_json(self, status: int, body: dict) -> None:
+        """JSONを返す.
+
+        Args:
+            status(int): HTTPステータスコード
+            body(dict): レスポンスボディ
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        """GET /health: モデルが読み込み済みかを返す."""
+        if self.path != "/health":
+            self.send_json(404, {"error": f"not found: {self.path}"})
+            return
+        self.send_json(200, {"ready": self.server.detector.is_loaded})
+
+    def do_POST(self) -> None:
+        """POST /detect: 物体検出を行い、結果を返す."""
+        if self.path != "/detect":
+            self.send_json(404, {"error": f"not found: {self.path}"})
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        save_path = None
+        if self.headers.get("Content-Type", "") == "application/json":
+            try:
+                request = json.loads(body)
+                img = str(request["path"])
+                save_path = request.get("save_path")
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"error": f"invalid request: {e}"})
+                return
+            if not Path(img).exists():
+                self.send_json(400, {"error": f"'{img}' is not found"})
+                return
+        else:
+            # デコードできない画像は推論に回さない
+            try:
+                img = ImageProcessing.load_img(body)
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+
+        try:
+            objects = self.server.batcher.submit(img, save_path).result()
+        except Exception as e:
+            self.send_json(500, {"error": repr(e)})
+            return
+        self.send_json(200, {"objects": objects.tolist(),
+                             "times": objects.times})
+
+
+class DetectServer(ThreadingHTTPServer):
+    """物体検出のHTTPサーバ."""
+
+    daemon_threads = True
+
+    def __init__(self,
+                 host="127.0.0.1",
+                 port=8765,
+                 batch_window=0.01,
+                 max_batch=4,
+                 detector=None,
+                 **kwargs) -> None:
+        """コンストラクタ.
+
+        Args:
+            host(str): 待ち受けるアドレス
+            port(int): 待ち受けるポート番号(0の場合、空いているポート)
+            batch_window(float): 要求をまとめる時間[s]
+            max_batch(int): まとめる最大件数
+            detector(DetectObject): 物体検出に使うインスタンス
+                                    Noneの場合、kwargsで作成する
+            kwargs: DetectObjectの引数
+        """
+        super().__init__((host, port), DetectRequestHandler)
+        self.detector = detector if detector is not None \
+            else DetectObject(**kwargs)
+        self.detector.preload()
+        self.batcher = DetectBatcher(self.detector, batch_window, max_batch)
+        self.__thread = None
+
+    @property
+    def url(self) -> str:
+        """サーバのURL."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        """バックグラウンドでリクエストの受付を開始する."""
+        self.__thread = threading.Thread(target=self.serve_forever,
+                                         daemon=True)
+        self.__thread.start()
+
+    def close(self) -> None:
+        """サーバを停止する."""
+        if self.__thread is not None:
+            self.shutdown()
+            self.__thread.join()
+        self.server_close()
+        self.batcher.close()
+
+
+class DetectClient:
+    """物体検出のHTTPサーバのクライアントクラス."""
+
+    def __init__(self, url="http://127.0.0.1:8765", timeout=60) -> None:
+        """コンストラクタ.
+
+        Args:
+            url(str): サーバのURL
+            timeout(float): レスポンスを待つ最大時間[s]
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def is_ready(self) -> bool:
+        """サーバでモデルが読み込み済みかどうか."""
+        try:
+            res = self.session.get(f"{self.url}/health",
+                                   timeout=self.timeout)
+            return res.status_code == 200 and res.json()["ready"]
+        except requests.exceptions.RequestException:
+            return False
+
+    def detect_object(self, img, save_path=None) -> list:
+        """物体検出を行う.
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+                                           画像パス(サーバから読めるパス),
+                                           PNGなどのバイト列, BGR画像のいずれか
+            save_path(str): 検出結果の画像保存パス(画像パスの場合のみ)
+                            Noneの場合、保存しない
+        Returns:
+            list: 検出したオブジェクト
+
+        raise:
+            RuntimeError: サーバで検出に失敗した場合に発生
+        """
+        if isinstance(img, (str, Path)):
+            res = self.session.post(
+                f"{self.url}/detect",
+                json={"path": str(Path(img).resolve()),
+                      "save_path": save_path},
+                timeout=self.timeout)
+        else:
+            if isinstance(img, np.ndarray):
+                img = cv2.imencode(".png", img)[1].tobytes()
+            res = self.session.post(f"{self.url}/detect", data=img,
+                                    headers={"Content-Type": "image/png"},
+                                    timeout=self.timeout)
+        body = res.json()
+        if res.status_code != 200:
+            raise RuntimeError(f"detect failed: {body.get('error')}")
+        return body["objects"]
+
+
+if __name__ == '__main__':
+    """作業用.
+    $ poetry run python src/detect_server.py
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="物体検出のHTTPサーバ")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help='待ち受けるアドレス')
+    parser.add_argument("--port", type=int, default=8765,
+                        help='待ち受けるポート番号')
+    parser.add_argument("-wpath", "--weights", type=str, default=None,
+                        help='重みファイルパス')
+    parser.add_argument("-label", "--label_data", type=str, default=None,
+                        help='ラベルを記述したファイルパス')
+    parser.add_argument("--batch_window", type=float, default=0.01,
+                        help='要求をまとめる時間[s]')
+    parser.add_argument("--max_batch", type=int, default=4,
+                        help='まとめる最大件数')
+    args = parser.parse_args()
+
+    kwargs = {k: v for k, v in (("weights", args.weights),
+                                ("label_data", args.label_data)) if v}
+    server = DetectServer(args.host, args.port, args.batch_window,
+                          args.max_batch, **kwargs)
+    print("detect server:", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
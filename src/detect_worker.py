@@ -0,0 +1,358 @@
+"""物体検出を別プロセスで行うモジュール.
+
+読み込んだモデルをワーカープロセスが保持し、メインプロセスの処理(画像の受信など)を
+止めずに物体検出を行う。画像は共有メモリで受け渡し、検出結果だけをキューで返す。
+
+@author: kawanoichi
+"""
+
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+from pathlib import Path
+import numpy as np
+
+from image_processing import ImageProcessing
+from detections import Detections
+from latency_profiler import LatencyProfiler
+
+
+def _attach(shm_name: str, shape: tuple, dtype: str):
+    """共有メモリを開き、画像として参照する.
+
+    Returns:
+        SharedMemory: 共有メモリ
+        np.ndarray: 共有メモリ上の画像
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _run_worker(requests, results, kwargs: dict) -> None:
+    """ワーカープロセスで物体検出を行う.
+
+    Args:
+        requests: 検出要求のキュー
+                  (ジョブID, 共有メモリ名, 形状, 型, エンコード済みか, 保存パス)
+                  共有メモリ名がNoneの場合は保存待ちの画像の保存を待つ
+                  Noneで終了する
+        results: 検出結果のキュー
+                 (ジョブID, (検出したオブジェクト, 処理時間), エラー)
+                 モデルの読み込み完了時はジョブIDがNone
+        kwargs: DetectObjectの引数
+    """
+    from detect_object import DetectObject
+
+    d = DetectObject(**kwargs)
+    try:
+        d.load_model()
+        results.put((None, None, None))
+    except Exception as e:
+        results.put((None, None, repr(e)))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        job_id, shm_name, shape, dtype, encoded, save_path = request
+        if shm_name is None:
+            d.flush_writes()
+            results.put((job_id, None, None))
+            continue
+        shm, img = _attach(shm_name, shape, dtype)
+        try:
+            if encoded:
+                img = ImageProcessing.load_img(img.tobytes())
+            elif save_path is not None:
+                # 保存スレッドが描画する前に共有メモリを再利用されないようにする
+                img = img.copy()
+            objects = d.detect_object(img, save_path)
+            results.put((job_id, (objects.data, objects.times), None))
+        except Exception as e:
+            results.put((job_id, None, repr(e)))
+        finally:
+            img = None  # 共有メモリの参照を外してから閉じる
+            shm.close()
+    d.flush_writes()
+
+
+class DetectWorker:
+    """物体検出を行うワーカープロセスを管理するクラス.
+
+    DetectObjectと同じ引数で作成し、detect_objectで同じ形式の検出結果を返す。
+    submitで検出を開始し、resultで結果を受け取ることで、検出中に別の処理ができる。
+    """
+
+    def __init__(self, slots=2, timeout=60, **kwargs) -> None:
+        """コンストラクタ.
+
+        Args:
+            slots(int): 同時に検出要求できる画像の数(共有メモリの数)
+            timeout(float): 結果を待つ最大時間[s]
+            kwargs: DetectObjectの引数
+        """
+        if slots < 1:
+            raise ValueError(f"slots must be positive: {slots}")
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.profiler = LatencyProfiler()
+        self.load_error = None
+        self.__ready = False
+        self.__process = None
+        self.__requests = None
+        self.__results = None
+        self.__shms = [None] * slots
+        self.__free_slots = list(range(slots))
+        self.__jobs = {}  # キー: ジョブID, 値: 共有メモリの番号
+        self.__done = {}  # キー: ジョブID, 値: (検出結果, エラー)
+        self.__next_job_id = 0
+
+    def __enter__(self):
+        """ワーカープロセスを開始する."""
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        """ワーカープロセスを終了する."""
+        self.close()
+
+    @property
+    def is_alive(self) -> bool:
+        """ワーカープロセスが動いているかどうか."""
+        return self.__process is not None and self.__process.is_alive()
+
+    @property
+    def is_loaded(self) -> bool:
+        """ワーカープロセスでモデルが読み込み済みかどうか."""
+        return self.__ready
+
+    def start(self) -> None:
+        """ワーカープロセスを開始し、モデルの読み込みを始める."""
+        if self.__process is not None:
+            return
+        # fork後のPyTorchのスレッドは使えないためspawnで起動する
+        ctx = multiprocessing.get_context("spawn")
+        self.__requests = ctx.Queue()
+        self.__results = ctx.Queue()
+        self.__process = ctx.Process(target=_run_worker,
+                                     args=(self.__requests, self.__results,
+                                           self.kwargs),
+                                     daemon=True)
+        self.__process.start()
+
+    def preload(self) -> "DetectWorker":
+        """DetectObject.preloadと同じく、バックグラウンドでモデルを読み込む.
+
+        Returns:
+            DetectWorker: 自身(読み込みの完了はwait_readyで待つ)
+        """
+        self.start()
+        return self
+
+    def wait_ready(self, timeout=None) -> bool:
+        """ワーカープロセスでのモデルの読み込みの完了を待つ.
+
+        Args:
+            timeout(float): 最大待ち時間[s]. Noneの場合、完了まで待つ
+
+        Returns:
+            bool: モデルが読み込み済みかどうか
+        """
+        if self.__process is None:
+            return False
+        try:
+            while not self.__ready and self.load_error is None:
+                self.__receive(timeout)
+        except TimeoutError:
+            pass
+        return self.__ready
+
+    def __receive(self, timeout=None) -> None:
+        """ワーカープロセスからの結果を1件受け取る.
+
+        Args:
+            timeout(float): 最大待ち時間[s]. Noneの場合、受け取るまで待つ
+
+        raise:
+            TimeoutError: 最大待ち時間を超えた場合に発生
+            RuntimeError: ワーカープロセスが終了していた場合に発生
+        """
+        waited = 0.0
+        while True:
+            # ワーカープロセスの異常終了を検知するため短い間隔で待つ
+            try:
+                job_id, result, error = self.__results.get(timeout=0.5)
+                break
+            except queue.Empty:
+                waited += 0.5
+                if not self.is_alive:
+                    raise RuntimeError("detect worker process is not running")
+                if timeout is not None and waited >= timeout:
+                    raise TimeoutError("detect worker did not respond")
+
+        if job_id is None:  # モデルの読み込み完了
+            self.__ready = error is None
+            self.load_error = error
+            if error is not None:
+                print("Error: model load failed in worker:", error)
+            return
+        slot = self.__jobs.pop(job_id)
+        if slot is not None:
+            self.__free_slots.append(slot)
+        self.__done[job_id] = (result, error)
+
+    def __get_slot(self, nbytes: int) -> int:
+        """空いている共有メモリを取得する(足りない場合は作り直す).
+
+        Args:
+            nbytes(int): 必要なサイズ[byte]
+
+        Returns:
+            int: 共有メモリの番号
+        """
+        while not self.__free_slots:
+            self.__receive(self.timeout)
+        slot = self.__free_slots.pop(0)
+        shm = self.__shms[slot]
+        if shm is None or shm.size < nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self.__shms[slot] = shared_memory.SharedMemory(create=True,
+                                                           size=nbytes)
+        return slot
+
+    def submit(self, img, save_path=None) -> int:
+        """物体検出を開始する.
+
+        画像は共有メモリにコピーして渡すため、呼び出し後に変更してもよい。
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+                                           画像パス, PNGなどのバイト列, BGR画像のいずれか
+            save_path(str): 検出結果の画像保存パス
+                            Noneの場合、保存しない
+        Returns:
+            int: ジョブID(resultに渡す)
+        """
+        self.start()
+        encoded = not isinstance(img, np.ndarray)
+        if isinstance(img, (str, Path)):
+            with open(img, "rb") as f:
+                img = f.read()
+        if encoded:
+            img = np.frombuffer(img, dtype=np.uint8)
+
+        slot = self.__get_slot(img.nbytes)
+        shm = self.__shms[slot]
+        np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)[...] = img
+
+        job_id = self.__new_job(slot)
+        self.__requests.put((job_id, shm.name, img.shape, img.dtype.str,
+                             encoded, save_path))
+        return job_id
+
+    def __new_job(self, slot) -> int:
+        """ジョブIDを発行する.
+
+        Args:
+            slot(int): 使用する共有メモリの番号(使わない場合はNone)
+
+        Returns:
+            int: ジョブID
+        """
+        job_id = self.__next_job_id
+        self.__next_job_id += 1
+        self.__jobs[job_id] = slot
+        return job_id
+
+    def result(self, job_id: int, timeout=None) -> Detections:
+        """検出結果を受け取る.
+
+        Args:
+            job_id(int): submitが返したジョブID
+            timeout(float): 最大待ち時間[s]. Noneの場合、コンストラクタの値
+
+        Returns:
+            Detections: 検出したオブジェクト
+
+        raise:
+            RuntimeError: ワーカープロセスで検出に失敗した場合に発生
+        """
+        if timeout is None:
+            timeout = self.timeout
+        while job_id not in self.__done:
+            if job_id not in self.__jobs:
+                raise KeyError(f"unknown job id: {job_id}")
+            self.__receive(timeout)
+        result, error = self.__done.pop(job_id)
+        if error is not None:
+            raise RuntimeError(f"detect failed in worker: {error}")
+        objects, times = result
+        self.profiler.record(times)
+        return Detections(objects, times)
+
+    def flush_writes(self, timeout=None) -> None:
+        """DetectObject.flush_writesと同じく、保存待ちの画像の保存を待つ.
+
+        Args:
+            timeout(float): 最大待ち時間[s]. Noneの場合、コンストラクタの値
+        """
+        if not self.is_alive:
+            return
+        if timeout is None:
+            timeout = self.timeout
+        job_id = self.__new_job(None)
+        self.__requests.put((job_id, None, None, None, None, None))
+        while job_id not in self.__done:
+            self.__receive(timeout)
+        self.__done.pop(job_id)
+
+    def detect_object(self, img, save_path=None) -> Detections:
+        """物体の検出を行い、結果を待つ.
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+            save_path(str): 検出結果の画像保存パス
+                            Noneの場合、保存しない
+        Returns:
+            Detections: 検出したオブジェクト
+        """
+        return self.result(self.submit(img, save_path))
+
+    def detect_objects(self, imgs: list, save_paths=None) -> list:
+        """複数画像の物体検出を行う(共有メモリの数だけ並行して要求する).
+
+        Args:
+            imgs(list): 物体検出を行う画像のリスト
+            save_paths(list): 検出結果の画像保存パスのリスト
+        Returns:
+            list: 画像ごとの検出したオブジェクトのリスト
+        """
+        if save_paths is None:
+            save_paths = [None] * len(imgs)
+        job_ids = [self.submit(img, path)
+                   for img, path in zip(imgs, save_paths)]
+        return [self.result(job_id) for job_id in job_ids]
+
+    def close(self) -> None:
+        """ワーカープロセスを終了し、共有メモリを解放する."""
+        if self.__process is not None:
+            self.__requests.put(None)
+            self.__process.join(timeout=10)
+            if self.__process.is_alive():
+                self.__process.terminate()
+            self.__process = None
+        self.__ready = False
+        self.__jobs.clear()
+        self.__done.clear()
+        self.__free_slots = list(range(len(self.__shms)))
+        for i, shm in enumerate(self.__shms):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+                self.__shms[i] = None
+
+    def release_model(self) -> None:
+        """DetectObject.release_modelと同じく、モデル(ワーカープロセス)を解放する."""
+        self.close()
@@ -0,0 +1,171 @@
+"""物体検出の結果をキャッシュするモジュール.
+
+画像の内容(ファイルのバイト列または画素)とモデルの設定(重みファイル, 閾値など)の
+ハッシュをキーとして検出結果を保持し、同じ画像の検出を省く。
+重みファイルや閾値が変わるとキーが変わるため、古い結果は使われない。
+
+@author: kawanoichi
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+
+
+@lru_cache(maxsize=16)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    """ファイルのSHA-256(更新日時とサイズが同じ間はキャッシュする)."""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def file_digest(path) -> str:
+    """ファイルの内容のSHA-256を返す.
+
+    Args:
+        path(str): ファイルパス
+
+    Returns:
+        str: SHA-256(16進数)
+    """
+    stat = os.stat(path)
+    return _file_digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def image_digest(img) -> str:
+    """画像の内容のSHA-256を返す.
+
+    Args:
+        img(str | bytes | np.ndarray): 画像パス, PNGなどのバイト列, BGR画像のいずれか
+                                       画像パスとバイト列はファイルの内容,
+                                       BGR画像は画素と形状から計算する
+
+    Returns:
+        str: SHA-256(16進数)
+    """
+    if isinstance(img, np.ndarray):
+        h = hashlib.sha256(f"{img.shape}{img.dtype.str}".encode())
+        h.update(np.ascontiguousarray(img).data)
+        return h.hexdigest()
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(img).hexdigest()
+    return hashlib.sha256(Path(img).read_bytes()).hexdigest()
+
+
+class DetectionCache:
+    """画像の内容をキーとして検出結果を保持するクラス.
+
+    メモリ上ではmaxsize件までを保持し、最も長く使われていない結果から削除する(LRU)。
+    cache_dirを指定した場合はJSONファイルとしても保存し、プロセスをまたいで再利用する。
+    """
+
+    def __init__(self, maxsize=256, cache_dir=None) -> None:
+        """コンストラクタ.
+
+        Args:
+            maxsize(int): メモリ上に保持する最大件数
+            cache_dir(str): 検出結果を保存するディレクトリ
+                            Noneの場合、ファイルに保存しない
+        """
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be positive: {maxsize}")
+        self.maxsize = maxsize
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()  # キー: キャッシュキー, 値: 検出結果
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """メモリ上に保持している件数."""
+        return len(self.__entries)
+
+    @staticmethod
+    def key(img, fingerprint: str) -> str:
+        """キャッシュキーを作成する.
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+            fingerprint(str): モデルの設定を表す文字列(DetectObject.fingerprint)
+
+        Returns:
+            str: キャッシュキー
+        """
+        return hashlib.sha256(
+            f"{image_digest(img)}:{fingerprint}".encode()).hexdigest()
+
+    def get(self, key: str):
+        """検出結果を取得する.
+
+        Args:
+            key(str): キャッシュキー
+
+        Returns:
+            np.ndarray: 検出したオブジェクト(検出数, 6). キャッシュにない場合はNone
+        """
+        with self.__lock:
+            objects = self.__entries.get(key)
+            if objects is not None:
+                self.__entries.move_to_end(key)
+        if objects is None and self.cache_dir is not None:
+            objects = self.__load(key)
+            if objects is not None:
+                self.__put(key, objects)
+        if objects is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return objects.copy()
+
+    def put(self, key: str, objects) -> None:
+        """検出結果を保持する.
+
+        Args:
+            key(str): キャッシュキー
+            objects: 検出したオブジェクト(Detectionsまたは(検出数, 6)の配列)
+        """
+        objects = np.array(objects, dtype=np.float32).reshape(-1, 6)
+        self.__put(key, objects)
+        if self.cache_dir is not None:
+            self.__save(key, objects)
+
+    def clear(self) -> None:
+        """保持している検出結果を全て削除する(ファイルも削除する)."""
+        with self.__lock:
+            self.__entries.clear()
+        if self.cache_dir is not None:
+            for path in self.cache_dir.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def __put(self, key: str, objects: np.ndarray) -> None:
+        """メモリ上に保持し、上限を超えた分を古い順に削除する."""
+        with self.__lock:
+            self.__entries[key] = objects
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def __load(self, key: str):
+        """ファイルから検出結果を読み込む(読めない場合はNone)."""
+        try:
+            with open(self.cache_dir / f"{key}.json") as f:
+                objects = json.load(f)["objects"]
+            return np.array(objects, dtype=np.float32).reshape(-1, 6)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def __save(self, key: str, objects: np.ndarray) -> None:
+        """検出結果をファイルに保存する."""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self.cache_dir / f"{key}.json"
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump({"objects": objects.tolist()}, f)
+            os.replace(tmp, path)  # 読み込み中のプロセスに書きかけを見せない
+        except OSError as e:
+            print("Warning: detection cache is not saved:", e)
@@ -0,0 +1,91 @@
+"""物体検出の検出結果を保持するモジュール.
+
+DetectObject, DnnDetectObject, DetectWorkerが返す検出結果(Detections)を定義する。
+
+@author: kawanoichi
+"""
+
+import numpy as np
+
+
+class Detections:
+    """検出結果.
+
+    (検出数, 6)のfloat32配列1つで保持し、列ごとの名前付きビューを持つ。
+    各行は[x_min, y_min, x_max, y_max, conf, cls]。
+    len, 反復, インデックス, np.asarrayでリストや配列と同じように扱える。
+    """
+
+    __slots__ = ("data", "times")
+
+    def __init__(self, objects=(), times=None):
+        """コンストラクタ.
+
+        Args:
+            objects: 検出したオブジェクト((検出数, 6)の配列またはリスト)
+            times(dict): ステージごとの処理時間[s](キー: ステージ名)
+        """
+        self.data = np.asarray(objects, dtype=np.float32).reshape(-1, 6)
+        self.times = dict(times or {})
+
+    def __len__(self) -> int:
+        """検出数."""
+        return len(self.data)
+
+    def __iter__(self):
+        """検出したオブジェクト(長さ6の配列)を順に返す."""
+        return iter(self.data)
+
+    def __getitem__(self, index):
+        """検出したオブジェクトを返す."""
+        return self.data[index]
+
+    def __array__(self, dtype=None, copy=None):
+        """np.asarrayで(検出数, 6)の配列として扱う."""
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    def __eq__(self, other) -> bool:
+        """検出結果が一致するかどうか(リストとも比較できる)."""
+        if isinstance(other, (Detections, list, tuple, np.ndarray)):
+            other = np.asarray(other, dtype=np.float32).reshape(-1, 6)
+            return np.array_equal(self.data, other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        """検出結果の文字列表現."""
+        return f"Detections({self.data.tolist()})"
+
+    @property
+    def boxes(self) -> np.ndarray:
+        """バウンディングボックス(検出数, 4)[x_min, y_min, x_max, y_max]."""
+        return self.data[:, :4]
+
+    @property
+    def confs(self) -> np.ndarray:
+        """信頼度(検出数,)."""
+        return self.data[:, 4]
+
+    @property
+    def classes(self) -> np.ndarray:
+        """クラスID(検出数,)."""
+        return self.data[:, 5].astype(np.int64)
+
+    def of_class(self, cls: int) -> np.ndarray:
+        """指定したクラスの検出結果を返す.
+
+        Args:
+            cls(int): クラスID
+
+        Returns:
+            np.ndarray: (検出数, 6)の配列
+        """
+        return self.data[self.data[:, 5] == cls]
+
+    def tolist(self) -> list:
+        """検出結果をリスト(JSONなど)に変換する."""
+        return self.data.tolist()
+
+    @property
+    def total_time(self) -> float:
+        """全ステージの処理時間の合計[s]."""
+        return sum(self.times.values())
@@ -0,0 +1,272 @@
+"""OpenCVのDNNモジュールで物体検出を行うモジュール.
+
+torchをimportせずに物体検出を行う。
+yolo/export.pyでエクスポートしたONNXモデルを使用する。
+    $ poetry run python yolo/export.py --include onnx
+
+@author: kawanoichi
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import yaml
+from pathlib import Path
+
+script_dir = os.path.dirname(os.path.abspath(__file__))  # noqa
+YOLO_PATH = os.path.join(script_dir, "..", "yolo")  # noqa
+sys.path.append(YOLO_PATH)  # noqa
+YOLO_PATH = Path(YOLO_PATH)  # noqa
+from utils.augmentations import cv2, letterbox
+from utils.nms import nms_numpy
+from utils.plots import Annotator, colors
+from image_processing import ImageProcessing
+from detections import Detections
+
+PROJECT_DIR_PATH = os.path.dirname(script_dir)
+IMAGE_DIR_PATH = Path(os.path.join(PROJECT_DIR_PATH, "fig_image"))
+
+
+class DnnDetectObject():
+    """OpenCV DNNで物体検出を行うクラス.
+
+    DetectObjectと同じ形式の検出結果を返す。
+    """
+
+    def __init__(self,
+                 weights=YOLO_PATH/'learned_fig_weight_ver2.onnx',
+                 label_data=YOLO_PATH/'fig_label.yaml',
+                 conf_thres=0.6,
+                 iou_thres=0.45,
+                 max_det=10,
+                 line_thickness=1,
+                 stride=32,
+                 img_size=(384, 480)):
+        """コンストラクタ.
+
+        Args:
+            weights (str): ONNXファイルパス
+            label_data (str): ラベルを記述したファイルパス
+            conf_thres (float): 信頼度閾値
+            iou_thres (float): NMS IOU 閾値
+            max_det (int): 最大検出数
+            line_thickness (int): バウンディングボックスの太さ
+            stride (int): ストライド
+            img_size (tuple): ONNXモデルの入力サイズ(高さ, 幅)
+                              エクスポート時の--imgszと合わせる
+        """
+        self.check_exist(weights)
+        self.check_exist(label_data)
+        self.weights = str(weights)
+        self.label_data = str(label_data)
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_det = max_det
+        self.line_thickness = line_thickness
+        self.stride = stride
+        self.img_size = tuple(img_size)
+        self.net = None
+        self.labels = None
+
+    # ファイル, ディレクトリが存在するかの確認
+    check_exist = staticmethod(ImageProcessing.check_exist)
+
+    @property
+    def is_loaded(self) -> bool:
+        """モデルが読み込み済みかどうか."""
+        return self.net is not None
+
+    def load_model(self):
+        """モデルを読み込む. 読み込み済みの場合は再利用する.
+
+        Returns:
+            cv2.dnn.Net: 読み込んだモデル
+        """
+        if self.net is None:
+            with open(self.label_data, errors='ignore') as f:
+                names = yaml.safe_load(f)['names']
+            if isinstance(names, (list, tuple)):
+                names = dict(enumerate(names))
+            self.labels = names
+            self.net = cv2.dnn.readNetFromONNX(self.weights)
+        return self.net
+
+    def release_model(self) -> None:
+        """読み込み済みのモデルを解放する."""
+        self.net = None
+
+    def preprocess(self, original_img: np.ndarray) -> np.ndarray:
+        """推論用に画像を前処理する.
+
+        Args:
+            original_img(np.ndarray): BGR画像
+
+        Returns:
+            np.ndarray: (1, 3, H, W)のRGB画像(0.0 - 1.0)
+        """
+        # モデルの入力サイズまでパディング
+        img = letterbox(original_img,
+                        self.img_size,
+                        stride=self.stride,
+                        auto=False)[0]
+        # BGR -> RGB, HWC -> CHW, 0 - 255 to 0.0 - 1.0
+        return cv2.dnn.blobFromImage(img, 1 / 255, swapRB=True)
+
+    def non_max_suppression(self, pred: np.ndarray) -> np.ndarray:
+        """非最大値抑制 (NMS) により重複検出を除く.
+
+        Args:
+            pred(np.ndarray): 1枚分の推論結果(n, 5 + クラス数)
+                              [x_center, y_center, width, height,
+                               obj_conf, cls_conf...]
+
+        Returns:
+            np.ndarray: 検出結果(n, 6) [x_min, y_min, x_max, y_max, conf, cls]
+        """
+        # 物体らしさが閾値を超えた候補だけをNMSする
+        # (DetectObjectの軽量なNMSと同じ処理)
+        return nms_numpy(pred[pred[:, 4] > self.conf_thres],
+                         self.conf_thres,
+                         self.iou_thres,
+                         max_det=self.max_det)
+
+    def scale_boxes(self,
+                    objects: np.ndarray,
+                    original_shape: tuple) -> np.ndarray:
+        """検出結果を推論時のサイズから元画像のサイズに再スケールする.
+
+        Args:
+            objects(np.ndarray): 検出結果(n, 6)
+            original_shape(tuple): 元画像のサイズ(高さ, 幅, ...)
+
+        Returns:
+            np.ndarray: 元画像の座標での検出結果(n, 6)
+        """
+        h, w = self.img_size
+        gain = min(h / original_shape[0], w / original_shape[1])
+        pad_w = (w - original_shape[1] * gain) / 2
+        pad_h = (h - original_shape[0] * gain) / 2
+        objects[:, [0, 2]] -= pad_w
+        objects[:, [1, 3]] -= pad_h
+        objects[:, :4] /= gain
+        objects[:, [0, 2]] = objects[:, [0, 2]].clip(0, original_shape[1])
+        objects[:, [1, 3]] = objects[:, [1, 3]].clip(0, original_shape[0])
+        objects[:, :4] = objects[:, :4].round()
+        return objects
+
+    def annotate(self, original_img: np.ndarray, objects) -> np.ndarray:
+        """検出結果を描画した画像を作成する.
+
+        Args:
+            original_img(np.ndarray): 元画像(BGR). 変更されない
+            objects: 元画像の座標での検出結果(n, 6)
+
+        Returns:
+            np.ndarray: 検出結果を描画した画像(BGR)
+        """
+        self.load_model()
+        save_img = original_img.copy()
+
+        # DetectObjectと同じAnnotatorで描画する
+        annotator = Annotator(save_img, line_width=self.line_thickness)
+        for *xyxy, conf, cls in reversed(objects):
+            c = int(cls)
+            label = f'{self.labels[c]} {conf:.2f}'
+            annotator.box_label(xyxy, label, color=colors(c, True))
+
+        return annotator.result()
+
+    def detect_object(self,
+                      img=IMAGE_DIR_PATH/'test_image.png',
+                      save_path=None,
+                      annotate=False):
+        """物体の検出を行う関数.
+
+        Args:
+            img(str | bytes | np.ndarray): 物体検出を行う画像
+                                           画像パス, PNGなどのバイト列, BGR画像のいずれか
+            save_path(str): 検出結果の画像保存パス
+                            Noneの場合、保存しない
+            annotate(bool): Trueの場合、検出結果を描画した画像も返す
+        Returns:
+            Detections: 検出したオブジェクト
+            np.ndarray: 検出結果を描画した画像(BGR). annotate=Trueの場合のみ
+        """
+        if isinstance(img, (str, Path)):
+            self.check_exist(img)
+        original_img = ImageProcessing.load_img(img)  # BGR
+
+        # 検出
+        net = self.load_model()
+        net.setInput(self.preprocess(original_img))
+        pred = net.forward()
+
+        objects = self.non_max_suppression(pred[0])
+        name = Path(img).name if isinstance(img, (str, Path)) else "image"
+        print(name, " 検出数", len(objects))
+
+        objects = self.scale_boxes(objects, original_img.shape)
+        annotated_img = None
+        if save_path is not None or annotate:
+            annotated_img = self.annotate(original_img, objects)
+        if save_path is not None and len(objects):
+            cv2.imwrite(save_path, annotated_img)
+
+        """
+        NOTE:
+            objectsの型について
+             行数:検出数
+             列数:6列([x_min, y_min, x_max, y_max, conf, cls])
+        """
+        objects = Detections(objects)
+        return (objects, annotated_img) if annotate else objects
+
+
+if __name__ == '__main__':
+    """作業用.
+    $ poetry run python ./src/dnn_detect_object.py
+        --img_path fig_image/test_image.png --compare
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenCV DNNによる物体検出")
+    parser.add_argument("-wpath", "--weights", type=str,
+                        default=YOLO_PATH/'learned_fig_weight_ver2.onnx',
+                        help='ONNXファイルパス')
+    parser.add_argument("-label", "--label_data", type=str,
+                        default=YOLO_PATH/'fig_label.yaml',
+                        help='ラベルを記述したファイルパス')
+    parser.add_argument("-img", "--img_path", type=str,
+                        default=IMAGE_DIR_PATH/'FigA_1.png', help='入力画像')
+    parser.add_argument("-n", "--repeat", type=int, default=10,
+                        help='レイテンシ計測の繰り返し回数')
+    parser.add_argument("--compare", type=str, default=None,
+                        help='比較するPyTorchの重みファイルパス')
+    args = parser.parse_args()
+
+    def measure(d) -> None:
+        """読み込み時間と検出のレイテンシを表示する."""
+        t = time.perf_counter()
+        d.load_model()
+        load_time = time.perf_counter() - t
+        times = []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            objects = d.detect_object(args.img_path)
+            times.append(time.perf_counter() - t)
+        print(f"{type(d).__name__}: load {load_time * 1000:.1f}ms, "
+              f"first {times[0] * 1000:.1f}ms, "
+              f"median {np.median(times) * 1000:.1f}ms")
+        print("objects\n", objects)
+
+    measure(DnnDetectObject(args.weights, args.label_data))
+    print("torch imported:", "torch" in sys.modules)
+
+    if args.compare:
+        t = time.perf_counter()
+        from detect_object import DetectObject
+        print(f"import detect_object: {(time.perf_counter() - t):.2f}s")
+        measure(DetectObject(args.compare, args.label_data))
+
+    print("完了")
@@ -14,8 +14,57 @@ class ImageProcessing:
         以下の関数を保持.
         ・画像の鮮明化(sharpen_image)
         ・画像のリサイズ(resize_img)
+        ・画像の読み込み(load_img)
+        ・ファイルの存在確認(check_exist)
     """
 
+    @staticmethod
+    def check_exist(path: str) -> None:
+        """ファイル, ディレクトリが存在するかの確認.
+
+        Args:
+            path (str): ファイルまたはディレクトリのパス
+
+        raise:
+            FileNotFoundError: ファイルがない場合に発生
+        """
+        try:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"'{path}' is not found")
+
+        except FileNotFoundError as e:
+            print("Error:", e)
+
+    @staticmethod
+    def load_img(img) -> np.ndarray:
+        """画像パス, PNGなどのエンコード済みバイト列, BGR画像をBGR画像として取得する.
+
+        Args:
+            img(str | bytes | np.ndarray): 画像パス, エンコード済みバイト列, BGR画像
+                                           BGR画像の場合はそのまま返す
+
+        Return:
+            result(np.ndarray): BGR画像
+
+        Raises:
+            FileNotFoundError: 画像が見つからない場合に発生
+            ValueError: 画像のデコードに失敗した場合に発生
+        """
+        if isinstance(img, np.ndarray):
+            return img
+
+        if isinstance(img, (bytes, bytearray, memoryview)):
+            result = cv2.imdecode(np.frombuffer(img, np.uint8),
+                                  cv2.IMREAD_COLOR)
+            if result is None:
+                raise ValueError("failed to decode image bytes")
+            return result
+
+        result = cv2.imread(str(img))  # BGR
+        if result is None:
+            raise FileNotFoundError(f"'{img}' is not found")
+        return result
+
     @staticmethod
     def sharpen_image(img_path: str, save_path=None) -> np.ndarray:
         """画像の鮮明化を行う関数.
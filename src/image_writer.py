@@ -0,0 +1,96 @@
+"""検出結果の画像の描画と保存をバックグラウンドで行うモジュール.
+
+検出結果の描画とPNGのエンコード, 書き込みは検出結果を使う処理には不要なため、
+別スレッドで行い、物体検出はNMSと座標の変換が終わった時点で結果を返す。
+
+@author: kawanoichi
+"""
+
+import queue
+import threading
+import cv2
+
+from latency_profiler import LatencyProfiler
+
+
+class ImageWriter:
+    """検出結果の画像を描画して保存するクラス.
+
+    保存待ちの画像はmaxsize件までとし、超えた場合はsubmitが空きを待つ
+    (保存が追いつかない場合に元画像がメモリに溜まり続けないようにする)。
+    """
+
+    def __init__(self, annotate, maxsize=4, profiler=None) -> None:
+        """コンストラクタ.
+
+        Args:
+            annotate: 検出結果を描画する関数
+                      annotate(元画像, 検出結果) -> 描画した画像
+            maxsize(int): 保存待ちの最大件数
+            profiler(LatencyProfiler): 描画, 保存の処理時間の記録先
+        """
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be positive: {maxsize}")
+        self.annotate = annotate
+        self.profiler = profiler if profiler is not None \
+            else LatencyProfiler()
+        self.errors = []  # 保存に失敗した(保存パス, エラー)
+        self.__requests = queue.Queue(maxsize)
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def submit(self, original_img, objects, save_path: str) -> None:
+        """検出結果の画像の保存を要求する.
+
+        Args:
+            original_img(np.ndarray): 元画像(BGR). 保存が終わるまで変更しないこと
+            objects(np.ndarray): 元画像の座標での検出結果(n, 6)
+                                 Noneの場合、original_imgを描画済みの画像として保存する
+            save_path(str): 検出結果の画像保存パス
+        """
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run,
+                                                 daemon=True)
+                self.__thread.start()
+        self.__requests.put((original_img, objects, save_path))
+
+    def flush(self) -> None:
+        """要求済みの画像の保存が全て終わるまで待つ."""
+        self.__requests.join()
+
+    def close(self) -> None:
+        """要求済みの画像を保存してから保存スレッドを終了する."""
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__requests.put(None)
+            thread.join()
+
+    def __run(self) -> None:
+        """保存スレッド."""
+        while True:
+            request = self.__requests.get()
+            try:
+                if request is None:
+                    return
+                self.__write(*request)
+            finally:
+                self.__requests.task_done()
+
+    def __write(self, original_img, objects, save_path: str) -> None:
+        """検出結果を描画して保存する."""
+        times = {}
+        try:
+            if objects is None:
+                save_img = original_img
+            else:
+                with self.profiler.measure(times, "annotate"):
+                    save_img = self.annotate(original_img, objects)
+            with self.profiler.measure(times, "write"):
+                if not cv2.imwrite(save_path, save_img):
+                    raise OSError(f"failed to write '{save_path}'")
+        except Exception as e:
+            print("Error: detect image is not saved:", e)
+            self.errors.append((save_path, e))
+        self.profiler.record(times)
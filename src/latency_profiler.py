@@ -0,0 +1,93 @@
+"""処理時間を計測するモジュール.
+
+物体検出の各ステージ(モデルの読み込み, 前処理, 推論, NMSなど)の処理時間を記録し、
+実行中の全呼び出しについて集計する。
+
+@author: kawanoichi
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+class LatencyProfiler:
+    """ステージごとの処理時間を記録, 集計するクラス."""
+
+    # 集計結果を表示する順番
+    STAGES = ("load", "cache", "read", "letterbox", "tensor", "forward",
+              "nms", "rescale", "annotate", "write")
+
+    def __init__(self, clock=time.perf_counter) -> None:
+        """コンストラクタ.
+
+        Args:
+            clock: 現在時刻[s]を返す関数
+        """
+        self.clock = clock
+        self.records = {}  # キー: ステージ名, 値: 処理時間[s]のリスト
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, times: dict, stage: str, n=1):
+        """withブロックの処理時間をtimes[stage]に加算する.
+
+        Args:
+            times(dict): 処理時間の格納先
+            stage(str): ステージ名
+            n(int): 処理時間を等分する数(まとめて処理した画像の枚数)
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            times[stage] = times.get(stage, 0.0) + \
+                (self.clock() - start) / n
+
+    def record(self, times: dict) -> None:
+        """1回分(1画像分)の処理時間を記録する.
+
+        Args:
+            times(dict): ステージごとの処理時間[s]
+        """
+        with self.__lock:
+            for stage, t in times.items():
+                self.records.setdefault(stage, []).append(t)
+
+    def reset(self) -> None:
+        """記録した処理時間を消去する."""
+        with self.__lock:
+            self.records = {}
+
+    def summary(self) -> dict:
+        """ステージごとに処理時間を集計する.
+
+        Returns:
+            dict: キー: ステージ名,
+                  値: {"count", "mean", "p50", "p95", "max"}(単位は秒)
+        """
+        with self.__lock:
+            records = {k: np.array(v) for k, v in self.records.items()}
+
+        stages = [s for s in self.STAGES if s in records] + \
+            sorted(s for s in records if s not in self.STAGES)
+        return {s: {"count": len(records[s]),
+                    "mean": float(records[s].mean()),
+                    "p50": float(np.percentile(records[s], 50)),
+                    "p95": float(np.percentile(records[s], 95)),
+                    "max": float(records[s].max())} for s in stages}
+
+    def report(self) -> str:
+        """集計結果を表形式の文字列にする(単位はミリ秒).
+
+        Returns:
+            str: 集計結果の表
+        """
+        lines = [f"{'stage':>10}{'count':>7}{'mean':>9}"
+                 f"{'p50':>9}{'p95':>9}{'max':>9}"]
+        for stage, s in self.summary().items():
+            lines.append(f"{stage:>10}{s['count']:>7}" +
+                         "".join(f"{s[k] * 1000:>9.1f}"
+                                 for k in ("mean", "p50", "p95", "max")))
+        return "\n".join(lines)
@@ -0,0 +1,97 @@
+"""物体検出のHTTPサーバの負荷試験を行うモジュール.
+
+複数スレッドから同時に検出を要求し、スループットとレイテンシの分布を計測する。
+サーバのURLを指定しない場合は、このプロセス内でサーバを起動する。
+
+    $ poetry run python src/load_test_detect_server.py --concurrency 1 4 8
+    $ poetry run python src/load_test_detect_server.py --url URL
+
+@author: kawanoichi
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark_detect import TEST_IMG_DIR, latency_stats, load_images
+from detect_server import DetectClient, DetectServer
+
+
+def load_test(url: str, imgs: list, concurrency=4, n_requests=32) -> dict:
+    """同時に検出を要求し、スループットとレイテンシを計測する.
+
+    Args:
+        url(str): サーバのURL
+        imgs(list): 要求する画像(PNGのバイト列)のリスト. 順番に繰り返し使う
+        concurrency(int): 同時に要求するクライアントの数
+        n_requests(int): 要求の総数
+
+    Returns:
+        dict: 計測結果
+              latencyの単位は秒, throughputの単位は枚/秒
+    """
+    clients = [DetectClient(url) for _ in range(concurrency)]
+
+    def request(i):
+        start = time.perf_counter()
+        clients[i % concurrency].detect_object(imgs[i % len(imgs)])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(request, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    return {"concurrency": concurrency,
+            "requests": n_requests,
+            "elapsed": elapsed,
+            "throughput": n_requests / elapsed,
+            "latency": latency_stats(latencies)}
+
+
+if __name__ == '__main__':
+    """作業用.
+    $ poetry run python src/load_test_detect_server.py
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="物体検出サーバの負荷試験")
+    parser.add_argument("--url", type=str, default=None,
+                        help='サーバのURL. 指定しない場合、サーバを起動する')
+    parser.add_argument("-wpath", "--weights", type=str, default=None,
+                        help='重みファイルパス(サーバを起動する場合)')
+    parser.add_argument("-label", "--label_data", type=str, default=None,
+                        help='ラベルを記述したファイルパス(サーバを起動する場合)')
+    parser.add_argument("--img_dir", type=str, nargs="+",
+                        default=[str(TEST_IMG_DIR)],
+                        help='画像(*.png)を格納したディレクトリ')
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[1, 4], help='同時に要求するクライアントの数')
+    parser.add_argument("-n", "--requests", type=int, default=32,
+                        help='要求の総数')
+    parser.add_argument("--batch_window", type=float, default=0.01,
+                        help='サーバで要求をまとめる時間[s]')
+    parser.add_argument("--max_batch", type=int, default=4,
+                        help='サーバでまとめる最大件数')
+    args = parser.parse_args()
+
+    imgs = [img for _, img in load_images(args.img_dir)]
+    server = None
+    url = args.url
+    if url is None:
+        kwargs = {k: v for k, v in (("weights", args.weights),
+                                    ("label_data", args.label_data)) if v}
+        server = DetectServer(port=0, batch_window=args.batch_window,
+                              max_batch=args.max_batch, **kwargs)
+        server.start()
+        server.detector.wait_ready()
+        url = server.url
+
+    try:
+        DetectClient(url).detect_object(imgs[0])  # ウォームアップ
+        for concurrency in args.concurrency:
+            result = load_test(url, imgs, concurrency, args.requests)
+            print(json.dumps(result, indent=2))
+    finally:
+        if server is not None:
+            server.close()
@@ -3,10 +3,16 @@
 競技システムとの通信を行うクラス.
 @author: miyashita64 kawanoichi
 """
+import struct
+import cv2
 import requests
+from pathlib import Path
 from image_processing import ImageProcessing
 from PIL import Image
 
+# PNGファイルの先頭8バイト
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
 
 class ResponseError(Exception):
     """レスポンスエラー用の例外."""
@@ -50,11 +56,12 @@ class OfficialInterface:
         return success
 
     @classmethod
-    def upload_snap(cls, img_path: str) -> bool:
+    def upload_snap(cls, img) -> bool:
         """フィグ画像をアップロードする.
 
         Args:
-            img_path (str): アップロードする画像のパス
+            img (str | bytes | np.ndarray): アップロードする画像
+                                            画像パス, PNGのバイト列, BGR画像のいずれか
 
         Returns:
             success (bool): 通信が成功したか(成功:true/失敗:false)
@@ -70,15 +77,8 @@ class OfficialInterface:
         }
 
         try:
-            # サイズが正しくない場合はリサイズする
-            img = Image.open(img_path)
-            width, height = img.size
-            if not (width == 640 and height == 480):
-                ImageProcessing.resize_img(img_path, img_path, 640, 480)
-
             # bytes型で読み込み
-            with open(img_path, "rb") as image_file:
-                image_data = image_file.read()
+            image_data = cls.to_png_bytes(img)
 
             # APIにリクエストを送信
             response = requests.post(url, headers=headers,
@@ -92,6 +92,46 @@ class OfficialInterface:
             success = False
         return success
 
+    @staticmethod
+    def to_png_bytes(img, width=640, height=480) -> bytes:
+        """アップロードする画像を指定サイズのPNGのバイト列にする.
+
+        Args:
+            img (str | bytes | np.ndarray): 画像パス, PNGのバイト列, BGR画像のいずれか
+            width (int): アップロードする画像の幅
+            height (int): アップロードする画像の高さ
+
+        Returns:
+            bytes: PNGのバイト列
+
+        NOTE:
+            画像パスの場合、サイズが正しくなければファイル自体をリサイズする。
+            バイト列, BGR画像の場合はファイルを介さずにメモリ上で処理する。
+        """
+        if isinstance(img, (str, Path)):
+            # サイズが正しくない場合はリサイズする
+            with Image.open(img) as pil_img:
+                size = pil_img.size
+            if size != (width, height):
+                ImageProcessing.resize_img(str(img), str(img), width, height)
+
+            with open(img, "rb") as image_file:
+                return image_file.read()
+
+        if isinstance(img, (bytes, bytearray)):
+            # サイズが正しいPNGはそのまま送信する
+            if img[:8] == PNG_SIGNATURE and \
+                    struct.unpack(">II", img[16:24]) == (width, height):
+                return bytes(img)
+            img = ImageProcessing.load_img(img)
+
+        if img.shape[:2] != (height, width):
+            img = cv2.resize(img, (width, height))
+        success, encoded_img = cv2.imencode(".png", img)
+        if not success:
+            raise ValueError("failed to encode fig image.")
+        return encoded_img.tobytes()
+
 
 if __name__ == "__main__":
     print("test-start")
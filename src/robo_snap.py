@@ -6,8 +6,10 @@ import os
 import time
 import numpy as np
 
-from detect_object import DetectObject
+from detection_cache import DetectionCache
+from detections import Detections
 from official_interface import OfficialInterface
+from image_processing import ImageProcessing
 from client import Client
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -38,13 +40,21 @@ class RoboSnap:
 
     def __init__(self,
                  raspike_ip="172.20.1.1",
+                 detector=None,
                  ) -> None:
         """コンストラクタ.
 
         Args:
             raspike_ip: 走行体のIPアドレス
+            detector(DetectObject | DetectWorker): 物体検出に使うインスタンス
+                                    (事前にモデルを読み込んだもの)
+                                    Noneの場合、デフォルトのパラメータで作成する
+                                    DetectWorkerの場合、検出中に次の画像を取得する
         """
         self.raspike_ip = raspike_ip
+        self.detector = detector
+        # 物体検出中に先に取得した画像(画像名, 画像パス)
+        self.prefetched_img = None
 
         self.fig_B_img_path = None
         self.successful_send_fig_B = False
@@ -55,6 +65,9 @@ class RoboSnap:
         self.candidate_img_path = None
         self.successful_send_candidate = False
 
+        # 読み込み済みの画像(キー: 画像パス, 値: (受信したバイト列, BGR画像))
+        self.loaded_imgs = {}
+
     def scp_fig_image(self) -> (str, str):
         """走行体からフィグ画像を取得するbashファイルを実行する関数.
 
@@ -83,13 +96,92 @@ class RoboSnap:
 
         return None, None
 
+    def next_fig_image(self) -> (str, str):
+        """次のフィグ画像を取得する.
+
+        物体検出中に先に取得した画像があればそれを返す。
+
+        Returns:
+            img_name(str): ファイル(画像)名
+            img_path(str): 画像パス
+        """
+        if self.prefetched_img is not None:
+            img_name, img_path = self.prefetched_img
+            self.prefetched_img = None
+            return img_name, img_path
+        return self.scp_fig_image()
+
+    def detect(self, d, img, save_path: str) -> list:
+        """物体検出を行う.
+
+        別プロセスで検出できる場合は、検出中に次の画像の取得を1回試みる。
+
+        Args:
+            d(DetectObject | DetectWorker): 物体検出に使うインスタンス
+            img(str | np.ndarray): 画像パスまたはBGR画像
+            save_path(str): 検出結果の画像保存パス
+
+        Returns:
+            list: 検出したオブジェクト
+        """
+        if not hasattr(d, "submit"):
+            return d.detect_object(img=img, save_path=save_path)
+
+        job_id = d.submit(img, save_path)
+        if self.prefetched_img is None:
+            img_name, img_path = self.scp_fig_image()
+            if img_name is not None:
+                self.prefetched_img = (img_name, img_path)
+        return d.result(job_id)
+
+    def load_fig_image(self, img_path: str):
+        """受信したフィグ画像を読み込む.
+
+        読み込んだ画像は検出, アップロードでファイルを介さずに使い回す。
+        アップロード用に受信したバイト列も保持する。
+
+        Args:
+            img_path(str): 画像パス
+
+        Returns:
+            np.ndarray: BGR画像. 読み込みに失敗した場合はNone
+        """
+        try:
+            with open(img_path, "rb") as f:
+                data = f.read()
+            img = ImageProcessing.load_img(data)
+        except Exception as e:
+            print("Error:", e)
+            return None
+        self.loaded_imgs[img_path] = (data, img)
+        return img
+
+    def upload_snap(self, img_path: str) -> bool:
+        """フィグ画像をアップロードする.
+
+        読み込み済みの画像はファイルを再度読み込まずにアップロードする。
+        受信したバイト列がアップロードするサイズの場合はそのまま送信し、
+        リサイズが必要な場合だけBGR画像をエンコードする。
+
+        Args:
+            img_path(str): 画像パス
+
+        Returns:
+            success (bool): 通信が成功したか(成功:true/失敗:false)
+        """
+        if img_path not in self.loaded_imgs:
+            return OfficialInterface.upload_snap(img_path)
+        data, img = self.loaded_imgs[img_path]
+        return OfficialInterface.upload_snap(
+            data if img.shape[:2] == (480, 640) else img)
+
     def check_bestshot(self, objects) -> int:
         """ベストショット画像らしさスコアの算出.
 
         信頼度は検出時にフィルターをかけているので検出したクラスと座標で判断する
 
         Args:
-            objects: 検出した物体
+            objects(Detections | list): 検出した物体
 
         Returns:
             int: ベストショット画像らしさスコア
@@ -116,53 +208,49 @@ class RoboSnap:
         if len(objects) == 0:
             return 0
 
-        # objectをラベルごとに仕分け
-        objects_np = np.array(objects)
-        index_of_fig = np.where(objects_np[:, 5] == 0)
-        index_of_frontalface = np.where(objects_np[:, 5] == 1)
-        index_of_profile = np.where(objects_np[:, 5] == 2)
-
-        if index_of_fig[0].size > 0 \
-                and index_of_frontalface[0].size > 0:
-            # 2つのボックスが重なっているかを確認
-            for fig in objects_np[index_of_fig]:
-                for frontalface in objects_np[index_of_frontalface]:
-                    # (x1_min < x2_max and x2_min < x1_max) \
-                    #     and (y2_min < y1_max and y1_min < y2_max)
-                    if fig[0] < frontalface[2] and \
-                            frontalface[0] < fig[2] and \
-                            frontalface[1] < fig[3] and \
-                            fig[1] < frontalface[3]:
-                        return 5
+        # objectをラベルごとに仕分け(リストの場合は配列にまとめる)
+        if not isinstance(objects, Detections):
+            objects = Detections(objects)
+        figs = objects.of_class(0)
+        frontalfaces = objects.of_class(1)
+        profiles = objects.of_class(2)
+
+        if len(figs) and len(frontalfaces):
             # 重なってない場合、"FrontalFace"を信用しない
-            return 3
+            return 5 if self.overlaps(figs, frontalfaces) else 3
 
-        elif index_of_fig[0].size > 0 \
-                and index_of_profile[0].size > 0:
-            # 2つのボックスが重なっているかを確認
-            for fig in objects_np[index_of_fig]:
-                for profile in objects_np[index_of_profile]:
-                    # (x1_min < x2_max and x2_min < x1_max) \
-                    #     and (y2_min < y1_max and y1_min < y2_max)
-                    if fig[0] < profile[2] and \
-                            profile[0] < fig[2] and \
-                            profile[1] < fig[3] and \
-                            fig[1] < profile[3]:
-                        return 4
+        elif len(figs) and len(profiles):
             # 重なってない場合、"Profile"を信用しない
-            return 3
+            return 4 if self.overlaps(figs, profiles) else 3
 
-        elif index_of_fig[0].size > 0:
+        elif len(figs):
             return 3
 
-        elif index_of_frontalface[0].size > 0:
+        elif len(frontalfaces):
             return 2
 
-        elif index_of_profile[0].size > 0:
+        elif len(profiles):
             return 1
         else:
             return 0
 
+    @staticmethod
+    def overlaps(boxes1: np.ndarray, boxes2: np.ndarray) -> bool:
+        """2種類のバウンディングボックスに重なっている組があるかを確認する.
+
+        Args:
+            boxes1(np.ndarray): (n, 4以上)[x_min, y_min, x_max, y_max, ...]
+            boxes2(np.ndarray): (m, 4以上)[x_min, y_min, x_max, y_max, ...]
+
+        Returns:
+            bool: 重なっている組がある場合True
+        """
+        b1, b2 = boxes1[:, None, :4], boxes2[None, :, :4]
+        # (x1_min < x2_max and x2_min < x1_max) \
+        #     and (y2_min < y1_max and y1_min < y2_max)
+        return bool(((b1[..., :2] < b2[..., 2:]) &
+                     (b2[..., :2] < b1[..., 2:])).all(-1).any())
+
     def show_result(self) -> None:
         """最終結果を表示する."""
         print(f"\n- 最終結果")
@@ -173,7 +261,13 @@ class RoboSnap:
     def start_snap(self) -> None:
         """ロボコンスナップを攻略する."""
         # 物体検出のパラメータはデフォルト通り
-        d = DetectObject()
+        # 同じ画像を再取得した場合は検出結果を再利用する
+        # 検出結果の画像は別スレッドで保存する(検出結果を待つ時間を短くする)
+        if self.detector is not None:
+            d = self.detector
+        else:
+            from detect_object import DetectObject
+            d = DetectObject(cache=DetectionCache(), async_write=True)
 
         try:
             max_score = -1  # score初期値
@@ -185,7 +279,7 @@ class RoboSnap:
                 # 走行体から画像を取得
                 while True:  # 画像が見つかるまでループ
                     # 画像の受信試み
-                    img_name, img_path = self.scp_fig_image()
+                    img_name, img_path = self.next_fig_image()
 
                     # 画像を受信したらループを抜ける
                     if img_name is not None:
@@ -204,11 +298,15 @@ class RoboSnap:
 
                     time.sleep(2)
 
+                # 画像の読み込み(以降はファイルを介さずに処理する)
+                if img_name is not None:
+                    img = self.load_fig_image(img_path)
+
                 # 配置エリアBの画像を取得した時の処理
                 if img_name == self.fig_img_B:
                     self.fig_B_img_path = img_path
                     # 配置エリアBの画像は検出せずにアップロード
-                    if OfficialInterface.upload_snap(self.fig_B_img_path):
+                    if self.upload_snap(self.fig_B_img_path):
                         self.successful_send_fig_B = True
                         if self.successful_send_best_shot or \
                                 self.successful_send_candidate:
@@ -223,7 +321,7 @@ class RoboSnap:
                 # コースアウトしているならば、候補写真を送信し、次の画像を探し続ける
                 if timeout_flag:
                     if self.candidate_img_path is not None:
-                        if OfficialInterface.upload_snap(
+                        if self.upload_snap(
                                 self.candidate_img_path):
                             self.successful_send_candidate = True
                             if self.successful_send_fig_B:
@@ -235,8 +333,9 @@ class RoboSnap:
                 detected_img_path = os.path.join(
                     self.img_dir_path, "detected_"+img_name)
                 try:
-                    objects = d.detect_object(img_path=img_path,
-                                              save_path=detected_img_path)
+                    objects = self.detect(
+                        d, img_path if img is None else img,
+                        detected_img_path)
                 except Exception:
                     print("Error: detect failed")
                     objects = []
@@ -252,7 +351,7 @@ class RoboSnap:
                     self.best_shot_img = img_name
                     self.best_shot_img_path = img_path
                     # 候補画像のアップロード
-                    if OfficialInterface.upload_snap(img_path):
+                    if self.upload_snap(img_path):
                         # Skipフラグを立てる
                         client = Client(self.raspike_ip)
                         success = client.set_true_camera_action_skip()
@@ -289,30 +388,45 @@ class RoboSnap:
             # ベストショット確定と判断できる画像がなかった場合
             if self.successful_send_best_shot is False:
                 # 候補画像のアップロード
-                if OfficialInterface.upload_snap(self.candidate_img_path):
+                if self.upload_snap(self.candidate_img_path):
                     self.successful_send_candidate = True
 
         except Exception:
             """エラー発生時の送信試み."""
             if (self.best_shot_img_path is not None) and \
                     (self.successful_send_best_shot is False):
-                if OfficialInterface.upload_snap(self.best_shot_img_path):
+                if self.upload_snap(self.best_shot_img_path):
                     self.successful_send_best_shot = True
 
             if (self.candidate_img_path is not None) and \
                 (self.successful_send_candidate is False) and \
                     (self.successful_send_best_shot is False):
-                if OfficialInterface.upload_snap(self.candidate_img_path):
+                if self.upload_snap(self.candidate_img_path):
                     self.successful_send_candidate = True
 
             if (self.fig_B_img_path is not None) and \
                     (self.successful_send_fig_B is False):
-                if OfficialInterface.upload_snap(self.fig_B_img_path):
+                if self.upload_snap(self.fig_B_img_path):
                     self.successful_send_fig_B = True
 
             # 結果表示
             self.show_result()
 
+        finally:
+            # 保存待ちの検出結果の画像を保存してから物体検出モデルを解放する
+            # NOTE: 後片付けの失敗で元の例外やアップロード済みの結果を失わないようにする
+            for name in ("flush_writes", "release_model"):
+                try:
+                    method = getattr(d, name, None)
+                    if method is not None:
+                        method()
+                except Exception as e:
+                    print(f"Error: detector {name} failed:", e)
+            # 物体検出のステージごとの処理時間[ms]を表示する
+            profiler = getattr(d, "profiler", None)
+            if profiler is not None:
+                print(profiler.report())
+
 
 if __name__ == "__main__":
     """作業用."""
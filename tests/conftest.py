@@ -0,0 +1,19 @@
+"""テスト全体の設定.
+
+融合済みモデルのキャッシュ(yolo/models/experimental.py)をテストごとの一時ディレクトリに
+保存し、ユーザのホームディレクトリに書き込まない, 既存のキャッシュに依存しないようにする。
+
+@author: kawanoichi
+"""
+import os
+import shutil
+import tempfile
+
+# yoloのモジュールをimportする前に設定する(サブプロセスにも引き継がれる)
+FUSED_CACHE_DIR = tempfile.mkdtemp(prefix="fused_models_")
+os.environ["YOLOv5_FUSED_CACHE_DIR"] = FUSED_CACHE_DIR
+
+
+def pytest_sessionfinish(session, exitstatus):
+    """融合済みモデルのキャッシュを削除する."""
+    shutil.rmtree(FUSED_CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,96 @@
+"""物体検出のベンチマークのテスト.
+
+@author: kawanoichi
+"""
+from src.benchmark_detect import (
+    YOLO_PATH, run_benchmarks, available_backends, sweep_threads,
+    peak_rss_mb, print_results)
+import json
+import sys
+import shutil
+import pytest
+
+
+class TestBenchmarkDetect:
+    def test_run_benchmarks(self, tmp_path):
+        """ベンチマークの計測結果のテスト."""
+        weights = tmp_path / "weight.pt"
+        shutil.copy("tests/testdata/yolo/weight.pt", weights)
+        assert list(available_backends(weights)) == ["pytorch",
+                                                     "pytorch-int8",
+                                                     "pytorch-freeze"]
+
+        img_dir = tmp_path / "img"
+        img_dir.mkdir()
+        shutil.copy("tests/testdata/img/fig.png", img_dir)
+        report = run_benchmarks(weights, "tests/testdata/yolo/label.yaml",
+                                [img_dir], ["pytorch"],
+                                [None, (320, 240)], repeat=2)
+        json.dumps(report)
+
+        assert [r["input_size"] for r in report["results"]] == [
+            "original", [320, 240]]
+        for r in report["results"]:
+            assert r["backend"] == "pytorch"
+            assert r["images"] == 1
+            assert r["latency"]["count"] == 2
+            assert r["cold_start"]["total"] >= r["cold_start"]["load"]
+            assert r["throughput"] > 0
+            assert r["peak_rss_mb"] > 0
+            assert r["threads"] >= 1
+            assert r["stages"]["forward"]["count"] == 2
+
+    def test_opencv_dnn(self, tmp_path, monkeypatch):
+        """OpenCV DNNのバックエンドをtorchなしで計測するテスト."""
+        pytest.importorskip("onnx")
+        monkeypatch.syspath_prepend(str(YOLO_PATH))
+        from export import run
+
+        weights = tmp_path / "weight.pt"
+        shutil.copy("tests/testdata/yolo/weight.pt", weights)
+        run(weights, "tests/testdata/yolo/label.yaml", include=["onnx"],
+            check=False)
+        assert "opencv-dnn" in available_backends(weights)
+
+        img_dir = tmp_path / "img"
+        img_dir.mkdir()
+        shutil.copy("tests/testdata/img/fig.png", img_dir)
+        report = run_benchmarks(weights, "tests/testdata/yolo/label.yaml",
+                                [img_dir], ["opencv-dnn"], repeat=2)
+        json.dumps(report)
+
+        r = report["results"][0]
+        assert "error" not in r
+        assert r["latency"]["count"] == 2
+        assert not r["torch_imported"]
+        assert r["torch_threads"] is None
+
+    def test_sweep_threads(self, tmp_path):
+        """スレッド数の探索のテスト."""
+        img_dir = tmp_path / "img"
+        img_dir.mkdir()
+        shutil.copy("tests/testdata/img/fig.png", img_dir)
+        report = sweep_threads("tests/testdata/yolo/weight.pt",
+                               "tests/testdata/yolo/label.yaml",
+                               [img_dir], repeat=1)
+
+        options = [r["options"] for r in report["results"]]
+        assert {"intra_op_threads": 1, "inter_op_threads": 1} in options
+        assert {"intra_op_threads": 1, "inter_op_threads": 2} in options
+        for r in report["results"]:
+            assert r["torch_threads"] == [r["options"]["intra_op_threads"],
+                                          r["options"]["inter_op_threads"]]
+        assert report["best"] in report["results"]
+
+    def test_peak_rss_unavailable(self, monkeypatch, capsys):
+        """resource, psutilがない環境でもメモリ使用量をn/aとして表示するテスト."""
+        monkeypatch.setitem(sys.modules, "resource", None)
+        monkeypatch.setitem(sys.modules, "psutil", None)
+        assert peak_rss_mb() is None
+
+        print_results({"results": [{
+            "backend": "pytorch", "input_size": "original",
+            "cold_start": {"total": 1.0},
+            "latency": {"p50": 0.1, "p95": 0.2}, "throughput": 10.0,
+            "peak_rss_mb": None, "threads": 4, "torch_threads": [4, 1]}]})
+        assert "n/a" in capsys.readouterr().out
@@ -0,0 +1,38 @@
+"""NMSのマイクロベンチマークのテスト.
+
+@author: kawanoichi
+"""
+from src.benchmark_nms import benchmark_nms, record_predictions
+from utils.general import non_max_suppression
+import torch
+
+
+class TestBenchmarkNms:
+    def test_benchmark_nms(self):
+        """記録した予測でのNMSの計測結果のテスト."""
+        preds = record_predictions(
+            ["tests/testdata/img/fig.png", "tests/testdata/img/FigA_1.png"],
+            weights="tests/testdata/yolo/weight.pt",
+            label_data="tests/testdata/yolo/label.yaml")
+        assert len(preds["dense"]) == len(preds["gated"]) == 2
+
+        for key in ("dense", "gated"):
+            report = benchmark_nms(preds[key], repeat=2)
+            for name in ("torchvision", "fast"):
+                assert report[name]["latency"]["count"] == 4
+                assert report[name]["matches"]
+
+    def test_fast_nms(self):
+        """軽量なNMSの結果がtorchvisionを使う処理と一致するかのテスト."""
+        torch.manual_seed(0)
+        for n in (1, 8, 32):
+            xy = torch.rand(n, 2) * 200 + 100
+            wh = torch.rand(n, 2) * 60 + 20
+            conf = torch.rand(n, 4) * 0.5 + 0.5  # 物体らしさ, 3クラス
+            pred = [torch.cat((xy, wh, conf), 1)]
+            for kwargs in ({}, {"agnostic": True}, {"classes": [1]}):
+                expected = non_max_suppression(pred, 0.3, 0.45, max_det=10,
+                                               fast_max=0, **kwargs)[0]
+                result = non_max_suppression(pred, 0.3, 0.45, max_det=10,
+                                             **kwargs)[0]
+                assert torch.equal(result, expected)
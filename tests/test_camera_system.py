@@ -4,10 +4,42 @@
 @note: モック化はunittestのmockを使用する
 """
 from src.camera_system import CameraSystem
+from pathlib import Path
 from unittest import mock
+import subprocess
+import sys
+
+# カメラシステムの起動時(キャリブレーションまで)に読み込まないモジュール
+HEAVY_MODULES = ["torch", "torchvision", "ultralytics", "pandas",
+                 "pkg_resources", "detect_object", "models", "utils"]
+
+
+def import_time(module: str) -> dict:
+    """-X importtimeでモジュールごとのimport時間を計測する.
+
+    Args:
+        module(str): importするモジュール名(src下)
+
+    Returns:
+        dict: キー: モジュール名, 値: 子モジュールを含むimport時間[us]
+    """
+    src_dir = Path(__file__).parent.parent / "src"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             f"import {module}"],
+                            cwd=src_dir, capture_output=True, text=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
 
 
 class TestCameraSystem:
+    @mock.patch("detect_object.DetectObject.load_model")
     @mock.patch("src.camera_system.CameraSystem.mkdir_fig_img")
     @mock.patch("src.camera_system.TrainTracker.observe")
     @mock.patch("src.camera_system.TrainTracker.calibrate")
@@ -18,7 +50,8 @@ class TestCameraSystem:
                    mock_get_robot_state,
                    mock_calibrate,
                    mock_observe,
-                   mock_mkdir_fig_img
+                   mock_mkdir_fig_img,
+                   mock_load_model
                    ):
         # 引数は、mock.patchが一番下のものから第1引数に対応するため注意
         cs = CameraSystem()
@@ -31,3 +64,17 @@ class TestCameraSystem:
         mock_mkdir_fig_img.return_value = None
 
         cs.start()
+
+        # 物体検出モデルはバックグラウンドで読み込まれる
+        assert cs.detector.wait_ready(timeout=10) is False
+        mock_load_model.assert_called_once()
+
+    def test_import_time(self):
+        """起動時にtorchなどの重いモジュールを読み込まないかのテスト."""
+        times = import_time("camera_system")
+        report = "\n".join(f"{t / 1e6:8.3f}s {name}" for name, t in sorted(
+            times.items(), key=lambda item: -item[1])[:15])
+
+        heavy = [name for name in times
+                 if name.split(".")[0] in HEAVY_MODULES]
+        assert not heavy, f"heavy modules are imported:\n{report}"
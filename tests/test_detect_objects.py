@@ -5,7 +5,22 @@
 @author: kawanoichi
 """
 from src.detect_object import DetectObject
+# DetectObjectと同じクラス(src/をパスに追加したモジュール)で比較, モック化する
+from detections import Detections
+from image_processing import ImageProcessing
+from utils.augmentations import letterbox
+import pytest
+import torch
+import cv2
+import logging
+import numpy as np
 import os
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from unittest import mock
 
 
 def delete_img(path):
@@ -34,3 +49,451 @@ class TestImageProcessing:
             self.img_path, self.save_path)
         assert len(objects) == 1
         assert os.path.exists(self.save_path)
+
+    def test_load_model(self):
+        """モデルの再利用と解放のテスト."""
+        self.detect.release_model()
+        assert not self.detect.is_loaded
+
+        model = self.detect.load_model()
+        assert self.detect.is_loaded
+        # 同じ重みファイルのモデルは再利用される
+        assert self.detect.load_model() is model
+        other = DetectObject(self.weights, self.label_data)
+        assert other.load_model() is model
+
+        # 検出しても再読み込みされない
+        self.detect.detect_object(self.img_path)
+        assert self.detect.load_model() is model
+
+        # 解放後は再度読み込まれる
+        self.detect.release_model()
+        assert not other.is_loaded
+        assert self.detect.load_model() is not model
+        self.detect.release_model()
+
+    def test_detect_objects(self):
+        """複数画像の一括検出のテスト."""
+        img_paths = [self.img_path,
+                     "tests/testdata/img/FigA_1.png",
+                     "tests/testdata/img/resized_fig.png",
+                     "tests/testdata/img/FigB.png"]
+        expected = [self.detect.detect_object(p) for p in img_paths]
+
+        for chunk_size in [1, 2, 4]:
+            results = self.detect.detect_objects(img_paths,
+                                                 chunk_size=chunk_size)
+            assert len(results) == len(img_paths)
+            for objects, expected_objects in zip(results, expected):
+                assert len(objects) == len(expected_objects)
+                for obj, expected_obj in zip(objects, expected_objects):
+                    assert obj == pytest.approx(expected_obj, abs=1e-3)
+
+        # 保存パスの指定
+        results = self.detect.detect_objects([self.img_path],
+                                             [self.save_path])
+        assert results[0][0] == pytest.approx(expected[0][0])
+        assert os.path.exists(self.save_path)
+
+    def test_detect_in_memory(self):
+        """画像パス以外の入力と描画画像の出力のテスト."""
+        expected = self.detect.detect_object(self.img_path)
+        img = cv2.imread(self.img_path)
+        with open(self.img_path, "rb") as f:
+            png = f.read()
+
+        for src in [img, png]:
+            objects, annotated_img = self.detect.detect_object(src,
+                                                               annotate=True)
+            assert len(objects) == len(expected)
+            assert objects[0] == pytest.approx(expected[0])
+            assert annotated_img.shape == img.shape
+            # 描画は元画像に影響しない
+            assert (annotated_img != img).any()
+            assert (cv2.imread(self.img_path) == img).all()
+
+    def test_annotate_once(self, tmp_path):
+        """画像パスの描画と保存で読み込み, 描画を1回だけ行うかのテスト."""
+        for async_write in [False, True]:
+            d = DetectObject(self.weights, self.label_data,
+                             async_write=async_write)
+            save_path = str(tmp_path / f"detect_{async_write}.png")
+            with mock.patch.object(ImageProcessing, "load_img",
+                                   wraps=ImageProcessing.load_img) as load, \
+                    mock.patch.object(d, "annotate",
+                                      wraps=d.annotate) as annotate:
+                objects, annotated_img = d.detect_object(
+                    self.img_path, save_path, annotate=True)
+                d.flush_writes()
+            assert len(objects)
+            decoded = [c for c in load.call_args_list
+                       if not isinstance(c.args[0], np.ndarray)]
+            assert len(decoded) == 1 and annotate.call_count == 1
+            # 返した画像と保存した画像は同じ
+            assert (cv2.imread(save_path) == annotated_img).all()
+
+    def test_no_heavy_imports(self):
+        """モデルの読み込みと描画でultralyticsとpandasを読み込まないかのテスト."""
+        code = ("from detect_object import DetectObject\n"
+                "import sys\n"
+                f"d = DetectObject({self.weights!r}, {self.label_data!r})\n"
+                f"d.detect_object({self.img_path!r}, annotate=True)\n"
+                "print(sorted({m.split('.')[0] for m in sys.modules}"
+                " & {'ultralytics', 'pandas'}))")
+        env = dict(os.environ, PYTHONPATH="src")
+        result = subprocess.run([sys.executable, "-c", code], env=env,
+                                capture_output=True, text=True, check=True)
+        assert result.stdout.strip().splitlines()[-1] == "[]"
+
+    def test_detect_exported(self, tmp_path):
+        """エクスポートしたモデル(TorchScript, ONNX)による検出のテスト."""
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+        from export import run
+
+        weights = tmp_path / "weight.pt"
+        shutil.copy(self.weights, weights)
+        # PyTorchモデルとの出力の一致も確認される
+        files = run(weights, self.label_data, dynamic=True)
+        assert [Path(f).suffix for f in files] == [".torchscript", ".onnx"]
+
+        img_paths = [self.img_path, "tests/testdata/img/FigA_1.png"]
+        expected = self.detect.detect_objects(img_paths)
+        for f in files:
+            detect = DetectObject(f, self.label_data)
+            results = detect.detect_objects(img_paths)
+            for objects, expected_objects in zip(results, expected):
+                assert len(objects) == len(expected_objects)
+                for obj, expected_obj in zip(objects, expected_objects):
+                    assert obj == pytest.approx(expected_obj, abs=1e-2)
+            detect.release_model()
+
+    def test_detect_safetensors(self, tmp_path):
+        """メモリマップで読み込む重みファイル(safetensors)による検出のテスト."""
+        from export import run
+        from models.experimental import load_safetensors
+
+        weights = tmp_path / "weight.pt"
+        shutil.copy(self.weights, weights)
+        # PyTorchモデルとの出力の一致も確認される
+        f, = run(weights, self.label_data, include=("safetensors",))
+        assert Path(f).suffix == ".safetensors"
+
+        # 層の一覧のログは読み込み中だけ抑制する(ロガーのレベルは変えない)
+        from utils.general import LOGGER
+        level = LOGGER.level
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        LOGGER.addHandler(handler)
+        try:
+            model = load_safetensors(f)
+            LOGGER.info("after load")
+        finally:
+            LOGGER.removeHandler(handler)
+        assert [r.getMessage() for r in records] == ["after load"]
+        assert LOGGER.level == level and not LOGGER.filters
+
+        # 重みはchannels-lastの順で保存され、コピーせずに使われる
+        assert model.names == self.detect.load_model().names
+        assert model.stride.tolist() == [8, 16, 32]
+        for p in model.parameters():
+            assert not p.is_meta
+            if p.ndim == 4:
+                assert p.is_contiguous(memory_format=torch.channels_last)
+        assert not any(b.is_meta for b in model.buffers())
+
+        img_paths = [self.img_path, "tests/testdata/img/FigA_1.png"]
+        expected = self.detect.detect_objects(img_paths)
+        detect = DetectObject(f, self.label_data)
+        results = detect.detect_objects(img_paths)
+        assert detect.load_model().pt
+        for objects, expected_objects in zip(results, expected):
+            assert len(objects) == len(expected_objects)
+            for obj, expected_obj in zip(objects, expected_objects):
+                assert obj == pytest.approx(expected_obj, abs=1e-2)
+        detect.release_model()
+
+    def test_detect_quantized(self):
+        """INT8に量子化したモデルによる検出のテスト."""
+        detect = DetectObject(self.weights, self.label_data, quantize=True,
+                              calib_imgs="tests/testdata/img")
+        assert detect.model_key != self.detect.model_key
+        model = detect.load_model()
+        assert any(type(m).__module__.startswith("torch.ao.nn.quantized")
+                   for m in model.model.modules())
+
+        objects = detect.detect_object(self.img_path)
+        assert all(len(obj) == 6 for obj in objects)
+        detect.release_model()
+
+        with pytest.raises(FileNotFoundError):
+            DetectObject(self.weights, self.label_data, quantize=True,
+                         calib_imgs="tests/testdata/yolo").load_model()
+
+    def test_fused_model_cache(self, tmp_path):
+        """融合済みモデルのキャッシュのテスト."""
+        import torch
+        from models.experimental import attempt_load, fused_cache_file
+
+        weights = tmp_path / "weight.pt"
+        shutil.copy(self.weights, weights)
+        cache_dir = tmp_path / "cache"
+        model = attempt_load(weights, cache_dir=cache_dir)
+        cache_file = fused_cache_file(weights, cache_dir)
+        assert list(cache_dir.iterdir()) == [cache_file]
+
+        # 2回目以降はキャッシュから読み込む
+        cached = attempt_load(weights, cache_dir=cache_dir)
+        im = torch.zeros(1, 3, 64, 64)
+        with torch.no_grad():
+            assert torch.equal(model(im)[0], cached(im)[0])
+
+        # 重みファイルが変わるとキャッシュを作り直す
+        ckpt = torch.load(weights, map_location="cpu", weights_only=False)
+        ckpt["epoch"] = -2
+        torch.save(ckpt, weights)
+        attempt_load(weights, cache_dir=cache_dir)
+        assert list(cache_dir.iterdir()) == [
+            fused_cache_file(weights, cache_dir)]
+        assert not cache_file.exists()
+
+        # 同じファイル名の別の重みファイルのキャッシュは削除しない
+        other_dir = tmp_path / "other"
+        other_dir.mkdir()
+        other = other_dir / "weight.pt"
+        shutil.copy(self.weights, other)
+        other_v2 = other_dir / "weight-v2.pt"
+        shutil.copy(self.weights, other_v2)
+        attempt_load(other, cache_dir=cache_dir)
+        attempt_load(other_v2, cache_dir=cache_dir)
+        attempt_load(weights, cache_dir=cache_dir)
+        assert sorted(cache_dir.iterdir()) == sorted(
+            fused_cache_file(w, cache_dir) for w in (weights, other, other_v2))
+
+    def test_preload(self):
+        """バックグラウンドでのモデルの読み込みのテスト."""
+        self.detect.release_model()
+        thread = self.detect.preload()
+        assert self.detect.preload() is thread
+        assert self.detect.wait_ready(timeout=60)
+        assert self.detect.load_error is None
+
+        # 読み込みに失敗した場合は例外を保持する
+        detect = DetectObject("tests/testdata/yolo/label.yaml",
+                              self.label_data)
+        detect.preload()
+        assert detect.wait_ready(timeout=60) is False
+        assert detect.load_error is not None
+
+    def test_warmup(self):
+        """CPUでのウォームアップのテスト."""
+        self.detect.release_model()
+        detect = self.detect.load_model().model.model.model[-1]  # Detect
+        # カメラ画像(640x480)の入力サイズ(384x480)でグリッドが作成済み
+        assert [tuple(g.shape[2:4]) for g in detect.grid] == [
+            (384 // s, 480 // s) for s in detect.stride.int().tolist()]
+
+        self.detect.release_model()
+        no_warmup = DetectObject(self.weights, self.label_data, warmup_runs=0)
+        detect = no_warmup.load_model().model.model.model[-1]
+        assert all(g.numel() == 0 for g in detect.grid)
+
+    def test_optimize(self, monkeypatch):
+        """推論の最適化(channels-last, jit.freeze)とフォールバックのテスト."""
+        expected = DetectObject(self.weights, self.label_data,
+                                channels_last=False).detect_object(
+                                    self.img_path)
+
+        frozen = DetectObject(self.weights, self.label_data,
+                              optimize="freeze")
+        model = frozen.load_model().model
+        assert model.mode == "freeze"
+        assert model.frozen  # ウォームアップの入力サイズでトレース済み
+        weight = next(model.model.parameters())
+        assert weight.is_contiguous(memory_format=torch.channels_last)
+        objects = frozen.detect_object(self.img_path)
+        assert len(objects) == len(expected)
+        for obj, expected_obj in zip(objects, expected):
+            assert obj == pytest.approx(expected_obj, abs=1e-3)
+        frozen.release_model()
+
+        # トレースできない場合はeagerで推論する
+        def fail(*args, **kwargs):
+            raise RuntimeError("trace is unavailable")
+        monkeypatch.setattr(torch.jit, "trace", fail)
+        fallback = DetectObject(self.weights, self.label_data,
+                                optimize="freeze")
+        assert fallback.load_model().model.mode == "eager"
+        assert len(fallback.detect_object(self.img_path)) == len(expected)
+        fallback.release_model()
+
+    def test_preprocess(self):
+        """前処理の結果がletterboxによる変換と一致するかのテスト."""
+        model = self.detect.load_model()
+        for path in ["tests/testdata/img/fig.png",
+                     "tests/testdata/img/FigA_1.png"]:
+            img = cv2.imread(path)
+            expected = letterbox(img, (640, 480), stride=32)[0]
+            expected = expected.transpose((2, 0, 1))[::-1]
+            expected = np.ascontiguousarray(expected)
+            expected = torch.from_numpy(expected).float() / 255
+
+            assert torch.equal(self.detect.preprocess(img, model), expected)
+            # 確保済みのテンソル(channels-last)に書き込む
+            out = torch.full((1, *expected.shape), -1.0).to(
+                memory_format=torch.channels_last)
+            self.detect.preprocess(img, model, out=out[0])
+            assert torch.equal(out[0], expected)
+
+    def test_gated_decode(self):
+        """検出層で信頼度閾値未満のセルを省いても検出結果が変わらないかのテスト."""
+        img_paths = [self.img_path, "tests/testdata/img/FigA_1.png"]
+        expected = DetectObject(self.weights, self.label_data,
+                                gated_decode=False).detect_objects(img_paths)
+
+        gated = DetectObject(self.weights, self.label_data)
+        head = gated.load_model().model.model.model[-1]  # Detect
+        assert head.conf_thres == gated.conf_thres
+        results = gated.detect_objects(img_paths)
+        for objects, expected_objects in zip(results, expected):
+            assert len(objects) == len(expected_objects)
+            for obj, expected_obj in zip(objects, expected_objects):
+                assert obj == pytest.approx(expected_obj)
+
+    def test_detections(self):
+        """検出結果の配列とビューのテスト."""
+        objects = self.detect.detect_object(self.img_path)
+        assert isinstance(objects, Detections)
+        assert objects.data.dtype == np.float32
+        assert objects.data.shape == (len(objects), 6)
+        assert np.asarray(objects) is objects.data
+        assert np.shares_memory(objects.boxes, objects.data)  # コピーしない
+        assert objects == objects.tolist()
+
+    def test_profiler(self):
+        """ステージごとの処理時間の計測のテスト."""
+        self.detect.profiler.reset()
+        objects = self.detect.detect_object(self.img_path, self.save_path)
+        assert isinstance(objects, Detections)
+        assert set(objects.times) == {"load", "read", "letterbox", "tensor",
+                                      "forward", "nms", "rescale",
+                                      "annotate", "write"}
+        assert all(t >= 0 for t in objects.times.values())
+        assert objects.total_time == pytest.approx(
+            sum(objects.times.values()))
+
+        results = self.detect.detect_objects([self.img_path] * 3)
+        assert all("forward" in r.times for r in results)
+
+        summary = self.detect.profiler.summary()
+        assert list(summary)[:3] == ["load", "read", "letterbox"]
+        assert summary["forward"]["count"] == 4
+        assert summary["load"]["count"] == 2
+        for s in summary.values():
+            assert s["p50"] <= s["p95"] <= s["max"]
+        assert "forward" in self.detect.profiler.report()
+
+        # バイト列の読み込み, 描画も検出と同じ1回分として記録する
+        self.detect.profiler.reset()
+        with open(self.img_path, "rb") as f:
+            png = f.read()
+        objects, _ = self.detect.detect_object(png, annotate=True)
+        summary = self.detect.profiler.summary()
+        assert {"read", "forward", "annotate"} <= set(summary)
+        assert all(s["count"] == 1 for s in summary.values())
+        assert summary["read"]["mean"] == pytest.approx(
+            objects.times["read"])
+
+    def test_async_write(self, tmp_path):
+        """検出結果の画像を別スレッドで保存するテスト."""
+        expected = self.detect.detect_object(self.img_path, self.save_path)
+        expected_img = cv2.imread(self.save_path)
+
+        d = DetectObject(self.weights, self.label_data, async_write=True)
+        save_paths = [str(tmp_path / f"detect{i}.png") for i in range(6)]
+        results = [d.detect_object(self.img_path, path)
+                   for path in save_paths]
+        # 描画, 保存の処理時間は検出結果に含めない
+        for objects in results:
+            assert objects == expected
+            assert "annotate" not in objects.times
+            assert "write" not in objects.times
+
+        d.flush_writes()
+        for path in save_paths:
+            assert (cv2.imread(path) == expected_img).all()
+        summary = d.profiler.summary()
+        assert summary["write"]["count"] == len(save_paths)
+
+        # モデルの解放前に保存待ちの画像を保存する
+        d.detect_object(self.img_path, str(tmp_path / "release.png"))
+        d.release_model()
+        assert (tmp_path / "release.png").exists()
+
+    def test_threads(self):
+        """推論のスレッド数の設定のテスト."""
+        import torch
+
+        num_threads = torch.get_num_threads()
+        try:
+            detect = DetectObject(self.weights, self.label_data,
+                                  intra_op_threads=1)
+            assert detect.model_key != self.detect.model_key
+            detect.load_model()
+            assert torch.get_num_threads() == 1
+            detect.release_model()
+        finally:
+            torch.set_num_threads(num_threads)
+
+        # TrainTracker用にコアを残す
+        detect = DetectObject(self.weights, self.label_data,
+                              reserved_cores=1, cpu_affinity=[0, 1, 2, 3])
+        assert detect.num_threads == 3
+        detect = DetectObject(self.weights, self.label_data,
+                              reserved_cores=8, cpu_affinity=[0, 1])
+        assert detect.num_threads == 1
+        assert self.detect.num_threads == 0
+
+    def test_affinity(self, monkeypatch):
+        """推論スレッドのCPUアフィニティの設定のテスト."""
+        detect = DetectObject(self.weights, self.label_data,
+                              reserved_cores=1, cpu_affinity=[0, 1, 2, 3])
+        assert detect.inference_cpus == [0, 1, 2]
+        assert self.detect.inference_cpus is None
+        # CPUが異なるモデルは共有しない
+        other = DetectObject(self.weights, self.label_data,
+                             reserved_cores=1, cpu_affinity=[0, 1, 2])
+        assert other.inference_cpus == [0, 1]
+        assert detect.model_key != other.model_key
+
+    @pytest.mark.skipif(not hasattr(os, "sched_setaffinity"),
+                        reason="per-thread affinity is not supported")
+    def test_affinity_threads(self, monkeypatch):
+        """読み込んだスレッドと推論したスレッドのそれぞれに設定するかのテスト."""
+        detect = DetectObject(self.weights, self.label_data,
+                              reserved_cores=1, cpu_affinity=[0, 1, 2, 3])
+        calls = []
+        monkeypatch.setattr(
+            os, "sched_setaffinity",
+            lambda pid, cpus: calls.append((threading.get_ident(), cpus)))
+        detect.preload().join()
+        thread = threading.Thread(
+            target=lambda: [detect.detect_object(self.img_path)
+                            for _ in range(2)])
+        thread.start()
+        thread.join()
+        detect.release_model()
+        assert len(calls) == 2
+        assert calls[0][0] != calls[1][0]
+        assert all(cpus == [0, 1, 2] for _, cpus in calls)
+
+    def test_affinity_unsupported(self, monkeypatch, capsys):
+        """スレッドごとに設定できない環境ではプロセスに設定しないかのテスト."""
+        monkeypatch.delattr(os, "sched_setaffinity", raising=False)
+        detect = DetectObject(self.weights, self.label_data,
+                              reserved_cores=1, cpu_affinity=[0, 1, 2, 3])
+        detect.apply_affinity()
+        detect.apply_affinity()
+        out = capsys.readouterr().out
+        assert out.count("Warning: cpu_affinity is not applied") == 1
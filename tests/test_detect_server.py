@@ -0,0 +1,66 @@
+"""物体検出のHTTPサーバのテスト.
+
+@author: kawanoichi
+"""
+from concurrent.futures import ThreadPoolExecutor
+from src.detect_object import DetectObject
+from src.detect_server import DetectClient, DetectServer
+import pytest
+import cv2
+import requests
+
+
+class TestDetectServer:
+    def setup_method(self):
+        """前処理."""
+        self.img_paths = ["tests/testdata/img/fig.png",
+                          "tests/testdata/img/FigA_1.png",
+                          "tests/testdata/img/resized_fig.png"]
+        self.weights = "tests/testdata/yolo/weight.pt"
+        self.label_data = "tests/testdata/yolo/label.yaml"
+
+    def test_detect(self, tmp_path):
+        """サーバでの検出結果がDetectObjectと一致するかのテスト."""
+        expected = DetectObject(self.weights,
+                                self.label_data).detect_objects(self.img_paths)
+
+        server = DetectServer(port=0, batch_window=0.05,
+                              weights=self.weights,
+                              label_data=self.label_data)
+        server.start()
+        try:
+            client = DetectClient(server.url)
+            assert server.detector.wait_ready(timeout=120)
+            assert client.is_ready()
+
+            # 画像パス, BGR画像, PNGのバイト列
+            img = cv2.imread(self.img_paths[0])
+            with open(self.img_paths[0], "rb") as f:
+                png = f.read()
+            for src in [self.img_paths[0], img, png]:
+                objects = client.detect_object(src)
+                assert len(objects) == len(expected[0])
+                for obj, expected_obj in zip(objects, expected[0]):
+                    assert obj == pytest.approx(expected_obj, abs=1e-4)
+
+            # 同時に届いた要求をまとめて検出する
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                results = list(executor.map(client.detect_object,
+                                            self.img_paths))
+            for objects, expected_objects in zip(results, expected):
+                assert len(objects) == len(expected_objects)
+
+            # 検出結果の画像の保存
+            save_path = str(tmp_path / "detect.png")
+            client.detect_object(self.img_paths[0], save_path)
+            assert cv2.imread(save_path) is not None
+
+            # 不正な要求
+            with pytest.raises(RuntimeError):
+                client.detect_object(b"not an image")
+            with pytest.raises(RuntimeError):
+                client.detect_object(str(tmp_path / "not_exist.png"))
+            res = requests.get(f"{server.url}/unknown")
+            assert res.status_code == 404
+        finally:
+            server.close()
@@ -0,0 +1,76 @@
+"""物体検出のワーカープロセスのテスト.
+
+@author: kawanoichi
+"""
+from src.detect_object import DetectObject
+from src.detect_worker import DetectWorker
+import pytest
+import cv2
+
+
+class TestDetectWorker:
+    def setup_method(self):
+        """前処理."""
+        self.img_paths = ["tests/testdata/img/fig.png",
+                          "tests/testdata/img/FigA_1.png",
+                          "tests/testdata/img/resized_fig.png"]
+        self.weights = "tests/testdata/yolo/weight.pt"
+        self.label_data = "tests/testdata/yolo/label.yaml"
+
+    def test_detect(self, tmp_path):
+        """別プロセスでの検出結果がDetectObjectと一致するかのテスト."""
+        expected = DetectObject(self.weights,
+                                self.label_data).detect_objects(self.img_paths)
+
+        with DetectWorker(weights=self.weights,
+                          label_data=self.label_data) as worker:
+            assert worker.wait_ready(timeout=120)
+
+            # 画像パス, BGR画像, PNGのバイト列
+            img = cv2.imread(self.img_paths[0])
+            with open(self.img_paths[0], "rb") as f:
+                png = f.read()
+            for src in [self.img_paths[0], img, png]:
+                objects = worker.detect_object(src)
+                assert len(objects) == len(expected[0])
+                for obj, expected_obj in zip(objects, expected[0]):
+                    assert obj == pytest.approx(expected_obj)
+                assert "forward" in objects.times
+
+            # 共有メモリの数より多い画像を要求する
+            results = worker.detect_objects(self.img_paths)
+            for objects, expected_objects in zip(results, expected):
+                assert len(objects) == len(expected_objects)
+
+            # 検出中に別の処理ができる
+            job_id = worker.submit(img, str(tmp_path / "detected.png"))
+            img[:] = 0  # 共有メモリにコピー済みなので影響しない
+            assert len(worker.result(job_id)) == len(expected[0])
+            assert (tmp_path / "detected.png").exists()
+
+            with pytest.raises(RuntimeError):
+                worker.detect_object(b"not an image")
+            assert worker.profiler.summary()["forward"]["count"] == 7
+
+        assert not worker.is_alive
+
+    def test_async_write(self, tmp_path):
+        """ワーカープロセスで検出結果の画像を別スレッドで保存するテスト."""
+        img = cv2.imread(self.img_paths[0])
+        # DetectObjectと同じく読み込みを開始してから使う(preloadは自身を返す)
+        worker = DetectWorker(weights=self.weights,
+                              label_data=self.label_data, async_write=True)
+        with worker.preload() as preloaded:
+            assert preloaded is worker
+            assert worker.wait_ready(timeout=120)
+            save_paths = [str(tmp_path / f"detect{i}.png") for i in range(3)]
+            for path in save_paths:
+                objects = worker.detect_object(img, path)
+                assert "write" not in objects.times
+            worker.flush_writes()
+            for path in save_paths:
+                assert cv2.imread(path) is not None
+
+            # 終了時に保存待ちの画像を保存する
+            worker.detect_object(img, str(tmp_path / "close.png"))
+        assert (tmp_path / "close.png").exists()
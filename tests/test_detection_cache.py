@@ -0,0 +1,81 @@
+"""物体検出の結果のキャッシュのテスト.
+
+@author: kawanoichi
+"""
+from src.detect_object import DetectObject
+from src.detection_cache import DetectionCache
+from unittest import mock
+import pytest
+import shutil
+import cv2
+import numpy as np
+
+
+class TestDetectionCache:
+    def setup_method(self):
+        """前処理."""
+        self.img_path = "tests/testdata/img/fig.png"
+        self.weights = "tests/testdata/yolo/weight.pt"
+        self.label_data = "tests/testdata/yolo/label.yaml"
+
+    def test_lru(self, tmp_path):
+        """LRUによる削除とファイルへの保存のテスト."""
+        cache = DetectionCache(maxsize=2, cache_dir=tmp_path)
+        expected = pytest.approx(np.array([[0, 0, 1, 1, 0.9, 0]]))
+        for key in ["a", "b", "c"]:
+            cache.put(key, [[0, 0, 1, 1, 0.9, 0]])
+        assert len(cache) == 2
+        # ファイルから読み込む
+        assert cache.get("a") == expected
+        assert len(cache) == 2 and cache.hits == 1
+
+        # 保存したファイルは別のインスタンスからも使える
+        other = DetectionCache(cache_dir=tmp_path)
+        assert other.get("c") == expected
+        other.clear()
+        assert other.get("c") is None and other.misses == 1
+
+        with pytest.raises(ValueError):
+            DetectionCache(maxsize=0)
+
+    def test_detect(self, tmp_path):
+        """同じ画像は推論せずに同じ検出結果を返すかのテスト."""
+        cache = DetectionCache(cache_dir=tmp_path / "cache")
+        d = DetectObject(self.weights, self.label_data, cache=cache)
+        expected = d.detect_object(self.img_path)
+        assert "forward" in expected.times and cache.misses == 1
+
+        # 画像パス, BGR画像(画素が同じならキャッシュを使う)
+        img = cv2.imread(self.img_path)
+        d.detect_object(img)
+        save_path = str(tmp_path / "detect.png")
+        with mock.patch.object(DetectObject, "load_model",
+                               side_effect=AssertionError("inferred")):
+            for src in [self.img_path, img]:
+                objects = d.detect_object(src)
+                assert objects == expected
+                assert "forward" not in objects.times
+            # キャッシュした結果でも検出結果の画像を保存する
+            d.detect_object(self.img_path, save_path)
+            assert cv2.imread(save_path) is not None
+        assert cache.hits == 3
+
+        # モデルの設定のハッシュは呼び出しごとに1回だけ計算する
+        with mock.patch.object(DetectObject, "fingerprint",
+                               new_callable=mock.PropertyMock,
+                               return_value=d.fingerprint) as fingerprint:
+            d.detect_objects([self.img_path, img, self.img_path])
+        assert fingerprint.call_count == 1 and cache.hits == 6
+
+        # 閾値, 重みファイルが変わるとキャッシュを使わない
+        d.conf_thres = 0.3
+        assert "forward" in d.detect_object(self.img_path).times
+        weights = tmp_path / "weight.pt"
+        shutil.copy(self.weights, weights)
+        other = DetectObject(str(weights), self.label_data, cache=cache)
+        assert other.fingerprint == DetectObject(
+            self.weights, self.label_data).fingerprint
+        with open(weights, "ab") as f:
+            f.write(b"\0")
+        assert other.fingerprint != DetectObject(
+            self.weights, self.label_data).fingerprint
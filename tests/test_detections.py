@@ -0,0 +1,42 @@
+"""検出結果のテスト.
+
+@author: kawanoichi
+"""
+from src.detections import Detections
+import pytest
+import numpy as np
+
+
+class TestDetections:
+    def setup_method(self):
+        """前処理."""
+        self.objects = Detections([[1, 2, 3, 4, 0.9, 0],
+                                   [5, 6, 7, 8, 0.8, 2]],
+                                  {"forward": 0.02, "nms": 0.01})
+
+    def test_views(self):
+        """列ごとのビューのテスト."""
+        assert self.objects.data.dtype == np.float32
+        assert self.objects.boxes.tolist() == [[1, 2, 3, 4], [5, 6, 7, 8]]
+        assert self.objects.confs == pytest.approx([0.9, 0.8])
+        assert self.objects.classes.tolist() == [0, 2]
+        assert np.shares_memory(self.objects.boxes, self.objects.data)
+        assert self.objects.of_class(2) == pytest.approx(
+            np.array([[5, 6, 7, 8, 0.8, 2]]))
+        assert len(self.objects.of_class(1)) == 0
+
+    def test_sequence(self):
+        """リストや配列と同じように扱えるかのテスト."""
+        assert len(self.objects) == 2
+        assert [obj[:4].tolist() for obj in self.objects] == [
+            [1, 2, 3, 4], [5, 6, 7, 8]]
+        assert self.objects[1][5] == 2
+        assert np.asarray(self.objects) is self.objects.data
+        assert self.objects == self.objects.tolist()
+        assert self.objects != [[1, 2, 3, 4, 0.9, 0]]
+        assert len(Detections()) == 0 and Detections().data.shape == (0, 6)
+
+    def test_times(self):
+        """処理時間のテスト."""
+        assert self.objects.total_time == pytest.approx(0.03)
+        assert Detections().times == {} and Detections().total_time == 0
@@ -0,0 +1,57 @@
+"""OpenCV DNNによる物体検出クラスのテスト.
+
+軽い重みファイルをONNXにエクスポートしてテストを行う。
+
+@author: kawanoichi
+"""
+from src.detect_object import DetectObject
+from src.dnn_detect_object import DnnDetectObject
+import pytest
+import cv2
+import shutil
+
+
+class TestDnnDetectObject:
+    def setup_method(self):
+        """前処理."""
+        self.img_paths = ["tests/testdata/img/fig.png",
+                          "tests/testdata/img/FigA_1.png"]
+        self.weights = "tests/testdata/yolo/weight.pt"
+        self.label_data = "tests/testdata/yolo/label.yaml"
+
+    @pytest.fixture
+    def onnx_weights(self, tmp_path):
+        """軽い重みファイルをONNXにエクスポートする."""
+        pytest.importorskip("onnx")
+        from export import run
+
+        weights = tmp_path / "weight.pt"
+        shutil.copy(self.weights, weights)
+        return run(weights, self.label_data, include=["onnx"], check=False)[0]
+
+    def test_detect(self, onnx_weights, tmp_path):
+        """PyTorchでの検出結果と一致するかのテスト."""
+        expected = DetectObject(self.weights,
+                                self.label_data).detect_objects(self.img_paths)
+        engines = [DnnDetectObject(onnx_weights, self.label_data),
+                   DetectObject(onnx_weights, self.label_data, dnn=True)]
+        for detect in engines:
+            for img_path, expected_objects in zip(self.img_paths, expected):
+                objects = detect.detect_object(img_path)
+                assert len(objects) == len(expected_objects)
+                for obj, expected_obj in zip(objects, expected_objects):
+                    assert obj == pytest.approx(expected_obj, abs=1e-2)
+            detect.release_model()
+
+        # 検出結果の描画
+        save_path = str(tmp_path / "detect_fig.png")
+        detect = DnnDetectObject(onnx_weights, self.label_data)
+        img = cv2.imread(self.img_paths[0])
+        objects, annotated_img = detect.detect_object(img, save_path,
+                                                      annotate=True)
+        assert (annotated_img != img).any()
+        assert (cv2.imread(save_path) == annotated_img).all()
+        # PyTorchと同じ描画になる
+        expected_img = DetectObject(self.weights,
+                                    self.label_data).annotate(img, objects)
+        assert (annotated_img == expected_img).all()
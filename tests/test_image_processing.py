@@ -4,6 +4,7 @@
 """
 from src.image_processing import ImageProcessing
 import cv2
+import pytest
 import os
 
 
@@ -52,3 +53,27 @@ class TestImageProcessing:
         resize_img = ImageProcessing.resize_img(
             self.wrong_path, self.save_resize_img, resize_w=320, resize_h=240)
         assert resize_img is None
+
+    def test_load_img(self):
+        """画像の読み込みのテスト."""
+        expect_img = cv2.imread(self.img_path)
+
+        # 画像パス
+        img = ImageProcessing.load_img(self.img_path)
+        assert (img == expect_img).all()
+
+        # バイト列
+        with open(self.img_path, "rb") as f:
+            img = ImageProcessing.load_img(f.read())
+        assert (img == expect_img).all()
+
+        # BGR画像はそのまま返す
+        assert ImageProcessing.load_img(expect_img) is expect_img
+
+        # パスが間違っている場合
+        with pytest.raises(FileNotFoundError):
+            ImageProcessing.load_img(self.wrong_path)
+
+        # デコードできない場合
+        with pytest.raises(ValueError):
+            ImageProcessing.load_img(b"not an image")
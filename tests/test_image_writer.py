@@ -0,0 +1,73 @@
+"""検出結果の画像の保存スレッドのテスト.
+
+@author: kawanoichi
+"""
+from src.image_writer import ImageWriter
+import threading
+import pytest
+import cv2
+import numpy as np
+
+
+class TestImageWriter:
+    def setup_method(self):
+        """前処理."""
+        self.img = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.objects = np.array([[4, 4, 20, 20, 0.9, 0]], dtype=np.float32)
+
+    @staticmethod
+    def annotate(original_img, objects):
+        """検出結果の範囲を白く塗った画像を返す."""
+        img = original_img.copy()
+        for x1, y1, x2, y2, _, _ in objects.astype(int):
+            img[y1:y2, x1:x2] = 255
+        return img
+
+    def test_write(self, tmp_path):
+        """要求した画像が保存されるかのテスト."""
+        writer = ImageWriter(self.annotate)
+        save_paths = [str(tmp_path / f"{i}.png") for i in range(8)]
+        for path in save_paths:
+            writer.submit(self.img, self.objects, path)
+        writer.flush()
+        for path in save_paths:
+            img = cv2.imread(path)
+            assert img[10, 10].tolist() == [255, 255, 255]
+            assert img[30, 30].tolist() == [0, 0, 0]
+        assert writer.profiler.summary()["write"]["count"] == 8
+        writer.close()
+
+    def test_bounded_queue(self, tmp_path):
+        """保存待ちが上限に達した場合にsubmitが待つかのテスト."""
+        release = threading.Event()
+
+        def blocking_annotate(original_img, objects):
+            release.wait()
+            return original_img
+
+        writer = ImageWriter(blocking_annotate, maxsize=1)
+        writer.submit(self.img, self.objects, str(tmp_path / "0.png"))
+        writer.submit(self.img, self.objects, str(tmp_path / "1.png"))
+        submitter = threading.Thread(target=writer.submit, args=(
+            self.img, self.objects, str(tmp_path / "2.png")))
+        submitter.start()
+        submitter.join(timeout=0.2)
+        assert submitter.is_alive()  # 保存待ちが1件あるため待つ
+
+        release.set()
+        submitter.join()
+        writer.close()
+        assert len(list(tmp_path.glob("*.png"))) == 3
+
+    def test_error(self, tmp_path):
+        """保存に失敗しても保存スレッドが止まらないかのテスト."""
+        writer = ImageWriter(self.annotate)
+        bad_path = str(tmp_path / "not_exist" / "0.png")
+        writer.submit(self.img, self.objects, bad_path)
+        writer.submit(self.img, self.objects, str(tmp_path / "1.png"))
+        writer.flush()
+        assert [path for path, _ in writer.errors] == [bad_path]
+        assert (tmp_path / "1.png").exists()
+
+        with pytest.raises(ValueError):
+            ImageWriter(self.annotate, maxsize=0)
@@ -5,6 +5,8 @@
 from src.official_interface import OfficialInterface
 from unittest import mock
 from requests import Response
+import cv2
+import numpy as np
 
 
 class TestOfficialInterface:
@@ -41,3 +43,32 @@ class TestOfficialInterface:
         mock_post.return_value = mock_response
         img_path = "tests/testdata/img/fig.png"
         OfficialInterface.upload_snap(img_path)
+
+    @mock.patch("requests.post")
+    def test_upload_snap_in_memory(self, mock_post):
+        mock_response = mock.Mock(spec=Response)
+        mock_response.status_code = 201
+        mock_post.return_value = mock_response
+        img_path = "tests/testdata/img/FigA_1.png"
+        img = cv2.imread(img_path)
+
+        # BGR画像はメモリ上で640x480にリサイズして送信する
+        assert OfficialInterface.upload_snap(img)
+        data = mock_post.call_args.kwargs["data"]
+        assert cv2.imdecode(np.frombuffer(data, np.uint8),
+                            cv2.IMREAD_COLOR).shape == (480, 640, 3)
+        # 元の画像は変更しない
+        assert cv2.imread(img_path).shape == img.shape
+
+        # サイズが正しいPNGのバイト列はそのまま送信する
+        with open("tests/testdata/img/fig.png", "rb") as f:
+            png = f.read()
+        assert OfficialInterface.upload_snap(png)
+        assert mock_post.call_args.kwargs["data"] == png
+
+        # サイズが正しくないPNGのバイト列はリサイズして送信する
+        with open(img_path, "rb") as f:
+            assert OfficialInterface.upload_snap(f.read())
+        data = mock_post.call_args.kwargs["data"]
+        assert cv2.imdecode(np.frombuffer(data, np.uint8),
+                            cv2.IMREAD_COLOR).shape == (480, 640, 3)
@@ -3,6 +3,7 @@
 @author: miyashita64
 """
 from src.robo_snap import RoboSnap
+from src.detections import Detections
 from unittest import mock
 import os
 
@@ -42,7 +43,7 @@ class TestRoboSnap:
             delete_img(path1)
             delete_img(path2)
 
-    @mock.patch("src.robo_snap.DetectObject.detect_object")
+    @mock.patch("detect_object.DetectObject.detect_object")
     @mock.patch("src.robo_snap.OfficialInterface.upload_snap")
     def test_start_snap(self,
                         mock_upload_snap,
@@ -57,6 +58,65 @@ class TestRoboSnap:
                 self.snap.img_dir_path, "processed_"+img)
             assert os.path.exists(check_img_path)
 
+    @mock.patch("src.robo_snap.OfficialInterface.upload_snap")
+    def test_detector_cleanup(self, mock_upload_snap):
+        """物体検出の後片付けに失敗しても攻略結果を失わないかのテスト."""
+        mock_upload_snap.return_value = True
+        # flush_writes, profilerを持たない検出器
+        self.snap.detector = mock.Mock(spec=["detect_object"])
+        self.snap.detector.detect_object.return_value = []
+        assert self.snap.start_snap() is None
+
+        # ワーカープロセスが終了していて保存待ちの画像を待てない検出器
+        self.setup_method()
+        self.snap.detector = mock.Mock(
+            spec=["detect_object", "flush_writes", "release_model"])
+        self.snap.detector.detect_object.return_value = []
+        self.snap.detector.flush_writes.side_effect = RuntimeError("dead")
+        assert self.snap.start_snap() is None
+        assert self.snap.successful_send_fig_B
+        self.snap.detector.release_model.assert_called_once()
+
+    def test_detect_prefetch(self):
+        """別プロセスでの検出中に次の画像を取得するテスト."""
+        detector = mock.Mock()
+        detector.submit.return_value = 0
+        detector.result.return_value = [[0, 0, 10, 10, 0.9, 0]]
+
+        objects = self.snap.detect(detector, "tests/testdata/img/fig.png",
+                                   None)
+        assert objects == [[0, 0, 10, 10, 0.9, 0]]
+        detector.result.assert_called_once_with(0)
+
+        # 検出中に受信した画像が次の画像になる
+        assert self.snap.prefetched_img == (
+            "black.png", "tests/testdata/img/black.png")
+        assert self.snap.next_fig_image() == (
+            "black.png", "tests/testdata/img/black.png")
+        assert self.snap.prefetched_img is None
+        assert self.snap.next_fig_image()[0] == "FigA_1.png"
+
+    @mock.patch("src.robo_snap.OfficialInterface.upload_snap")
+    def test_upload_loaded_image(self, mock_upload_snap):
+        """読み込み済みの画像のアップロードのテスト."""
+        mock_upload_snap.return_value = True
+        # 640x480の画像は受信したバイト列をそのまま送信する
+        img_path = "tests/testdata/img/fig.png"
+        assert self.snap.load_fig_image(img_path).shape == (480, 640, 3)
+        assert self.snap.upload_snap(img_path)
+        with open(img_path, "rb") as f:
+            mock_upload_snap.assert_called_with(f.read())
+
+        # リサイズが必要な画像は読み込み済みのBGR画像を渡す
+        img_path = "tests/testdata/img/FigA_1.png"
+        img = self.snap.load_fig_image(img_path)
+        self.snap.upload_snap(img_path)
+        assert mock_upload_snap.call_args.args[0] is img
+
+        # 読み込んでいない画像は画像パスを渡す
+        self.snap.upload_snap("tests/testdata/img/FigB.png")
+        mock_upload_snap.assert_called_with("tests/testdata/img/FigB.png")
+
     def test_check_bestshot(self):
         """ロベストショット画像らしさスコアの算出のテスト."""
         # Fig&FrontalFace, ボックス重なってる
@@ -94,3 +154,9 @@ class TestRoboSnap:
         # 検出0
         objects = []
         assert self.snap.check_bestshot(objects) == 0
+
+        # 検出結果(Detections)をそのまま渡す
+        objects = Detections([[226.0, 121.0, 271.0, 196.0, 0.94, 0.0],
+                              [242.0, 131.0, 254.0, 145.0, 0.88, 1.0]])
+        assert self.snap.check_bestshot(objects) == 5
+        assert self.snap.check_bestshot(Detections()) == 0
@@ -1,9 +1,36 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Export a YOLOv5 PyTorch model to TorchScript and ONNX formats and verify the exported models
+
+Format                      | `--include`         | Model
+---                         | ---                 | ---
+PyTorch                     | -                   | learned_fig_weight_ver2.pt
+TorchScript                 | `torchscript`       | learned_fig_weight_ver2.torchscript
+ONNX                        | `onnx`              | learned_fig_weight_ver2.onnx
+Safetensors (memory-mapped) | `safetensors`       | learned_fig_weight_ver2.safetensors
+
+Usage:
+    $ poetry run python yolo/export.py --weights yolo/learned_fig_weight_ver2.pt --include torchscript onnx
+    $ poetry run python yolo/export.py --weights yolo/learned_fig_weight_ver2.pt --include safetensors
+
+    The exported models are checked against the PyTorch model on tests/testdata/img/*.png after
+    non_max_suppression (disable with --no-check).
+
+Inference:
+    DetectObject(weights='yolo/learned_fig_weight_ver2.onnx')  # ONNX Runtime
+    DetectObject(weights='yolo/learned_fig_weight_ver2.torchscript')  # TorchScript
+    DetectObject(weights='yolo/learned_fig_weight_ver2.safetensors')  # PyTorch, memory-mapped weights
+"""
+
+import argparse
+import inspect
+import json
 import os
 import platform
 import sys
+import time
 from pathlib import Path
 
-import pandas as pd
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # YOLOv5 root directory
@@ -12,23 +39,269 @@ if str(ROOT) not in sys.path:
 if platform.system() != 'Windows':
     ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
+IMAGE_DIR = FILE.parents[1] / 'tests' / 'testdata' / 'img'  # parity check images
+# Camera frames are 640x480. DetectObject letterboxes them with new_shape=(640, 480), auto=True,
+# which gives a (384, 480) input tensor, so that is the fixed export size
+DEFAULT_IMGSZ = (384, 480)  # (height, width)
 
 MACOS = platform.system() == 'Darwin'  # macOS environment
 
 
+EXPORT_FORMATS = (
+    # Format, Argument, Suffix, CPU, GPU
+    ('PyTorch', '-', '.pt', True, True),
+    ('TorchScript', 'torchscript', '.torchscript', True, True),
+    ('ONNX', 'onnx', '.onnx', True, True),
+    ('OpenVINO', 'openvino', '_openvino_model', True, False),
+    ('TensorRT', 'engine', '.engine', False, True),
+    ('CoreML', 'coreml', '.mlmodel', True, False),
+    ('TensorFlow SavedModel', 'saved_model', '_saved_model', True, True),
+    ('TensorFlow GraphDef', 'pb', '.pb', True, True),
+    ('TensorFlow Lite', 'tflite', '.tflite', True, False),
+    ('TensorFlow Edge TPU', 'edgetpu', '_edgetpu.tflite', False, False),
+    ('TensorFlow.js', 'tfjs', '_web_model', False, False),
+    ('PaddlePaddle', 'paddle', '_paddle_model', True, True),
+    ('Safetensors', 'safetensors', '.safetensors', True, True), )  # loaded as PyTorch, see DetectMultiBackend
+
+
 def export_formats():
-    # YOLOv5 export formats
-    x = [
-        ['PyTorch', '-', '.pt', True, True],
-        ['TorchScript', 'torchscript', '.torchscript', True, True],
-        ['ONNX', 'onnx', '.onnx', True, True],
-        ['OpenVINO', 'openvino', '_openvino_model', True, False],
-        ['TensorRT', 'engine', '.engine', False, True],
-        ['CoreML', 'coreml', '.mlmodel', True, False],
-        ['TensorFlow SavedModel', 'saved_model', '_saved_model', True, True],
-        ['TensorFlow GraphDef', 'pb', '.pb', True, True],
-        ['TensorFlow Lite', 'tflite', '.tflite', True, False],
-        ['TensorFlow Edge TPU', 'edgetpu', '_edgetpu.tflite', False, False],
-        ['TensorFlow.js', 'tfjs', '_web_model', False, False],
-        ['PaddlePaddle', 'paddle', '_paddle_model', True, True], ]
-    return pd.DataFrame(x, columns=['Format', 'Argument', 'Suffix', 'CPU', 'GPU'])
+    # YOLOv5 export formats as a plain tuple table (no pandas), see EXPORT_FORMATS for the columns
+    return EXPORT_FORMATS
+
+
+def export_torchscript(model, im, file, metadata, prefix='TorchScript:'):
+    # YOLOv5 TorchScript model export
+    import torch
+
+    from utils.general import LOGGER, file_size
+
+    LOGGER.info(f'\n{prefix} starting export with torch {torch.__version__}...')
+    f = file.with_suffix('.torchscript')
+
+    ts = torch.jit.trace(model, im, strict=False)
+    extra_files = {'config.txt': json.dumps(metadata)}  # torch._C.ExtraFilesMap()
+    ts.save(str(f), _extra_files=extra_files)
+    LOGGER.info(f'{prefix} export success ✅ saved as {f} ({file_size(f):.1f} MB)')
+    return f
+
+
+def export_onnx(model, im, file, metadata, opset=12, dynamic=False, simplify=False, prefix='ONNX:'):
+    # YOLOv5 ONNX export
+    import onnx
+    import torch
+
+    from utils.general import LOGGER, file_size
+
+    LOGGER.info(f'\n{prefix} starting export with onnx {onnx.__version__}...')
+    f = file.with_suffix('.onnx')
+
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False  # TorchScript-based exporter, torch>=2.5 defaults to dynamo
+    torch.onnx.export(
+        model,
+        im,
+        str(f),
+        verbose=False,
+        opset_version=opset,
+        do_constant_folding=True,
+        input_names=['images'],
+        output_names=['output0'],
+        dynamic_axes={
+            'images': {0: 'batch'},  # shape(1,3,384,480), height and width stay fixed
+            'output0': {0: 'batch'}} if dynamic else None,  # shape(1,n,8)
+        **kwargs)
+
+    # Checks
+    model_onnx = onnx.load(f)  # load onnx model
+    onnx.checker.check_model(model_onnx)  # check onnx model
+
+    # Metadata
+    for k, v in metadata.items():
+        meta = model_onnx.metadata_props.add()
+        meta.key, meta.value = k, str(v)
+
+    # Simplify
+    if simplify:
+        try:
+            import onnxsim
+
+            LOGGER.info(f'{prefix} simplifying with onnx-simplifier {onnxsim.__version__}...')
+            model_onnx, check = onnxsim.simplify(model_onnx)
+            assert check, 'assert check failed'
+        except Exception as e:
+            LOGGER.info(f'{prefix} simplifier failure: {e}')
+    onnx.save(model_onnx, f)
+    LOGGER.info(f'{prefix} export success ✅ saved as {f} ({file_size(f):.1f} MB)')
+    return f
+
+
+def export_safetensors(model, file, prefix='Safetensors:'):
+    # YOLOv5 fused weights export for memory-mapped loading, see models/experimental.save_safetensors()
+    from models.experimental import save_safetensors
+    from utils.general import LOGGER, file_size
+
+    LOGGER.info(f'\n{prefix} starting export...')
+    f = save_safetensors(model, file.with_suffix('.safetensors'))
+    LOGGER.info(f'{prefix} export success ✅ saved as {f} ({file_size(f):.1f} MB)')
+    return f
+
+
+def load_check_images(source=IMAGE_DIR, imgsz=DEFAULT_IMGSZ, stride=32):
+    # Load and letterbox the parity check images to the fixed export size, returns [(name, (1,3,h,w) tensor)]
+    import cv2
+    import numpy as np
+    import torch
+
+    from utils.augmentations import letterbox
+
+    files = sorted(Path(source).glob('*.png')) if Path(source).is_dir() else [Path(source)]
+    images = []
+    for f in files:
+        im0 = cv2.imread(str(f))  # BGR
+        if im0 is None:
+            continue
+        im = letterbox(im0, imgsz, stride=stride, auto=False)[0]
+        im = np.ascontiguousarray(im.transpose((2, 0, 1))[::-1])  # HWC to CHW, BGR to RGB
+        images.append((f.name, torch.from_numpy(im).float()[None] / 255))
+    return images
+
+
+def check_parity(model, exported, data=None, source=IMAGE_DIR, imgsz=DEFAULT_IMGSZ, conf_thres=0.6, iou_thres=0.45,
+                 max_det=10, atol=1e-2, rtol=1e-3):
+    # Compare exported models with the PyTorch model after non_max_suppression, returns True if all outputs match
+    import torch
+
+    from models.common import DetectMultiBackend
+    from utils.general import LOGGER, non_max_suppression
+
+    stride = int(model.stride.max())
+    images = load_check_images(source, imgsz, stride)
+    assert images, f'ERROR: no images found in {source}'
+
+    def detect(m, im):
+        with torch.no_grad():
+            return non_max_suppression(m(im), conf_thres, iou_thres, max_det=max_det)[0]
+
+    expected = [detect(model, im) for _, im in images]
+    ok = True
+    for f in exported:
+        backend = DetectMultiBackend(f, device=torch.device('cpu'), data=data)
+        for (name, im), x in zip(images, expected):
+            y = detect(backend, im)
+            match = x.shape == y.shape and torch.allclose(x, y, atol=atol, rtol=rtol)
+            max_diff = (x - y).abs().max().item() if x.shape == y.shape and len(x) else 0.0
+            LOGGER.info(f'{Path(f).name:>40} {name:>20} {len(x):>3} vs {len(y):>3} detections, '
+                        f'max diff {max_diff:.2e} {"✅" if match else "❌"}')
+            ok &= match
+    return ok
+
+
+def run(
+        weights=ROOT / 'learned_fig_weight_ver2.pt',  # weights path
+        data=ROOT / 'fig_label.yaml',  # label yaml path
+        imgsz=DEFAULT_IMGSZ,  # image (height, width)
+        batch_size=1,  # batch size
+        include=('torchscript', 'onnx'),  # include formats
+        dynamic=False,  # ONNX: dynamic batch axis
+        simplify=False,  # ONNX: simplify model
+        opset=12,  # ONNX: opset version
+        check=True,  # compare exported models with the PyTorch model
+        source=IMAGE_DIR,  # parity check images
+        atol=1e-2,  # parity check absolute tolerance
+        rtol=1e-3,  # parity check relative tolerance
+):
+    import torch
+
+    from models.experimental import attempt_load
+    from models.yolo import Detect
+    from utils.general import LOGGER, check_img_size, colorstr
+
+    t = time.time()
+    include = [x.lower() for x in include]  # to lowercase
+    fmts = tuple(x[1] for x in export_formats()[1:])  # --include arguments
+    flags = [x in include for x in fmts]
+    assert sum(flags) == len(include), f'ERROR: Invalid --include {include}, valid --include arguments are {fmts}'
+    jit, onnx, safetensors = flags[0], flags[1], flags[-1]  # export booleans
+    assert not any(flags[2:-1]), \
+        f'ERROR: only torchscript, onnx and safetensors export are supported, got --include {include}'
+    file = Path(weights)
+
+    # Load PyTorch model
+    device = torch.device('cpu')
+    model = attempt_load(weights, device=device, inplace=True, fuse=True)  # load FP32 model
+
+    # Checks
+    imgsz = [imgsz, imgsz] if isinstance(imgsz, int) else list(imgsz)
+    gs = int(max(model.stride))  # grid size (max stride)
+    imgsz = check_img_size(imgsz, s=gs)  # verify img_size are gs-multiples
+
+    # Input
+    im = torch.zeros(batch_size, 3, *imgsz).to(device)  # image size(1,3,384,480) BCHW iDetection
+
+    # Update model
+    model.eval()
+    for k, m in model.named_modules():
+        if isinstance(m, Detect):
+            m.inplace = True
+            m.dynamic = dynamic
+            m.export = True
+
+    for _ in range(2):
+        y = model(im)  # dry runs
+    shape = tuple((y[0] if isinstance(y, tuple) else y).shape)  # model output shape
+    metadata = {'stride': gs, 'names': model.names}  # model metadata
+    LOGGER.info(f"\n{colorstr('PyTorch:')} starting from {file} with output shape {shape}")
+
+    # Exports
+    f = []
+    if jit:  # TorchScript
+        f.append(export_torchscript(model, im, file, metadata))
+    if onnx:  # ONNX
+        f.append(export_onnx(model, im, file, metadata, opset, dynamic, simplify))
+    if safetensors:  # Safetensors
+        f.append(export_safetensors(model, file))
+    f = [str(x) for x in f]  # exporters return a Path for every requested format, nothing to filter
+
+    # Parity check
+    for m in model.modules():
+        if isinstance(m, Detect):
+            m.export = False  # same (pred, feature maps) output as DetectMultiBackend PyTorch inference
+    ok = check_parity(model, f, data, source, imgsz, atol=atol, rtol=rtol) if check and f else True
+
+    # Finish
+    LOGGER.info(f'\nExport complete ({time.time() - t:.1f}s)'
+                f"\nResults saved to {colorstr('bold', file.parent.resolve())}"
+                f"\nParity check:    {'skipped' if not check else 'passed ✅' if ok else 'FAILED ❌'}")
+    if not ok:
+        raise AssertionError('ERROR: exported model outputs do not match the PyTorch model')
+    return f  # return list of exported files/dirs
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default=ROOT / 'learned_fig_weight_ver2.pt', help='model.pt path')
+    parser.add_argument('--data', type=str, default=ROOT / 'fig_label.yaml', help='label yaml path')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=list(DEFAULT_IMGSZ),
+                        help='image (h, w)')
+    parser.add_argument('--batch-size', type=int, default=1, help='batch size')
+    parser.add_argument('--dynamic', action='store_true', help='ONNX: dynamic batch axis')
+    parser.add_argument('--simplify', action='store_true', help='ONNX: simplify model')
+    parser.add_argument('--opset', type=int, default=12, help='ONNX: opset version')
+    parser.add_argument('--include', nargs='+', default=['torchscript', 'onnx'], help='torchscript, onnx, safetensors')
+    parser.add_argument('--no-check', dest='check', action='store_false', help='skip the parity check')
+    parser.add_argument('--source', type=str, default=IMAGE_DIR, help='parity check image file or directory')
+    parser.add_argument('--atol', type=float, default=1e-2, help='parity check absolute tolerance')
+    parser.add_argument('--rtol', type=float, default=1e-3, help='parity check relative tolerance')
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    main(opt)
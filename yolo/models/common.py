@@ -3,9 +3,9 @@
 Common modules
 """
 
-# import ast
+import ast
 # import contextlib
-# import json
+import json
 import math
 # import platform
 import warnings
@@ -15,7 +15,7 @@ import warnings
 from pathlib import Path
 from urllib.parse import urlparse
 
-# import cv2
+import cv2
 import numpy as np
 # import pandas as pd
 # import requests
@@ -42,7 +42,7 @@ import torch.nn as nn
 # from utils.general import (LOGGER, ROOT, Profile, check_requirements, check_suffix, check_version, colorstr,
 #                            increment_path, is_jupyter, make_divisible, non_max_suppression, scale_boxes, xywh2xyxy,
 #                            xyxy2xywh, yaml_load)
-from utils.general import (check_suffix)
+from utils.general import (LOGGER, check_suffix, yaml_load)
 
 
 # from utils.torch_utils import copy_attr, smart_inference_mode
@@ -329,9 +329,26 @@ class Concat(nn.Module):
 
 class DetectMultiBackend(nn.Module):
     # YOLOv5 MultiBackend class for python inference on various backends
-    def __init__(self, weights='yolov5s.pt', device=torch.device('cpu'), dnn=False, data=None, fp16=False, fuse=True):
+    # ONNX Runtime graph optimization levels
+    ORT_GRAPH_OPTIMIZATION_LEVELS = {
+        'disable': 'ORT_DISABLE_ALL',
+        'basic': 'ORT_ENABLE_BASIC',
+        'extended': 'ORT_ENABLE_EXTENDED',
+        'all': 'ORT_ENABLE_ALL'}
+
+    def __init__(self,
+                 weights='yolov5s.pt',
+                 device=torch.device('cpu'),
+                 dnn=False,
+                 data=None,
+                 fp16=False,
+                 fuse=True,
+                 intra_op_threads=0,
+                 inter_op_threads=0,
+                 graph_optimization_level='all'):
         # Usage:
         #   PyTorch:              weights = *.pt
+        #                                   *.safetensors (memory-mapped, see export.py --include safetensors)
         #   TorchScript:                    *.torchscript
         #   ONNX Runtime:                   *.onnx
         #   ONNX OpenCV DNN:                *.onnx --dnn
@@ -343,6 +360,8 @@ class DetectMultiBackend(nn.Module):
         #   TensorFlow Lite:                *.tflite
         #   TensorFlow Edge TPU:            *_edgetpu.tflite
         #   PaddlePaddle:                   *_paddle_model
+        # ONNX Runtime options (0 threads = ONNX Runtime default):
+        #   intra_op_threads, inter_op_threads, graph_optimization_level = 'disable', 'basic', 'extended' or 'all'
         from models.experimental import attempt_download, attempt_load  # scoped to avoid circular import
 
         super().__init__()
@@ -350,8 +369,9 @@ class DetectMultiBackend(nn.Module):
         pt, jit, onnx, xml, engine, coreml, saved_model, pb, tflite, edgetpu, tfjs, paddle, triton = self._model_type(w)
         fp16 &= pt or jit or onnx or engine or triton  # FP16
         nhwc = coreml or saved_model or pb or tflite or edgetpu  # BHWC formats (vs torch BCWH)
-        # stride = 32  # default stride
-        # cuda = torch.cuda.is_available() and device.type != 'cpu'  # use CUDA
+        stride = 32  # default stride
+        cuda = torch.cuda.is_available() and device.type != 'cpu'  # use CUDA
+        fixed_imgsz, max_batch_size = None, None  # static input (h, w) and batch size, None if dynamic
         if not (pt or triton):
             w = attempt_download(w)  # download if not local
 
@@ -361,31 +381,42 @@ class DetectMultiBackend(nn.Module):
             names = model.module.names if hasattr(model, 'module') else model.names  # get class names
             model.half() if fp16 else model.float()
             self.model = model  # explicitly assign for to(), cpu(), cuda(), half()
-        # elif jit:  # TorchScript
-        #     LOGGER.info(f'Loading {w} for TorchScript inference...')
-        #     extra_files = {'config.txt': ''}  # model metadata
-        #     model = torch.jit.load(w, _extra_files=extra_files, map_location=device)
-        #     model.half() if fp16 else model.float()
-        #     if extra_files['config.txt']:  # load metadata dict
-        #         d = json.loads(extra_files['config.txt'],
-        #                        object_hook=lambda d: {
-        #                            int(k) if k.isdigit() else k: v
-        #                            for k, v in d.items()})
-        #         stride, names = int(d['stride']), d['names']
-        # elif dnn:  # ONNX OpenCV DNN
-        #     LOGGER.info(f'Loading {w} for ONNX OpenCV DNN inference...')
-        #     check_requirements('opencv-python>=4.5.4')
-        #     net = cv2.dnn.readNetFromONNX(w)
-        # elif onnx:  # ONNX Runtime
-        #     LOGGER.info(f'Loading {w} for ONNX Runtime inference...')
-        #     check_requirements(('onnx', 'onnxruntime-gpu' if cuda else 'onnxruntime'))
-        #     import onnxruntime
-        #     providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda else ['CPUExecutionProvider']
-        #     session = onnxruntime.InferenceSession(w, providers=providers)
-        #     output_names = [x.name for x in session.get_outputs()]
-        #     meta = session.get_modelmeta().custom_metadata_map  # metadata
-        #     if 'stride' in meta:
-        #         stride, names = int(meta['stride']), eval(meta['names'])
+        elif jit:  # TorchScript
+            LOGGER.info(f'Loading {w} for TorchScript inference...')
+            extra_files = {'config.txt': ''}  # model metadata
+            model = torch.jit.load(w, _extra_files=extra_files, map_location=device)
+            model.half() if fp16 else model.float()
+            if extra_files['config.txt']:  # load metadata dict
+                d = json.loads(extra_files['config.txt'],
+                               object_hook=lambda d: {
+                                   int(k) if k.isdigit() else k: v
+                                   for k, v in d.items()})
+                stride, names = int(d['stride']), d['names']
+        elif dnn:  # ONNX OpenCV DNN
+            LOGGER.info(f'Loading {w} for ONNX OpenCV DNN inference...')
+            net = cv2.dnn.readNetFromONNX(w)
+        elif onnx:  # ONNX Runtime
+            LOGGER.info(f'Loading {w} for ONNX Runtime inference...')
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = intra_op_threads
+            session_options.inter_op_num_threads = inter_op_threads
+            if graph_optimization_level not in self.ORT_GRAPH_OPTIMIZATION_LEVELS:
+                raise ValueError(f'ERROR: invalid graph_optimization_level {graph_optimization_level}, '
+                                 f'valid values are {list(self.ORT_GRAPH_OPTIMIZATION_LEVELS)}')
+            session_options.graph_optimization_level = getattr(
+                onnxruntime.GraphOptimizationLevel, self.ORT_GRAPH_OPTIMIZATION_LEVELS[graph_optimization_level])
+            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda else ['CPUExecutionProvider']
+            session = onnxruntime.InferenceSession(w, sess_options=session_options, providers=providers)
+            output_names = [x.name for x in session.get_outputs()]
+            input_shape = session.get_inputs()[0].shape  # i.e. [1, 3, 384, 480] or ['batch', 3, 384, 480]
+            if all(isinstance(x, int) for x in input_shape[2:]):
+                fixed_imgsz = tuple(input_shape[2:])
+            if isinstance(input_shape[0], int):
+                max_batch_size = input_shape[0]
+            meta = session.get_modelmeta().custom_metadata_map  # metadata
+            if 'stride' in meta:
+                stride, names = int(meta['stride']), ast.literal_eval(meta['names'])
         # elif xml:  # OpenVINO
         #     LOGGER.info(f'Loading {w} for OpenVINO inference...')
         #     check_requirements('openvino>=2023.0')  # requires openvino-dev: https://pypi.org/project/openvino-dev/
@@ -511,8 +542,10 @@ class DetectMultiBackend(nn.Module):
             raise NotImplementedError(f'ERROR: {w} is not a supported format')
 
         # class names
-        # if 'names' not in locals():
-        #     names = yaml_load(data)['names'] if data else {i: f'class{i}' for i in range(999)}
+        if 'names' not in locals():
+            names = yaml_load(data)['names'] if data else {i: f'class{i}' for i in range(999)}
+        if isinstance(names, (list, tuple)):
+            names = dict(enumerate(names))  # convert to dict
         # if names[0] == 'n01440764' and len(names) == 1000:  # ImageNet
         #     names = yaml_load(ROOT / 'data/ImageNet.yaml')['names']  # human-readable names
 
@@ -528,15 +561,15 @@ class DetectMultiBackend(nn.Module):
 
         if self.pt:  # PyTorch
             y = self.model(im, augment=augment, visualize=visualize) if augment or visualize else self.model(im)
-        # elif self.jit:  # TorchScript
-        #     y = self.model(im)
-        # elif self.dnn:  # ONNX OpenCV DNN
-        #     im = im.cpu().numpy()  # torch to numpy
-        #     self.net.setInput(im)
-        #     y = self.net.forward()
-        # elif self.onnx:  # ONNX Runtime
-        #     im = im.cpu().numpy()  # torch to numpy
-        #     y = self.session.run(self.output_names, {self.session.get_inputs()[0].name: im})
+        elif self.jit:  # TorchScript
+            y = self.model(im)
+        elif self.dnn:  # ONNX OpenCV DNN
+            im = im.cpu().numpy()  # torch to numpy
+            self.net.setInput(im)
+            y = self.net.forward()
+        elif self.onnx:  # ONNX Runtime
+            im = im.cpu().numpy()  # torch to numpy
+            y = self.session.run(self.output_names, {self.session.get_inputs()[0].name: im})
         # elif self.xml:  # OpenVINO
         #     im = im.cpu().numpy()  # FP32
         #     y = list(self.ov_compiled_model(im).values())
@@ -603,12 +636,13 @@ class DetectMultiBackend(nn.Module):
     def from_numpy(self, x):
         return torch.from_numpy(x).to(self.device) if isinstance(x, np.ndarray) else x
 
-    def warmup(self, imgsz=(1, 3, 640, 640)):
-        # Warmup model by running inference once
-        warmup_types = self.pt, self.jit, self.onnx, self.engine, self.saved_model, self.pb, self.triton
-        if any(warmup_types) and (self.device.type != 'cpu' or self.triton):
-            im = torch.empty(*imgsz, dtype=torch.half if self.fp16 else torch.float, device=self.device)  # input
-            for _ in range(2 if self.jit else 1):  #
+    def warmup(self, imgsz=(1, 3, 640, 640), cpu=False, n=1):
+        # Warmup model by running inference n times, on CPU only if cpu=True
+        # CPU warmup moves the one-time costs (allocator growth, oneDNN primitives, Detect grids) out of the first image
+        warmup_types = self.pt, self.jit, self.dnn, self.onnx, self.engine, self.saved_model, self.pb, self.triton
+        if any(warmup_types) and (self.device.type != 'cpu' or self.triton or cpu):
+            im = torch.zeros(*imgsz, dtype=torch.half if self.fp16 else torch.float, device=self.device)  # input
+            for _ in range(max(n, 2 if self.jit else 1)):  #
                 self.forward(im)  # warmup
 
     @staticmethod
@@ -617,12 +651,13 @@ class DetectMultiBackend(nn.Module):
         # types = [pt, jit, onnx, xml, engine, coreml, saved_model, pb, tflite, edgetpu, tfjs, paddle]
         from export import export_formats
         from utils.downloads import is_url
-        sf = list(export_formats().Suffix)  # export suffixes
+        sf = [x[2] for x in export_formats()]  # export suffixes
         if not is_url(p, check=False):
             check_suffix(p, sf)  # checks
         url = urlparse(p)  # if url may be Triton inference server
         types = [s in Path(p).name for s in sf]
         types[8] &= not types[9]  # tflite &= not edgetpu
+        types[0] |= types.pop()  # *.safetensors weights are loaded by attempt_load() like *.pt
         triton = not any(types) and all([any(s in url.scheme for s in ['http', 'grpc']), url.netloc])
         return types + [triton]
 
@@ -2,13 +2,28 @@
 """
 Experimental modules
 """
+import hashlib
+import json
+import logging
 # import math
+import os
+import struct
+import threading
+from pathlib import Path
 
-# import numpy as np
+import numpy as np
 import torch
 import torch.nn as nn
 
 from utils.downloads import attempt_download
+from utils.general import CONFIG_DIR, LOGGER
+
+# Fused eval-mode FP32 models saved by attempt_load(), set YOLOv5_FUSED_CACHE_DIR to relocate
+FUSED_CACHE_DIR = Path(os.getenv('YOLOv5_FUSED_CACHE_DIR', CONFIG_DIR / 'fused_models'))
+# safetensors dtype codes of the tensors a YOLOv5 state_dict can hold
+SAFETENSORS_DTYPES = {
+    'F16': np.float16, 'F32': np.float32, 'F64': np.float64, 'I32': np.int32, 'I64': np.int64, 'U8': np.uint8,
+    'BOOL': np.bool_}
 
 
 # class Sum(nn.Module):
@@ -74,24 +89,163 @@ class Ensemble(nn.ModuleList):
         return y, None  # inference, train output
 
 
-def attempt_load(weights, device=None, inplace=True, fuse=True):
+def fused_cache_file(w, cache_dir=FUSED_CACHE_DIR):
+    # Return the fused model cache path of weights w: '<stem>-<path hash>-<weights SHA-256>-torch<version>.pt'
+    # The hash of the resolved path keeps caches of different weights files with the same stem apart
+    w = Path(w).resolve()
+    k = hashlib.sha256(str(w).encode()).hexdigest()[:8]
+    h = hashlib.sha256(w.read_bytes()).hexdigest()[:16]
+    return Path(cache_dir) / f'{w.stem}-{k}-{h}-torch{torch.__version__}.pt'
+
+
+def load_fused_cache(f, device=None):
+    # Load a fused model saved by save_fused_cache(), returns None if f is missing or unreadable
+    if not f.exists():
+        return None
+    try:
+        return torch.load(f, map_location='cpu', weights_only=False).to(device)  # written by this process owner
+    except Exception as e:
+        LOGGER.warning(f'WARNING ⚠️ fused model cache {f} is unreadable and will be rebuilt: {e}')
+        f.unlink(missing_ok=True)
+        return None
+
+
+def save_fused_cache(model, f):
+    # Save a fused model to f and remove stale caches of the same weights file (other SHA-256 or torch version)
+    try:
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_suffix(f'.{os.getpid()}.tmp')
+        torch.save(model, tmp)
+        os.replace(tmp, f)  # atomic, concurrent loaders never see a partial file
+        prefix = f'{f.name.rsplit("-", 2)[0]}-'  # '<stem>-<path hash>-'
+        for x in f.parent.iterdir():
+            if x != f and x.name.startswith(prefix) and x.suffix == '.pt':
+                x.unlink(missing_ok=True)
+    except Exception as e:
+        LOGGER.warning(f'WARNING ⚠️ fused model cache {f} not saved: {e}')
+
+
+def save_safetensors(model, f, channels_last=True):
+    # Save a fused FP32 model in the safetensors layout (https://github.com/huggingface/safetensors): an 8-byte
+    # little-endian header size, a JSON header {name: {dtype, shape, data_offsets}, '__metadata__': {...}} and the raw
+    # tensor blob. The metadata holds stride, names and the model yaml so load_safetensors() needs no pickle.
+    # With channels_last, 4D weights are stored in OHWI order so DetectObject(channels_last=True) can use them as mapped
+    header, blobs, offset = {}, [], 0
+    for k, v in model.state_dict().items():
+        v = v.detach().cpu()
+        a = (v.permute(0, 2, 3, 1) if channels_last and v.ndim == 4 else v).contiguous().numpy()
+        dtype = next(c for c, d in SAFETENSORS_DTYPES.items() if a.dtype == d)
+        header[k] = {'dtype': dtype, 'shape': list(a.shape), 'data_offsets': [offset, offset + a.nbytes]}
+        blobs.append(a)
+        offset += a.nbytes
+    header['__metadata__'] = {
+        'stride': json.dumps(model.stride.tolist()),
+        'names': json.dumps(dict(enumerate(model.names)) if isinstance(model.names, (list, tuple)) else model.names),
+        'yaml': json.dumps(model.yaml),
+        'memory_format': 'channels_last' if channels_last else 'contiguous'}
+    data = json.dumps(header, separators=(',', ':')).encode()
+    data += b' ' * (-len(data) % 8)  # pad the header so the tensor blob starts 8-byte aligned
+    f = Path(f)
+    tmp = f.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp, 'wb') as file:
+        file.write(struct.pack('<Q', len(data)))
+        file.write(data)
+        for a in blobs:
+            file.write(a.data)
+    os.replace(tmp, f)  # atomic, concurrent loaders never see a partial file
+    return f
+
+
+def load_safetensors(w, device=None):
+    # Load a model saved by save_safetensors(). The model is built from the yaml in the header and its parameters and
+    # buffers become copy-on-write memory-mapped views of the file, so nothing is read or unpickled up front and
+    # processes loading the same file share its page-cache pages until a tensor is written
+    from models.common import Conv, DWConv
+    from models.yolo import Model
+
+    with open(w, 'rb') as f:
+        n = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(n))
+    meta = header.pop('__metadata__')
+    channels_last = meta.get('memory_format') == 'channels_last'
+    blob = np.memmap(w, dtype=np.uint8, mode='c', offset=8 + n)
+    state = {}
+    for k, v in header.items():
+        start, end = v['data_offsets']
+        t = torch.from_numpy(blob[start:end].view(SAFETENSORS_DTYPES[v['dtype']]).reshape(v['shape']))
+        state[k] = t.permute(0, 3, 1, 2) if channels_last and t.ndim == 4 else t  # OHWI storage, OIHW view
+
+    cfg = json.loads(meta['yaml'])
+    # parse_model() logs the layer table on every build, drop this thread's INFO records only (the logger level is
+    # shared with other threads, e.g. while preload() runs this in the background)
+    thread = threading.get_ident()
+
+    def quiet(record):
+        return record.thread != thread or record.levelno >= logging.WARNING
+
+    LOGGER.addFilter(quiet)
+    try:
+        # Build on the meta device so no parameter is allocated or initialized, saved strides skip the probe forward
+        with torch.device('meta'):
+            model = Model(cfg, ch=cfg.get('ch', 3), nc=cfg['nc'], stride=json.loads(meta['stride']))
+            for m in model.modules():  # fuse Conv() + BatchNorm2d() layers structurally, stored weights are fused
+                if isinstance(m, (Conv, DWConv)) and hasattr(m, 'bn'):
+                    c = m.conv
+                    m.conv = nn.Conv2d(c.in_channels, c.out_channels, c.kernel_size, c.stride, c.padding, c.dilation,
+                                       c.groups)
+                    delattr(m, 'bn')
+                    m.forward = m.forward_fuse
+    finally:
+        LOGGER.removeFilter(quiet)
+    # Take the mapped tensors as they are, no copy into the new model. load_state_dict() copies into the existing
+    # (meta) tensors and its assign=True needs torch>=2.1, so swap them in directly (torch>=2.0)
+    missing = set(model.state_dict()) ^ set(state)
+    if missing:
+        raise RuntimeError(f'{w} does not match its model yaml: {sorted(missing)}')
+    for k, t in state.items():
+        module_name, _, name = k.rpartition('.')
+        module = model.get_submodule(module_name)
+        if name in module._parameters:
+            module._parameters[name] = nn.Parameter(t, requires_grad=False)
+        else:
+            module._buffers[name] = t
+    m = model.model[-1]  # Detect()
+    m.grid, m.anchor_grid = [torch.empty(0)] * m.nl, [torch.empty(0)] * m.nl  # drop meta grids, rebuilt on 1st forward
+    model.names = {int(k): v for k, v in json.loads(meta['names']).items()}
+    return model.to(device).eval()
+
+
+def attempt_load(weights, device=None, inplace=True, fuse=True, cache_dir=FUSED_CACHE_DIR):
     # Loads an ensemble of models weights=[a,b,c] or a single model weights=[a] or weights=a
+    # Fused models are cached in cache_dir (None to disable) and reloaded while the weights file is unchanged
+    # *.safetensors weights (see save_safetensors()) are fused already and memory-mapped instead of unpickled
     from models.yolo import Detect, Model
 
     model = Ensemble()
     for w in weights if isinstance(weights, list) else [weights]:
-        ckpt = torch.load(attempt_download(w), map_location='cpu')  # load
-        ckpt = (ckpt.get('ema') or ckpt['model']).to(
-            device).float()  # FP32 model
-
-        # Model compatibility updates
-        if not hasattr(ckpt, 'stride'):
-            ckpt.stride = torch.tensor([32.])
-        if hasattr(ckpt, 'names') and isinstance(ckpt.names, (list, tuple)):
-            ckpt.names = dict(enumerate(ckpt.names))  # convert to dict
-
-        model.append(ckpt.fuse().eval() if fuse and hasattr(
-            ckpt, 'fuse') else ckpt.eval())  # model in eval mode
+        w = attempt_download(w)
+        if Path(w).suffix == '.safetensors':
+            model.append(load_safetensors(w, device))
+            continue
+        f = fused_cache_file(w, cache_dir) if fuse and cache_dir else None
+        ckpt = load_fused_cache(f, device) if f else None
+        if ckpt is None:
+            ckpt = torch.load(w, map_location='cpu', weights_only=False)  # load (torch>=2.6 defaults to weights_only)
+            ckpt = (ckpt.get('ema') or ckpt['model']).to(
+                device).float()  # FP32 model
+
+            # Model compatibility updates
+            if not hasattr(ckpt, 'stride'):
+                ckpt.stride = torch.tensor([32.])
+            if hasattr(ckpt, 'names') and isinstance(ckpt.names, (list, tuple)):
+                ckpt.names = dict(enumerate(ckpt.names))  # convert to dict
+
+            ckpt = ckpt.fuse().eval() if fuse and hasattr(
+                ckpt, 'fuse') else ckpt.eval()  # model in eval mode
+            if f:
+                save_fused_cache(ckpt, f)
+
+        model.append(ckpt)
 
     # Module updates
     for m in model.modules():
@@ -7,6 +7,7 @@ from utils.general import LOGGER, check_version, make_divisible
 from utils.autoanchor import check_anchor_order
 # import argparse
 import contextlib
+import math
 import os
 import platform
 import sys
@@ -34,6 +35,7 @@ class Detect(nn.Module):
     stride = None  # strides computed during build
     dynamic = False  # force grid reconstruction
     export = False  # export mode
+    conf_thres = None  # confidence-gated inference, only decode cells with objectness > conf_thres
 
     def __init__(self, nc=80, anchors=(), ch=(), inplace=True):  # detection layer
         super().__init__()
@@ -51,6 +53,8 @@ class Detect(nn.Module):
         self.inplace = inplace  # use inplace ops (e.g. slice assignment)
 
     def forward(self, x):
+        if self.conf_thres is not None and not (self.training or self.export or isinstance(self, Segment)):
+            return self._forward_gated(x)
         z = []  # inference output
         for i in range(self.nl):
             x[i] = self.m[i](x[i])  # conv
@@ -79,6 +83,28 @@ class Detect(nn.Module):
 
         return x if self.training else (torch.cat(z, 1), ) if self.export else (torch.cat(z, 1), x)
 
+    def _forward_gated(self, x):
+        # Threshold objectness on the raw logits (inverse sigmoid of conf_thres) and decode only the surviving cells
+        # Returns ([(n,no) candidates per image], feature maps), non_max_suppression() accepts the candidate list
+        t = math.log(self.conf_thres / (1 - self.conf_thres)) - 1e-6 if 0 < self.conf_thres < 1 else \
+            (-math.inf if self.conf_thres <= 0 else math.inf)  # slightly loose, NMS applies the exact threshold
+        z, b = [], []  # candidates, image indices
+        for i in range(self.nl):
+            x[i] = self.m[i](x[i])  # conv
+            bs, _, ny, nx = x[i].shape  # x(bs,255,20,20) to x(bs,3,20,20,85)
+            x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
+            if self.dynamic or self.grid[i].shape[2:4] != x[i].shape[2:4]:
+                self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)
+
+            bi, ai, yi, xi = (x[i][..., 4] > t).nonzero(as_tuple=True)  # surviving cells
+            xy, wh, conf = x[i][bi, ai, yi, xi].sigmoid().split((2, 2, self.nc + 1), 1)
+            xy = (xy * 2 + self.grid[i][0, ai, yi, xi]) * self.stride[i]  # xy
+            wh = (wh * 2) ** 2 * self.anchor_grid[i][0, ai, yi, xi]  # wh
+            z.append(torch.cat((xy, wh, conf), 1))
+            b.append(bi)
+        z, b = torch.cat(z, 0), torch.cat(b, 0)
+        return [z[b == j] for j in range(x[0].shape[0])], x
+
     def _make_grid(self, nx=20, ny=20, i=0, torch_1_10=check_version(torch.__version__, '1.10.0')):
         d = self.anchors[i].device
         t = self.anchors[i].dtype
@@ -174,8 +200,8 @@ class BaseModel(nn.Module):
 
 class DetectionModel(BaseModel):
     # YOLOv5 detection model
-    # model, input channels, number of classes
-    def __init__(self, cfg='yolov5s.yaml', ch=3, nc=None, anchors=None):
+    # model, input channels, number of classes, strides (known strides, i.e. saved with the weights, skip the probe)
+    def __init__(self, cfg='yolov5s.yaml', ch=3, nc=None, anchors=None, stride=None):
         super().__init__()
         if isinstance(cfg, dict):
             self.yaml = cfg  # model dict
@@ -207,10 +233,13 @@ class DetectionModel(BaseModel):
             m.inplace = self.inplace
             def forward(x): return self.forward(
                 x)[0] if isinstance(m, Segment) else self.forward(x)
-            m.stride = torch.tensor(
-                [s / x.shape[-2] for x in forward(torch.zeros(1, ch, s, s))])  # forward
-            check_anchor_order(m)
-            m.anchors /= m.stride.view(-1, 1, 1)
+            if stride is None:
+                m.stride = torch.tensor(
+                    [s / x.shape[-2] for x in forward(torch.zeros(1, ch, s, s))])  # forward
+                check_anchor_order(m)
+                m.anchors /= m.stride.view(-1, 1, 1)
+            else:  # anchors are loaded with the weights, already in stride units
+                m.stride = torch.tensor(stride, device='cpu')
             self.stride = m.stride
             self._initialize_biases()  # only run once
 
@@ -345,15 +374,15 @@ def parse_model(d, ch):  # model_dict, input_channels(3)
                 args[j] = eval(a) if isinstance(a, str) else a  # eval strings
 
         n = n_ = max(round(n * gd), 1) if n > 1 else n  # depth gain
-        if m in {
-                Conv, GhostConv, Bottleneck, GhostBottleneck, SPP, SPPF, DWConv, MixConv2d, Focus, CrossConv,
-                BottleneckCSP, C3, C3TR, C3SPP, C3Ghost, nn.ConvTranspose2d, DWConvTranspose2d, C3x}:
+        # GhostConv, GhostBottleneck, SPP, MixConv2d, Focus, CrossConv, BottleneckCSP, C3TR, C3SPP, C3Ghost,
+        # DWConvTranspose2d and C3x are commented out in models/common.py, so they are not listed here
+        if m in {Conv, Bottleneck, SPPF, DWConv, C3, nn.ConvTranspose2d}:
             c1, c2 = ch[f], args[0]
             if c2 != no:  # if not output
                 c2 = make_divisible(c2 * gw, 8)
 
             args = [c1, c2, *args[1:]]
-            if m in {BottleneckCSP, C3, C3TR, C3Ghost, C3x}:
+            if m is C3:
                 args.insert(2, n)  # number of repeats
                 n = 1
         elif m is nn.BatchNorm2d:
@@ -367,10 +396,10 @@ def parse_model(d, ch):  # model_dict, input_channels(3)
                 args[1] = [list(range(args[1] * 2))] * len(f)
             if m is Segment:
                 args[3] = make_divisible(args[3] * gw, 8)
-        elif m is Contract:
-            c2 = ch[f] * args[0] ** 2
-        elif m is Expand:
-            c2 = ch[f] // args[0] ** 2
+        # elif m is Contract:
+        #     c2 = ch[f] * args[0] ** 2
+        # elif m is Expand:
+        #     c2 = ch[f] // args[0] ** 2
         else:
             c2 = ch[f]
 
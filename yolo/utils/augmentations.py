@@ -3,16 +3,25 @@
 Image augmentation functions
 """
 
+from functools import lru_cache
 
 import cv2
 import numpy as np
 
 
-def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
+@lru_cache(maxsize=16)
+def letterbox_params(shape, new_shape=(640, 640), auto=True, scaleFill=False, scaleup=True, stride=32):
     """
-    ストライドマルチの制約を満たしながら画像のサイズ変更とパディングを行う.
+    letterboxの変形(リサイズ後のサイズ, 比率, パディング)を計算する.
+
+    入力画像のサイズごとに一度だけ計算し、結果をキャッシュする。
+    Returns:
+        new_unpad: リサイズ後のサイズ(幅, 高さ)
+        ratio: 比率(幅, 高さ)
+        (dw, dh): 片側のパディング
+        border: 上下左右のパディング(top, bottom, left, right)
     """
-    shape = im.shape[:2]  # current shape [height, width]
+    shape = tuple(shape[:2])  # current shape [height, width]
     if isinstance(new_shape, int):
         new_shape = (new_shape, new_shape)
 
@@ -37,10 +46,57 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleF
     dw /= 2  # divide padding into 2 sides
     dh /= 2
 
-    if shape[::-1] != new_unpad:  # resize
-        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
     top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
     left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return new_unpad, ratio, (dw, dh), (top, bottom, left, right)
+
+
+def letterbox_shape(params):
+    """
+    letterbox_paramsの結果からletterbox後の画像サイズ(高さ, 幅)を返す.
+    """
+    (w, h), _, _, (top, bottom, left, right) = params
+    return h + top + bottom, w + left + right
+
+
+def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
+    """
+    ストライドマルチの制約を満たしながら画像のサイズ変更とパディングを行う.
+    """
+    new_unpad, ratio, (dw, dh), (top, bottom, left, right) = letterbox_params(
+        im.shape[:2], tuple(new_shape) if isinstance(new_shape, list) else new_shape,
+        auto, scaleFill, scaleup, stride)
+
+    if im.shape[1::-1] != new_unpad:  # resize
+        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
     im = cv2.copyMakeBorder(im, top, bottom, left, right,
                             cv2.BORDER_CONSTANT, value=color)  # add border
     return im, ratio, (dw, dh)
+
+
+def letterbox_into(im, out, params, color=(114, 114, 114)):
+    """
+    letterboxと同じ画像を推論用のテンソルとして直接outに書き込む.
+
+    リサイズ, BGR -> RGB以外はHWC -> CHW, 0 - 255 -> 0.0 - 1.0の変換を1回の走査で行い、
+    パディングは上下左右の余白だけを埋める(中間の画像を作らない)。
+    Args:
+        im: BGR画像(uint8)
+        out: 書き込み先のfloat32配列(3, 高さ, 幅). ストライドは任意(channels-lastも可)
+        params: letterbox_paramsの結果
+    """
+    new_unpad, _, _, (top, bottom, left, right) = params
+    if im.shape[1::-1] != new_unpad:  # resize
+        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(im, cv2.COLOR_BGR2RGB, dst=im)  # BGR to RGB (in place)
+    else:
+        im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)  # BGR to RGB
+    h, w = out.shape[1:]
+    # HWC to CHW, 0 - 255 to 0.0 - 1.0 (numpy's reversed-stride views are slow, so the channel swap is done by cv2)
+    np.divide(im.transpose(2, 0, 1), np.float32(255),
+              out=out[:, top:h - bottom, left:w - right], dtype=np.float32)
+    for c, v in enumerate(color[::-1]):  # add border
+        v = np.float32(v) / np.float32(255)
+        out[c, :top], out[c, h - bottom:] = v, v
+        out[c, top:h - bottom, :left], out[c, top:h - bottom, w - right:] = v, v
+    return out
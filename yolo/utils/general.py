@@ -30,7 +30,6 @@ from zipfile import ZipFile, is_zipfile
 
 import cv2
 import numpy as np
-import pandas as pd
 import pkg_resources as pkg
 import torch
 import torchvision
@@ -43,6 +42,7 @@ from utils.downloads import curl_download
 # from utils.downloads import curl_download, gsutil_getsize
 # from utils.metrics import box_iou, fitness
 from utils.metrics import box_iou
+from utils.nms import nms_numpy
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[1]  # YOLOv5 root directory
@@ -58,7 +58,6 @@ FONT = 'Arial.ttf'  # https://ultralytics.com/assets/Arial.ttf
 
 torch.set_printoptions(linewidth=320, precision=5, profile='long')
 np.set_printoptions(linewidth=320, formatter={'float_kind': '{:11.5g}'.format})  # format short g, %precision=5
-pd.options.display.max_columns = 10
 cv2.setNumThreads(0)  # prevent OpenCV from multithreading (incompatible with PyTorch DataLoader)
 os.environ['NUMEXPR_MAX_THREADS'] = str(NUM_THREADS)  # NumExpr max threads
 os.environ['OMP_NUM_THREADS'] = '1' if platform.system() == 'darwin' else str(NUM_THREADS)  # OpenMP (PyTorch and SciPy)
@@ -542,6 +541,13 @@ def clip_segments(segments, shape):
         segments[:, 1] = segments[:, 1].clip(0, shape[0])  # y
 
 
+def nms_small(x, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, max_det=300, max_wh=7680):
+    # Lightweight NMS of one image's few (n,5+nc) candidates in NumPy (best class only, no masks), same output as the
+    # general path. For a few dozen boxes the per-op dispatch of torch/torchvision costs more than the work itself
+    y = nms_numpy(x.cpu().numpy(), conf_thres, iou_thres, classes, agnostic, max_det, max_wh)
+    return torch.from_numpy(y).to(x.device)
+
+
 def non_max_suppression(
         prediction,
         conf_thres=0.25, # 信頼度の閾値
@@ -552,9 +558,13 @@ def non_max_suppression(
         labels=(), # 自動ラベリング時のラベル情報
         max_det=300, # 保持する最大検出数
         nm=0,  # マスクの数
+        fast_max=32,  # 候補がこの数以下の場合、torchvisionを使わない軽量なNMSを使う(0の場合、使わない)
 ):
     """Non-Maximum Suppression (NMS) on inference results to reject overlapping detections
 
+    prediction may also be a list of (n,5+nc+nm) candidate tensors per image, i.e. the output of a confidence-gated
+    Detect head (Detect.conf_thres)
+
     Returns:
          list of detections, on (n,6) tensor per image [xyxy, conf, cls]
     """
@@ -562,16 +572,22 @@ def non_max_suppression(
     # Checks
     assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
     assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
-    if isinstance(prediction, (list, tuple)):  # YOLOv5 model in validation model, output = (inference_out, loss_out)
+    if isinstance(prediction, (list, tuple)) and not (isinstance(prediction[0], torch.Tensor) and
+                                                      prediction[0].dim() == 2):
+        # YOLOv5 model in validation model, output = (inference_out, loss_out)
         prediction = prediction[0]  # select only inference output
+    if isinstance(prediction, torch.Tensor):
+        xc = prediction[..., 4] > conf_thres  # candidates
+        prediction = [x[xc[xi]] for xi, x in enumerate(prediction)]
+    else:  # candidates per image
+        prediction = [x[x[:, 4] > conf_thres] for x in prediction]
 
-    device = prediction.device
+    device = prediction[0].device
     mps = 'mps' in device.type  # Apple MPS
     if mps:  # MPS not fully supported yet, convert tensors to CPU before NMS
-        prediction = prediction.cpu()
-    bs = prediction.shape[0]  # batch size
-    nc = prediction.shape[2] - nm - 5  # number of classes
-    xc = prediction[..., 4] > conf_thres  # candidates
+        prediction = [x.cpu() for x in prediction]
+    bs = len(prediction)  # batch size
+    nc = prediction[0].shape[1] - nm - 5  # number of classes
 
     # Settings
     # min_wh = 2  # (pixels) minimum box width and height
@@ -584,11 +600,15 @@ def non_max_suppression(
 
     t = time.time()
     mi = 5 + nc  # mask start index
-    output = [torch.zeros((0, 6 + nm), device=prediction.device)] * bs
+    output = [torch.zeros((0, 6 + nm), device=device)] * bs
     for xi, x in enumerate(prediction):  # image index, image inference
         # Apply constraints
         # x[((x[..., 2:4] < min_wh) | (x[..., 2:4] > max_wh)).any(1), 4] = 0  # width-height
-        x = x[xc[xi]]  # confidence
+
+        # Lightweight path for a few candidates, e.g. max_det=10 with 3 classes
+        if 0 < x.shape[0] <= fast_max and not (labels or nm or multi_label or merge):
+            output[xi] = nms_small(x, conf_thres, iou_thres, classes, agnostic, max_det, max_wh).to(device)
+            continue
 
         # Cat apriori labels if autolabelling
         if labels and len(labels[xi]):
@@ -0,0 +1,35 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+NumPy non-maximum suppression (no torch import, shared by the PyTorch and OpenCV DNN paths)
+"""
+
+import numpy as np
+
+
+def nms_numpy(a, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, max_det=300, max_wh=7680):
+    # NMS of one image's (n,5+nc) candidates [x, y, w, h, obj_conf, cls_conf...] in NumPy (best class only, no masks)
+    # Returns (n,6) float32 detections [xyxy, conf, cls] sorted by confidence, same as the torchvision path
+    scores = a[:, 5:] * a[:, 4:5]  # conf = obj_conf * cls_conf
+    j = scores.argmax(1)
+    conf = scores[np.arange(len(a)), j]
+    i = conf > conf_thres
+    if classes is not None:
+        i &= np.isin(j, classes)
+    i = np.flatnonzero(i)
+    i = i[np.argsort(-conf[i], kind='stable')]  # sort by confidence
+    xywh, conf, j = a[i, :4], conf[i], j[i].astype(np.float32)
+    box = np.concatenate((xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2), 1)  # xywh to xyxy
+
+    b = box + j[:, None] * (0 if agnostic else max_wh)  # boxes (offset by class)
+    area = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    inter = (np.minimum(b[:, None, 2:], b[:, 2:]) - np.maximum(b[:, None, :2], b[:, :2])).clip(0).prod(2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        over = inter / (area[:, None] + area - inter) > iou_thres  # iou > iou_thres
+    keep, alive = [], np.ones(len(b), dtype=bool)
+    while len(keep) < max_det and alive.any():  # greedy, one iteration per kept box
+        k = alive.argmax()  # highest confidence remaining
+        keep.append(k)
+        alive &= ~over[k]
+        alive[k] = False
+    keep = np.array(keep, dtype=np.int64)
+    return np.concatenate((box[keep], conf[keep, None], j[keep, None]), 1).astype(np.float32)
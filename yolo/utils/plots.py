@@ -9,10 +9,10 @@ Plotting utils
 # from copy import copy
 from pathlib import Path
 
-# import cv2
+import cv2
 # import matplotlib
 # import matplotlib.pyplot as plt
-# import numpy as np
+import numpy as np
 # import pandas as pd
 # import seaborn as sn
 # import torch
@@ -48,7 +48,38 @@ class Colors:
         return tuple(int(h[1 + i:1 + i + 2], 16) for i in (0, 2, 4))
 
 
-# colors = Colors()  # create instance for 'from utils.plots import colors'
+colors = Colors()  # create instance for 'from utils.plots import colors'
+
+
+class Annotator:
+    # YOLOv5 Annotator for detect inference annotations, cv2 only (replaces ultralytics.utils.plotting.Annotator)
+    def __init__(self, im, line_width=None):
+        assert im.data.contiguous, 'Image not contiguous. Apply np.ascontiguousarray(im) to Annotator() input images.'
+        self.im = im
+        self.lw = line_width or max(round(sum(im.shape) / 2 * 0.003), 2)  # line width
+        self.tf = max(self.lw - 1, 1)  # font thickness
+        self.sf = self.lw / 3  # font scale
+
+    def box_label(self, box, label='', color=(128, 128, 128), txt_color=(255, 255, 255)):
+        # Add one xyxy box to image with label
+        p1, p2 = (int(box[0]), int(box[1])), (int(box[2]), int(box[3]))
+        cv2.rectangle(self.im, p1, p2, color, thickness=self.lw, lineType=cv2.LINE_AA)
+        if label:
+            w, h = cv2.getTextSize(label, 0, fontScale=self.sf, thickness=self.tf)[0]  # text width, height
+            outside = p1[1] - h >= 3  # label fits outside box
+            p2 = p1[0] + w, p1[1] - h - 3 if outside else p1[1] + h + 3
+            cv2.rectangle(self.im, p1, p2, color, -1, cv2.LINE_AA)  # filled
+            cv2.putText(self.im,
+                        label, (p1[0], p1[1] - 2 if outside else p1[1] + h + 2),
+                        0,
+                        self.sf,
+                        txt_color,
+                        thickness=self.tf,
+                        lineType=cv2.LINE_AA)
+
+    def result(self):
+        # Return annotated image as array
+        return np.asarray(self.im)
 
 
 def feature_visualization(x, module_type, stage, n=32, save_dir=Path('runs/detect/exp')):
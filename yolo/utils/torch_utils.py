@@ -19,7 +19,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 # from torch.nn.parallel import DistributedDataParallel as DDP
 
-from utils.general import check_version
+from utils.general import LOGGER, check_version
 # from utils.general import LOGGER, check_version, colorstr, file_date, git_describe
 
 # https://pytorch.org/docs/stable/elastic/run.html
@@ -243,6 +243,92 @@ def fuse_conv_and_bn(conv, bn): # 必要
     return fusedconv
 
 
+class _ForwardOnce(nn.Module):
+    # Single-scale inference wrapper so FX traces model._forward_once(x) without the augment/profile flags
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model._forward_once(x)
+
+
+def quantize_model(model, images, backend='x86'):
+    # Post-training static INT8 quantization of a fused YOLOv5 model, calibrated on images [(1,3,h,w) tensor, ...]
+    # The Detect head (grid/anchor decoding) stays FP32 and receives dequantized feature maps
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    assert images, 'quantize_model() requires calibration images'
+    torch.backends.quantized.engine = backend
+    prepare_config = PrepareCustomConfig().set_non_traceable_module_classes([type(model.model[-1])])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # torch.ao.quantization deprecation notices
+        prepared = prepare_fx(_ForwardOnce(deepcopy(model).eval()),
+                              get_default_qconfig_mapping(backend), (images[0], ),
+                              prepare_custom_config=prepare_config)
+        with torch.no_grad():
+            for im in images:
+                prepared(im)  # calibrate observers
+        qmodel = convert_fx(prepared)
+    for k in 'stride', 'names', 'yaml':
+        if hasattr(model, k):
+            setattr(qmodel, k, getattr(model, k))
+    return qmodel
+
+
+class InferenceModel(nn.Module):
+    # Inference-only forward path: inference mode, channels-last input/weights and optionally
+    # torch.jit.freeze (traced once per input shape) or torch.compile, falling back to eager mode on failure
+    modes = 'eager', 'freeze', 'compile'
+
+    def __init__(self, model, mode='eager', channels_last=True):
+        super().__init__()
+        assert mode in self.modes, f'invalid mode {mode}, valid modes are {self.modes}'
+        self.model = model.eval()
+        self.mode = mode
+        self.channels_last = channels_last
+        if channels_last:
+            self.model.to(memory_format=torch.channels_last)
+        self.frozen = {}  # input shape: frozen TorchScript module
+        self.compiled = None
+        if mode == 'compile':
+            if hasattr(torch, 'compile'):
+                self.compiled = torch.compile(self.model)  # compiled lazily on the first forward
+            else:
+                self._fallback(f'torch.compile() requires torch>=2.0, found {torch.__version__}')
+        for k in 'stride', 'names', 'yaml':
+            if hasattr(model, k):
+                setattr(self, k, getattr(model, k))
+
+    def _fallback(self, e):
+        LOGGER.warning(f'WARNING ⚠️ {self.mode} inference failed, falling back to eager mode: {e}')
+        self.mode = 'eager'
+
+    def _optimized(self, x):
+        if self.mode == 'compile':
+            return self.compiled(x)
+        key = tuple(x.shape)
+        if key not in self.frozen:  # Detect grids are baked in, so trace once per input shape
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')  # TracerWarning
+                traced = torch.jit.trace(self.model, x, strict=False, check_trace=False)
+                self.frozen[key] = torch.jit.freeze(traced.eval())
+        return self.frozen[key](x)
+
+    def forward(self, x, *args, **kwargs):
+        with torch.inference_mode():
+            if self.channels_last:
+                x = x.contiguous(memory_format=torch.channels_last)
+            if self.mode != 'eager' and not (args or kwargs):
+                try:
+                    return self._optimized(x)
+                except Exception as e:
+                    self._fallback(e)
+            return self.model(x, *args, **kwargs)
+
+
 def model_info(model, verbose=False, imgsz=640):
     pass
     """